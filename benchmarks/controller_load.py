@@ -0,0 +1,127 @@
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+from locker_controller import controller_service
+from locker_controller import lock_controls
+
+"""
+Load generator for the controller service.
+
+Starts the daemon in its own process with simulated ports, then runs several client processes against it, each
+sending commands as fast as it gets replies back (batch > 1 pipelines that many requests per round trip).
+
+Run from the repository root:
+
+    python -m benchmarks.controller_load                              # 4 clients, 2 simulated ports
+    python -m benchmarks.controller_load --clients 16 --batch 8 -o load.json
+"""
+
+simulated_ports = ('LOAD_SIM0', 'LOAD_SIM1')
+
+
+def _client(socket_path: str, ports: tuple, requests: int, batch: int, results) -> None:
+    frames = [lock_controls.get_command_frame(1, lock_addr, 'QI')[1] for lock_addr in range(1, 25)]
+    latencies = []
+    failed = 0
+
+    with controller_service.ControllerClient(socket_path) as client:
+        sent = 0
+        while sent < requests:
+            count = min(batch, requests - sent)
+            batch_requests = [(ports[(sent + index) % len(ports)], frames[(sent + index) % len(frames)], 'QI')
+                              for index in range(count)]
+
+            start = time.perf_counter()
+            replies = client.send_commands(batch_requests)
+            latencies.append(time.perf_counter() - start)
+
+            failed += sum(1 for ok, reply in replies if not ok)
+            sent += count
+
+    results.put((latencies, failed))
+
+
+def _percentile(values: list, fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def run(clients: int = 4, requests: int = 5000, batch: int = 1, latency: float = 0.0) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        socket_path = os.path.join(tmp_dir, 'controller.sock')
+
+        service = multiprocessing.Process(target=_run_simulated_service, args=(socket_path, latency), daemon=True)
+        service.start()
+
+        if not controller_service.wait_for_service(socket_path):
+            service.terminate()
+            raise RuntimeError('Controller service did not start')
+
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=_client, args=(socket_path, simulated_ports, requests, batch, results))
+                   for _ in range(clients)]
+
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+
+        latencies = []
+        failed = 0
+        for _ in workers:
+            client_latencies, client_failed = results.get()
+            latencies.extend(client_latencies)
+            failed += client_failed
+
+        elapsed = time.perf_counter() - start
+
+        for worker in workers:
+            worker.join()
+
+        service.terminate()
+        service.join()
+
+    latencies.sort()
+    total = clients * requests
+
+    return {'clients': clients,
+            'requests_per_client': requests,
+            'batch': batch,
+            'bus_latency_ms': latency * 1e3,
+            'requests': total,
+            'failed': failed,
+            'seconds': elapsed,
+            'requests_per_sec': total / elapsed,
+            'round_trip_p50_ms': _percentile(latencies, 0.5) * 1e3,
+            'round_trip_p99_ms': _percentile(latencies, 0.99) * 1e3,
+            'round_trip_max_ms': latencies[-1] * 1e3 if latencies else 0.0}
+
+
+def _run_simulated_service(socket_path: str, latency: float) -> None:
+    from locker_controller import simulated_board
+
+    for port in simulated_ports:
+        simulated_board.install_simulated_port(port, boards=[1, 2], latency=latency)
+
+    controller_service.run_service(socket_path, simulated_ports)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the controller service against simulated ports.')
+    parser.add_argument('--clients', type=int, default=4, help='Client processes')
+    parser.add_argument('--requests', type=int, default=5000, help='Requests per client')
+    parser.add_argument('--batch', type=int, default=1, help='Requests pipelined per round trip')
+    parser.add_argument('--latency', type=float, default=0.0, help='Simulated board reply latency in seconds')
+    parser.add_argument('-o', '--output', help='JSON file to write results to')
+    args = parser.parse_args()
+
+    report = run(args.clients, args.requests, args.batch, args.latency)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    for name, value in report.items():
+        print('{:<22} {}'.format(name, round(value, 3) if isinstance(value, float) else value))
@@ -0,0 +1,45 @@
+import timeit
+
+from locker_controller import lock_controls
+
+"""
+Micro-benchmark: building UI/QI frames per call vs looking them up in the precomputed frame table.
+
+Run from the repository root:
+
+    python -m benchmarks.frame_table_bench
+"""
+
+iterations = 200000
+
+
+# The frame build that generate_unlock_code did on every call before the frame table existed
+def build_frame(header: int, board_addr: int, lock_addr: int, function_code: int) -> (bool, bytes):
+    check_code = lock_controls.generate_check_code(header=header,
+                                                   board_addr=board_addr,
+                                                   lock_addr=lock_addr,
+                                                   lock_state=function_code)
+    return True, bytes([header, board_addr, lock_addr, function_code, check_code[1]])
+
+
+def run() -> dict:
+    header = lock_controls.unlock_header
+    fxn = lock_controls.fxn_code_unlock
+
+    cases = {
+        'per_call_build': lambda: build_frame(header, 1, 17, fxn),
+        'generate_unlock_code': lambda: lock_controls.generate_unlock_code(header, 1, 17, fxn),
+        'get_command_frame': lambda: lock_controls.get_command_frame(1, 17, 'UI'),
+    }
+
+    # Best of 5 runs, in nanoseconds per call
+    return {name: min(timeit.repeat(case, number=iterations, repeat=5)) / iterations * 1e9
+            for name, case in cases.items()}
+
+
+if __name__ == '__main__':
+    results = run()
+    baseline = results['per_call_build']
+
+    for name, ns in results.items():
+        print('{:<22} {:>8.1f} ns/call  {:>5.2f}x'.format(name, ns, baseline / ns))
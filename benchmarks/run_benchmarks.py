@@ -0,0 +1,196 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import timeit
+
+from database import locker_db
+from benchmarks import frame_table_bench
+from locker_controller import access_control
+from locker_controller import frame_parser
+from locker_controller import lock_controls
+from locker_controller import simulated_board
+
+"""
+Benchmark suite for the controller and database hot paths.
+
+Run from the repository root:
+
+    python -m benchmarks.run_benchmarks                      # full run, results in benchmark_results.json
+    python -m benchmarks.run_benchmarks --quick -o out.json  # smaller tables, for a quick check
+
+Each result records how many operations ran, the best wall time and the derived ops/s and ns/op, together with the
+Python/SQLite/platform versions so results from different releases can be compared.
+"""
+
+simulated_port = 'BENCH_SIM'
+
+
+def result(ops: int, seconds: float) -> dict:
+    return {'ops': ops,
+            'seconds': seconds,
+            'ops_per_sec': ops / seconds if seconds else None,
+            'ns_per_op': seconds / ops * 1e9 if ops else None}
+
+
+# Best of repeat runs of number calls
+def time_calls(func, number: int, repeat: int = 5) -> dict:
+    return result(number, min(timeit.repeat(func, number=number, repeat=repeat)))
+
+
+def bench_frames(number: int) -> dict:
+    reply = b'\x80\x01\x01\x01\x01\x33\xb3'
+    header = lock_controls.unlock_header
+    fxn = lock_controls.fxn_code_unlock
+
+    results = {
+        'generate_check_code': time_calls(lambda: lock_controls.generate_check_code(header, 1, 17, fxn), number),
+        'generate_unlock_code': time_calls(lambda: lock_controls.generate_unlock_code(header, 1, 17, fxn), number),
+        'get_command_frame': time_calls(lambda: lock_controls.get_command_frame(1, 17, 'UI'), number),
+        'bytes_to_binary': time_calls(lambda: lock_controls.bytes_to_binary(reply), number),
+        'decode_door_mask': time_calls(lambda: lock_controls.decode_door_mask(reply), number),
+        'parse_reply': time_calls(lambda: frame_parser.parse_reply(reply), number),
+    }
+    results['frame_build_per_call'] = time_calls(lambda: frame_table_bench.build_frame(header, 1, 17, fxn), number)
+
+    return results
+
+
+def _employees(count: int) -> list:
+    return [("{:08d}".format(number), "Employee {}".format(number), number % 10) for number in range(count)]
+
+
+# New database file with count employees added through add_employee, returns (connection, add_employee result)
+def _populated_db(db_name: str, count: int):
+    locker_db.create_database(db_name)
+    conn = sqlite3.connect(db_name)
+    employees = _employees(count)
+
+    start = time.perf_counter()
+    locker_db.add_employee(conn.cursor(), employees)
+    return conn, result(count, time.perf_counter() - start)
+
+
+def bench_database(tmp_dir: str, sizes: list, lookups: int) -> dict:
+    results = {}
+
+    for size in sizes:
+        conn, results['add_employee_{}'.format(size)] = _populated_db(os.path.join(tmp_dir, 'add_{}.db'.format(size)),
+                                                                      size)
+
+        bulk_db = os.path.join(tmp_dir, 'bulk_{}.db'.format(size))
+        locker_db.create_database(bulk_db)
+        bulk_conn = sqlite3.connect(bulk_db)
+        employees = _employees(size)
+        start = time.perf_counter()
+        locker_db.add_employees_bulk(bulk_conn.cursor(), employees)
+        results['add_employees_bulk_{}'.format(size)] = result(size, time.perf_counter() - start)
+        bulk_conn.close()
+
+        cursor = conn.cursor()
+        ids = ["{:08d}".format(random.randrange(size)) for _ in range(lookups)]
+
+        start = time.perf_counter()
+        for emp_id in ids:
+            locker_db.get_employee(cursor, emp_id)
+        results['get_employee_{}'.format(size)] = result(lookups, time.perf_counter() - start)
+
+        locker_db.enable_employee_cache(max_size=size)
+        for emp_id in ids:
+            locker_db.get_employee(cursor, emp_id)
+
+        start = time.perf_counter()
+        for emp_id in ids:
+            locker_db.get_employee(cursor, emp_id)
+        results['get_employee_cached_{}'.format(size)] = result(lookups, time.perf_counter() - start)
+        locker_db.disable_employee_cache()
+
+        results['get_all_employees_{}'.format(size)] = time_calls(lambda: locker_db.get_all_employees(cursor), 1, 3)
+        results['iter_employees_{}'.format(size)] = time_calls(lambda: sum(1 for _ in
+                                                                          locker_db.iter_employees(cursor)), 1, 3)
+        conn.close()
+
+    return results
+
+
+def bench_end_to_end(tmp_dir: str, number: int) -> dict:
+    simulated_board.install_simulated_port(simulated_port, boards=[1, 2])
+
+    db_name = os.path.join(tmp_dir, 'unlock.db')
+    locker_db.create_database(db_name)
+    conn = sqlite3.connect(db_name)
+    cursor = conn.cursor()
+    locker_db.add_employee(cursor, [("1", "Bench Employee", 9)])
+    locker_db.add_locker(cursor, [(number, 1) for number in range(1, 49)])
+    locker_db.add_item(cursor, [("I{}".format(number), "Item", None, 1, number) for number in range(1, 49)])
+
+    frame = lock_controls.get_command_frame(1, 17, 'UI')[1]
+    items = ["I{}".format(random.randrange(1, 49)) for _ in range(number)]
+
+    try:
+        results = {
+            'send_command_simulated': time_calls(lambda: lock_controls.send_command(simulated_port, frame, 'UI'),
+                                                 number, 3),
+            'authorize_and_unlock_simulated': result(number, _timed_loop(
+                lambda item_id: access_control.authorize_and_unlock(cursor, simulated_port, "1", item_id), items)),
+        }
+        results['authorize_and_unlock_stages'] = access_control.unlock_latency_summary()
+        return results
+
+    finally:
+        conn.close()
+        simulated_board.remove_simulated_port(simulated_port)
+
+
+def _timed_loop(func, args: list) -> float:
+    start = time.perf_counter()
+    for arg in args:
+        func(arg)
+    return time.perf_counter() - start
+
+
+def run(quick: bool = False) -> dict:
+    sizes = [1000, 10000] if quick else [1000, 100000]
+
+    # Measure the code paths themselves, not the expected warnings (e.g. employees not found) they log
+    logging.getLogger('database').setLevel(logging.CRITICAL)
+    logging.getLogger('locker_controller').setLevel(logging.CRITICAL)
+    number = 10000 if quick else 100000
+
+    report = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+              'python': sys.version.split()[0],
+              'sqlite': sqlite3.sqlite_version,
+              'platform': platform.platform(),
+              'quick': quick,
+              'results': {}}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        report['results'].update(bench_frames(number))
+        report['results'].update(bench_database(tmp_dir, sizes, number // 10))
+        report['results'].update(bench_end_to_end(tmp_dir, number // 10))
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the controller and database hot paths.')
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help='JSON file to write results to')
+    parser.add_argument('--quick', action='store_true', help='Smaller tables and fewer iterations')
+    args = parser.parse_args()
+
+    report = run(args.quick)
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    for name, values in report['results'].items():
+        if 'ns_per_op' in values:
+            print('{:<36} {:>14.1f} ns/op {:>14.1f} ops/s'.format(name, values['ns_per_op'], values['ops_per_sec']))
+
+    print('Results written to {}'.format(args.output))
@@ -0,0 +1,273 @@
+import logging
+import sqlite3
+import threading
+from bisect import bisect_left, insort
+
+from database import locker_db
+
+logger = logging.getLogger(__name__)
+
+"""
+#--------------------ACCESS MATRIX--------------------#
+
+Precomputed answers to "which lockers/items can employee X open" and "which employees can open locker N", fast
+enough to call on every keystroke of a search box.
+
+Uses the same rule as locker_db.get_unlock_target: an employee can open a locker if max_perm_level >= the locker's
+locker_perm_level, and can get an item if max_perm_level >= both the item's min_perm_level and the perm level of the
+locker it is stored in (an item without a locker can't be opened). Whether an item is currently borrowed is not part
+of the matrix, that is checked at checkout.
+
+Employees, lockers and items are each kept in a list of (perm level, key) sorted with bisect, so every question is
+one bisect plus a slice. Locker and item lists per perm level are cached until a locker or item changes.
+
+Loaded once from the database, then kept up to date from locker_db write events: an employee's level change only
+moves that employee in the sorted list, a locker's level change re-sorts the items stored in it.
+
+Example:
+
+    matrix = AccessMatrix()
+    matrix.load(cursor)
+    matrix.attach()
+
+    matrix.lockers_for_employee("12345678")   # (1, 2, 5)
+    matrix.employees_for_locker(5)           # ['12345678', ...]
+
+#--------------------ACCESS MATRIX END--------------------#
+"""
+
+
+# Keys sorted by perm level, ties broken by key
+class SortedLevels:
+    __slots__ = ('entries', 'level_of')
+
+    def __init__(self):
+        self.entries = []
+        self.level_of = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def set(self, key, level: int) -> None:
+        if self.level_of.get(key) == level:
+            return
+
+        self.discard(key)
+        insort(self.entries, (level, key))
+        self.level_of[key] = level
+
+    def discard(self, key) -> None:
+        level = self.level_of.pop(key, None)
+
+        if level is not None:
+            del self.entries[bisect_left(self.entries, (level, key))]
+
+    # Keys with a level <= level, lowest level first
+    def at_most(self, level: int) -> list:
+        return [key for entry_level, key in self.entries[:bisect_left(self.entries, (level + 1,))]]
+
+    # Keys with a level >= level, lowest level first, at most limit of them
+    def at_least(self, level: int, limit: int = None) -> list:
+        start = bisect_left(self.entries, (level,))
+        end = None if limit is None else start + limit
+        return [key for entry_level, key in self.entries[start:end]]
+
+    def count_at_least(self, level: int) -> int:
+        return len(self.entries) - bisect_left(self.entries, (level,))
+
+
+class AccessMatrix:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.employees = SortedLevels()
+        self.lockers = SortedLevels()
+        # Items keyed by the level needed to get them, max(min_perm_level, locker_perm_level)
+        self.items = SortedLevels()
+
+        # item_id -> (min_perm_level, locker_number) and locker_number -> item_ids, to re-key items when a locker moves
+        self._item_details = {}
+        self._locker_items = {}
+
+        # perm level -> sorted locker numbers / item IDs that level can open
+        self._lockers_by_level = {}
+        self._items_by_level = {}
+
+    def load(self, cursor: sqlite3.Cursor) -> bool:
+        try:
+            employees = cursor.execute("SELECT id, max_perm_level FROM employees").fetchall()
+            lockers = cursor.execute("SELECT locker_number, locker_perm_level FROM locker_doors").fetchall()
+            items = cursor.execute("SELECT item_id, min_perm_level, locker_number FROM items").fetchall()
+
+        except sqlite3.Error as e:
+            logger.error("Error has occurred! %s", e)
+            return False
+
+        with self.lock:
+            self._reset()
+
+            for emp_id, level in employees:
+                self.employees.set(emp_id, level)
+            for locker_number, level in lockers:
+                self.lockers.set(locker_number, level)
+            for item_id, min_perm_level, locker_number in items:
+                self._set_item(item_id, min_perm_level, locker_number)
+
+        return True
+
+    # Follow the writes made through locker_db from now on
+    def attach(self) -> None:
+        locker_db.add_write_listener(self.apply_write)
+
+    def detach(self) -> None:
+        locker_db.remove_write_listener(self.apply_write)
+
+    '''
+    ------------------------------UPDATES------------------------------
+    '''
+
+    def _rekey_item(self, item_id: str) -> None:
+        min_perm_level, locker_number = self._item_details[item_id]
+        locker_level = self.lockers.level_of.get(locker_number)
+
+        if locker_level is None:
+            self.items.discard(item_id)
+        else:
+            self.items.set(item_id, max(min_perm_level, locker_level))
+
+    def _set_item(self, item_id: str, min_perm_level: int, locker_number: int) -> None:
+        self._remove_item(item_id)
+        self._item_details[item_id] = (min_perm_level, locker_number)
+
+        if locker_number is not None:
+            self._locker_items.setdefault(locker_number, set()).add(item_id)
+
+        self._rekey_item(item_id)
+
+    def _remove_item(self, item_id: str) -> None:
+        details = self._item_details.pop(item_id, None)
+        if details is None:
+            return
+
+        self.items.discard(item_id)
+        item_ids = self._locker_items.get(details[1])
+
+        if item_ids is not None:
+            item_ids.discard(item_id)
+            if not item_ids:
+                del self._locker_items[details[1]]
+
+    def _locker_changed(self, locker_number: int) -> None:
+        for item_id in self._locker_items.get(locker_number, ()):
+            self._rekey_item(item_id)
+
+    # locker_db write listener
+    def apply_write(self, event) -> None:
+        with self.lock:
+            if event.table == 'employees':
+                if event.action in ('insert', 'update'):
+                    for emp_id, name, level in event.rows:
+                        self.employees.set(emp_id, level)
+                elif event.action == 'delete':
+                    for emp_id, in event.rows:
+                        self.employees.discard(emp_id)
+                elif event.action == 'wipe':
+                    self.employees = SortedLevels()
+
+                # Nothing cached depends on employees
+                return
+
+            if event.table == 'locker_doors':
+                if event.action in ('insert', 'update'):
+                    for locker_number, level in event.rows:
+                        self.lockers.set(locker_number, level)
+                        self._locker_changed(locker_number)
+                elif event.action == 'delete':
+                    for locker_number, in event.rows:
+                        self.lockers.discard(locker_number)
+                        self._locker_changed(locker_number)
+                elif event.action == 'wipe':
+                    self.lockers = SortedLevels()
+                    self.items = SortedLevels()
+
+            elif event.table == 'items':
+                if event.action in ('insert', 'update'):
+                    for item_id, name, description, min_perm_level, locker_number in event.rows:
+                        self._set_item(item_id, min_perm_level, locker_number)
+                elif event.action == 'delete':
+                    for item_id, in event.rows:
+                        self._remove_item(item_id)
+                elif event.action == 'wipe':
+                    self.items = SortedLevels()
+                    self._item_details = {}
+                    self._locker_items = {}
+                else:
+                    # checkout / return don't change who may open what
+                    return
+
+            else:
+                return
+
+            self._lockers_by_level = {}
+            self._items_by_level = {}
+
+    '''
+    ------------------------------READS------------------------------
+    '''
+
+    # Sorted locker numbers an employee with this perm level can open, the cached tuple is shared between callers
+    def lockers_for_level(self, level: int) -> tuple:
+        with self.lock:
+            lockers = self._lockers_by_level.get(level)
+
+            if lockers is None:
+                lockers = self._lockers_by_level[level] = tuple(sorted(self.lockers.at_most(level)))
+
+            return lockers
+
+    # Sorted item IDs an employee with this perm level can get
+    def items_for_level(self, level: int) -> tuple:
+        with self.lock:
+            items = self._items_by_level.get(level)
+
+            if items is None:
+                items = self._items_by_level[level] = tuple(sorted(self.items.at_most(level)))
+
+            return items
+
+    # Employee IDs with at least this perm level, lowest level first. limit caps the list for paged UI results,
+    # count_employees_for_level gives the total without building it.
+    def employees_for_level(self, level: int, limit: int = None) -> list:
+        with self.lock:
+            return self.employees.at_least(level, limit)
+
+    def count_employees_for_level(self, level: int) -> int:
+        with self.lock:
+            return self.employees.count_at_least(level)
+
+    # Perm level of an employee, None if unknown
+    def employee_level(self, emp_id: str):
+        return self.employees.level_of.get(emp_id)
+
+    def lockers_for_employee(self, emp_id: str) -> tuple:
+        level = self.employee_level(emp_id)
+        return () if level is None else self.lockers_for_level(level)
+
+    def items_for_employee(self, emp_id: str) -> tuple:
+        level = self.employee_level(emp_id)
+        return () if level is None else self.items_for_level(level)
+
+    def employees_for_locker(self, locker_number: int, limit: int = None) -> list:
+        level = self.lockers.level_of.get(locker_number)
+        return [] if level is None else self.employees_for_level(level, limit)
+
+    def employees_for_item(self, item_id: str, limit: int = None) -> list:
+        level = self.items.level_of.get(item_id)
+        return [] if level is None else self.employees_for_level(level, limit)
+
+    def can_open_locker(self, emp_id: str, locker_number: int) -> bool:
+        level = self.employee_level(emp_id)
+        locker_level = self.lockers.level_of.get(locker_number)
+        return level is not None and locker_level is not None and level >= locker_level
@@ -2,8 +2,18 @@ import sqlite3
 from sqlite3 import Error
 import os
 import logging
+import csv
+import itertools
+import json
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
 
-logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO, filename='database.log')
+from telemetry import metrics
+
+# Log output is set up by the application, see telemetry.metrics.configure_logging
+logger = logging.getLogger(__name__)
 
 
 def isSqlite3Db(db: str) -> bool:
@@ -30,6 +40,57 @@ def isSqlite3Db(db: str) -> bool:
     return header[:16] == b'SQLite format 3\x00'
 
 
+# What does employee X hold / what is in locker N
+items_held_by_employee_statement = "SELECT item_id, name, locker_number FROM items WHERE borrowed_by = ?"
+items_in_locker_statement = "SELECT item_id, name, borrowed_by FROM items WHERE locker_number = ?"
+
+
+# Create any missing tables and indexes on an open cursor, does not commit
+def _create_tables(cursor: sqlite3.Cursor) -> None:
+    # Create table for employees
+    cursor.execute(
+        '''CREATE TABLE IF NOT EXISTS employees (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            max_perm_level INTEGER NOT NULL
+        )'''
+    )
+
+    # Create table for locker doors
+    cursor.execute(
+        '''CREATE TABLE IF NOT EXISTS locker_doors (
+            locker_number INTEGER PRIMARY KEY,
+            locker_perm_level INTEGER NOT NULL
+        )'''
+    )
+
+    # Create table for items
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS items (
+            item_id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            description TEXT,
+            min_perm_level INTEGER NOT NULL,
+            borrowed_by TEXT,
+            locker_number INTEGER,
+            FOREIGN KEY(borrowed_by) REFERENCES employees(id),
+            FOREIGN KEY(locker_number) REFERENCES locker_doors(locker_number)
+        )
+    ''')
+
+    # Covering indexes for the hot item lookups (items_held_by_employee_statement / items_in_locker_statement).
+    # idx_items_borrowed_by is also what SQLite uses for the foreign key check when an employee is removed.
+    # IF NOT EXISTS means running this on an older database file adds the indexes to it.
+    cursor.execute(
+        '''CREATE INDEX IF NOT EXISTS idx_items_borrowed_by
+            ON items(borrowed_by, item_id, name, locker_number)'''
+    )
+    cursor.execute(
+        '''CREATE INDEX IF NOT EXISTS idx_items_locker_number
+            ON items(locker_number, item_id, name, borrowed_by)'''
+    )
+
+
 def create_database(db_name: str) -> bool:
     try:
         # Connect to the SQLite database (or create it if it doesn't exist)
@@ -38,36 +99,7 @@ def create_database(db_name: str) -> bool:
         # Create a cursor object to access database functions
         cursor = conn.cursor()
 
-        # Create table for employees
-        cursor.execute(
-            '''CREATE TABLE IF NOT EXISTS employees (
-                id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                max_perm_level INTEGER NOT NULL
-            )'''
-        )
-
-        # Create table for locker doors
-        cursor.execute(
-            '''CREATE TABLE IF NOT EXISTS locker_doors (
-                locker_number INTEGER PRIMARY KEY,
-                locker_perm_level INTEGER NOT NULL
-            )'''
-        )
-
-        # Create table for items
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS items (
-                item_id TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                description TEXT,
-                min_perm_level INTEGER NOT NULL,
-                borrowed_by TEXT,
-                locker_number INTEGER,
-                FOREIGN KEY(borrowed_by) REFERENCES employees(id),
-                FOREIGN KEY(locker_number) REFERENCES locker_doors(locker_number)
-            )
-        ''')
+        _create_tables(cursor)
 
         # Commit the changes and close the connection
         conn.commit()
@@ -76,12 +108,11 @@ def create_database(db_name: str) -> bool:
         return True
 
     except sqlite3.OperationalError:
-        print("Database already initialized.\n")
+        logger.warning("Database already initialized.")
         return False
 
     except sqlite3.Error as e:
-        print("Fatal error has occurred! Check logs.")
-        print(e)
+        logger.error("Fatal error has occurred! %s", e)
         return False
 
 
@@ -93,12 +124,352 @@ def wipe_table(db_name: str, table: str) -> None:
     db_conn.commit()
     db_conn.close()
 
+    if table == 'employees':
+        _employees_changed()
+
+    _notify_write(None, table, 'wipe', [])
+
+
+# Return the detail column of EXPLAIN QUERY PLAN for a statement, e.g. ['SEARCH items USING COVERING INDEX ...']
+# Used to check that the hot queries are served by an index and not a full table scan
+def explain_query_plan(cursor: sqlite3.Cursor, statement: str, parameters: tuple = ()) -> list:
+    return [row[3] for row in cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()]
+
+
+'''
+------------------------------CONNECTION MANAGER------------------------------
+'''
+
+
+# Connection class handed out by LockerDB
+# Inside a LockerDB.batch() scope commit() is held back until the outermost scope exits, so the CRUD functions
+# (which commit after every operation) can be grouped into one transaction and one fsync.
+class LockerConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_depth = 0
+        self.batch_rolled_back = False
+        # Write events and employee cache invalidations held back until the batch commits
+        self.pending_writes = []
+        self.pending_invalidations = []
+
+    def commit(self) -> None:
+        if self.batch_depth == 0:
+            super().commit()
+
+    # A rollback inside a batch (e.g. add_employee rejecting a row) throws away the whole batch
+    def rollback(self) -> None:
+        if self.batch_depth > 0:
+            self.batch_rolled_back = True
+            self.pending_writes = []
+            self.pending_invalidations = []
+
+        super().rollback()
+
+
+# Shared entry point to one locker DB file for multi-threaded use (e.g. several checkout stations)
+# - WAL journal so readers don't block the writer and vice versa
+# - synchronous=NORMAL, in WAL mode this only fsyncs at checkpoints instead of on every commit
+# - a larger per-connection prepared statement cache
+# - one connection per thread, created on first use and reused after that
+#
+# Example:
+#     ldb = LockerDB("locker.db")
+#     add_employee(ldb.cursor(), [("12345", "Jake Enoch", 5)])
+#
+#     with ldb.batch() as cursor:
+#         add_employee(cursor, [("123", "John Enoch", 4)])
+#         update_employee(cursor, "12345", ("Jake Enoch", 6))
+class LockerDB:
+    def __init__(self, db_name: str, statement_cache_size: int = 256, busy_timeout: float = 5.0,
+                 foreign_keys: bool = True):
+        self.db_name = db_name
+        self.statement_cache_size = statement_cache_size
+        self.busy_timeout = busy_timeout
+        self.foreign_keys = foreign_keys
+
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+    # This thread's connection, opened on first use
+    def connection(self) -> LockerConnection:
+        conn = getattr(self._local, 'conn', None)
+
+        if conn is None:
+            # check_same_thread is off only so close() can close every thread's connection,
+            # each connection is still only ever used by the thread that opened it
+            conn = sqlite3.connect(self.db_name,
+                                   timeout=self.busy_timeout,
+                                   factory=LockerConnection,
+                                   cached_statements=self.statement_cache_size,
+                                   check_same_thread=False)
+
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute('PRAGMA foreign_keys = {}'.format('ON' if self.foreign_keys else 'OFF'))
+
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+
+        return conn
+
+    def cursor(self) -> sqlite3.Cursor:
+        return self.connection().cursor()
+
+    # Batched commit scope, everything done with the cursor is committed once when the outermost scope exits
+    # and rolled back if an exception escapes any scope. If one of the CRUD functions rolled back inside the scope,
+    # or an exception escaped a nested scope and was caught by the outer one, the batch is discarded and
+    # sqlite3.DatabaseError is raised on exit so the caller knows nothing was saved.
+    @contextmanager
+    def batch(self):
+        conn = self.connection()
+        conn.batch_depth += 1
+
+        try:
+            yield conn.cursor()
+
+        except BaseException:
+            conn.batch_depth -= 1
+            if conn.batch_depth == 0:
+                conn.batch_rolled_back = False
+                conn.pending_writes = []
+                conn.pending_invalidations = []
+                sqlite3.Connection.rollback(conn)
+            else:
+                # The outer scope may catch the exception, the whole batch is discarded all the same
+                conn.rollback()
+            raise
+
+        conn.batch_depth -= 1
+
+        if conn.batch_depth == 0:
+            if conn.batch_rolled_back:
+                conn.batch_rolled_back = False
+                conn.pending_writes = []
+                conn.pending_invalidations = []
+                sqlite3.Connection.rollback(conn)
+                raise sqlite3.DatabaseError("Batch was rolled back by one of its operations, nothing was committed.")
+
+            conn.commit()
+
+            invalidations, conn.pending_invalidations = conn.pending_invalidations, []
+            for emp_ids in invalidations:
+                _employees_changed(emp_ids)
+
+            events, conn.pending_writes = conn.pending_writes, []
+            _dispatch_writes(events)
+
+    def create_database(self) -> bool:
+        try:
+            with self.batch() as cursor:
+                _create_tables(cursor)
+            return True
+
+        except sqlite3.Error as e:
+            logger.error("Fatal error has occurred! %s", e)
+            return False
+
+    def wipe_table(self, table: str) -> None:
+        with self.batch() as cursor:
+            cursor.execute(f'DELETE FROM {table}')
+
+        if table == 'employees':
+            _employees_changed()
+
+        _notify_write(None, table, 'wipe', [])
+
+    # Close every connection handed out by this manager
+    def close(self) -> None:
+        with self._connections_lock:
+            connections = self._connections
+            self._connections = []
+
+        for conn in connections:
+            conn.close()
+
+        self._local = threading.local()
+
+
+'''
+------------------------------EMPLOYEE CACHE------------------------------
+'''
+
+
+# Bounded LRU cache of employee rows with a time to live, sits in front of get_employee and get_employee_perm_level.
+# Keyed by employee ID only, so one cache serves one database. The employee write functions in this module
+# invalidate the IDs they touch once the change is committed (inside a LockerDB.batch() scope when the batch commits),
+# ttl bounds how stale a row changed outside this process can get.
+class EmployeeCache:
+    def __init__(self, max_size: int = 4096, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        # emp_id -> (expires_at, row), most recently used last
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    # Returns True, row on a hit or False, None on a miss
+    def get(self, emp_id: str) -> (bool, tuple):
+        with self._lock:
+            entry = self._entries.get(emp_id)
+
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(emp_id)
+                    self.hits += 1
+                    return True, entry[1]
+
+                del self._entries[emp_id]
+                self.expirations += 1
+
+            self.misses += 1
+            return False, None
+
+    def put(self, emp_id: str, row: tuple) -> None:
+        with self._lock:
+            self._entries[emp_id] = (time.monotonic() + self.ttl, row)
+            self._entries.move_to_end(emp_id)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    # Drop the given IDs, or everything if emp_ids is None
+    def invalidate(self, emp_ids=None) -> None:
+        with self._lock:
+            if emp_ids is None:
+                self._entries.clear()
+                return
+
+            for emp_id in emp_ids:
+                self._entries.pop(emp_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._entries),
+                    'max_size': self.max_size,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'expirations': self.expirations,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+# Off unless enable_employee_cache is called
+_employee_cache = None
+
+
+def enable_employee_cache(max_size: int = 4096, ttl: float = 300.0) -> EmployeeCache:
+    global _employee_cache
+    _employee_cache = EmployeeCache(max_size, ttl)
+    return _employee_cache
+
+
+def disable_employee_cache() -> None:
+    global _employee_cache
+    _employee_cache = None
+
+
+# Hit/miss/eviction counters of the active cache, empty dict if caching is off
+def employee_cache_stats() -> dict:
+    cache = _employee_cache
+    return cache.stats() if cache is not None else {}
+
+
+# Called by every employee write path after its commit, emp_ids None = every employee
+# Inside a LockerDB.batch() scope the commit is held back, so is the invalidation (a rolled back batch drops it)
+def _employees_changed(emp_ids=None, cursor: sqlite3.Cursor = None) -> None:
+    conn = cursor.connection if cursor is not None else None
+
+    if getattr(conn, 'batch_depth', 0) > 0:
+        conn.pending_invalidations.append(None if emp_ids is None else list(emp_ids))
+        return
+
+    cache = _employee_cache
+    if cache is not None:
+        cache.invalidate(emp_ids)
+
+
+# A connection with uncommitted changes may see employee rows nobody else can, don't serve or fill the cache there
+def _cache_usable(cursor: sqlite3.Cursor) -> bool:
+    conn = cursor.connection
+    return not conn.in_transaction and getattr(conn, 'batch_depth', 0) == 0
+
+
+'''
+------------------------------WRITE LISTENERS------------------------------
+'''
+
+# One committed change made through this module, passed to every write listener
+# table = 'employees' / 'locker_doors' / 'items', rows depend on table and action:
+#   employees     insert / update  (id, name, max_perm_level)      delete  (id,)
+#   locker_doors  insert / update  (locker_number, locker_perm_level)      delete  (locker_number,)
+#   items         insert / update  (item_id, name, description, min_perm_level, locker_number)      delete  (item_id,)
+#                 checkout  (item_id, locker_number, emp_id)      return  (item_id, locker_number)
+#   any table     wipe  [] - every row was deleted
+WriteEvent = namedtuple('WriteEvent', ['table', 'action', 'rows'])
+
+_write_listeners = []
+_write_listeners_lock = threading.Lock()
+
+
+# Listeners are called with each WriteEvent after the change is committed, inside a LockerDB.batch() scope only
+# once the batch commits (a rolled back batch sends nothing). Used to keep in-memory views such as
+# locker_snapshot.LockerSnapshot in step with the database without querying it again.
+def add_write_listener(listener) -> None:
+    with _write_listeners_lock:
+        _write_listeners.append(listener)
+
+
+def remove_write_listener(listener) -> None:
+    with _write_listeners_lock:
+        if listener in _write_listeners:
+            _write_listeners.remove(listener)
+
+
+def _dispatch_writes(events: list) -> None:
+    if not events:
+        return
+
+    with _write_listeners_lock:
+        listeners = list(_write_listeners)
+
+    for listener in listeners:
+        for event in events:
+            # The write is already committed, a broken listener must not turn it into a failure for the caller
+            try:
+                listener(event)
+            except Exception as e:
+                logger.error("Write listener failed on %s %s. %s", event.table, event.action, e)
+
+
+def _notify_write(cursor, table: str, action: str, rows: list) -> None:
+    if not _write_listeners:
+        return
+
+    event = WriteEvent(table, action, rows)
+    conn = cursor.connection if cursor is not None else None
+
+    if getattr(conn, 'batch_depth', 0) > 0:
+        conn.pending_writes.append(event)
+    else:
+        _dispatch_writes([event])
+
 
 '''
 ------------------------------EMPLOYEE CRUD FUNCTIONS------------------------------
 '''
 
 
+@metrics.instrumented('db.add_employee')
 def add_employee(cursor: sqlite3.Cursor, list_of_employees: list) -> bool:
     # Add items by using list of tuples [()], each individual tuple is one item
     # Ex: [(12345, 'Jake Enoch', 4), (54321, 'Mark Treadwell', 7)]
@@ -106,7 +477,7 @@ def add_employee(cursor: sqlite3.Cursor, list_of_employees: list) -> bool:
         insert_statement = "INSERT INTO employees VALUES (?, ?, ?)"
 
         if len(list_of_employees) < 1 or len(list_of_employees[0]) == 0:
-            print("Attempting to add 0 items to database. Check syntax and try again.\n")
+            logger.warning("Attempting to add 0 items to database. Check syntax and try again.")
             return False
 
         count = 1
@@ -118,8 +489,8 @@ def add_employee(cursor: sqlite3.Cursor, list_of_employees: list) -> bool:
                 error_msg = "Employee #{} is not formatted correctly. Correct Format is (id (string), name (string), " \
                             "perm_level (int)".format(count)
 
-                print(error_msg)
-                print("No employees added.")
+                logger.warning(error_msg)
+                logger.warning("No employees added.")
 
                 cursor.connection.rollback()
 
@@ -129,20 +500,23 @@ def add_employee(cursor: sqlite3.Cursor, list_of_employees: list) -> bool:
             count += 1
 
         cursor.connection.commit()
+        _employees_changed([employee[0] for employee in list_of_employees], cursor)
+        _notify_write(cursor, 'employees', 'insert', [tuple(employee) for employee in list_of_employees])
         return True
 
     except Error as e:
-        print(e)
+        logger.error("%s", e)
         return False
 
 
+@metrics.instrumented('db.remove_employee')
 def remove_employee(cursor: sqlite3.Cursor, emp_id: str) -> bool:
     try:
 
         # Make sure that the emp_id is a string
         if type(emp_id) is not str:
             err_msg = "ID is {} when it should be type string. Check formatting and try again.".format(type(emp_id))
-            print(err_msg)
+            logger.warning(err_msg)
             return False
 
         # Define the SQL delete statement
@@ -155,25 +529,27 @@ def remove_employee(cursor: sqlite3.Cursor, emp_id: str) -> bool:
         if res.rowcount == 0:
             err_msg = "Employee with ID {} not found! Delete was not performed.".format(emp_id)
             # No commit is needed here since nothing changed in the database
-            print(err_msg)
+            logger.warning(err_msg)
             return False
 
         # Commit the changes to the database
         cursor.connection.commit()
+        _employees_changed([emp_id], cursor)
+        _notify_write(cursor, 'employees', 'delete', [(emp_id,)])
         return True
 
     except sqlite3.Error as e:
         cursor.connection.rollback()
-        print("Error has occurred! Check logs for answers.")
-        print(e)
+        logger.error("Error has occurred! %s", e)
         return False
 
 
+@metrics.instrumented('db.update_employee')
 def update_employee(cursor: sqlite3.Cursor, emp_id: str, new_details: tuple) -> bool:
     try:
         if type(new_details[0]) is not str or type(new_details[1]) is not int or len(new_details) != 2:
             err_msg = "Employee with ID {} not updated! Use a tuple with types (str, int) to update employee!".format(emp_id)
-            print(err_msg)
+            logger.warning(err_msg)
             return False
 
         # Search for the employee and verify that it exists before trying to update
@@ -194,47 +570,795 @@ def update_employee(cursor: sqlite3.Cursor, emp_id: str, new_details: tuple) ->
 
         # Commit the changes to the database
         cursor.connection.commit()
+        _employees_changed([emp_id], cursor)
+        _notify_write(cursor, 'employees', 'update', [(emp_id, new_details[0], new_details[1])])
         return True
 
     except sqlite3.Error as e:
-        print("Error has occurred! Check logs for answers.")
-        print(e)
+        logger.error("Error has occurred! %s", e)
         return False
 
 
+@metrics.instrumented('db.get_employee')
 def get_employee(cursor: sqlite3.Cursor, emp_id: str) -> tuple:
     try:
+        cache = _employee_cache if _cache_usable(cursor) else None
+
+        if cache is not None:
+            hit, row = cache.get(emp_id)
+            if hit:
+                return row
+
         select_statement = "SELECT * FROM employees WHERE id = ?"
 
         cursor.execute(select_statement, (emp_id,))
         search_res = cursor.fetchone()
 
         if search_res is None:
-            print("Employee with ID: {} not found!".format(emp_id))
+            logger.warning("Employee with ID: %s not found!", emp_id)
+
+        # Unknown IDs are not cached so a newly added employee shows up straight away
+        elif cache is not None:
+            cache.put(emp_id, search_res)
 
         return search_res
 
     except sqlite3.Error as e:
-        print("Error has occurred! Check logs for answers.")
-        print(e)
+        logger.error("Error has occurred! %s", e)
         return ()
 
 
+# Max perm level of an employee (through the employee cache if it is on), None if the employee does not exist
+def get_employee_perm_level(cursor: sqlite3.Cursor, emp_id: str) -> int:
+    employee = get_employee(cursor, emp_id)
+    return employee[2] if employee else None
+
+
+@metrics.instrumented('db.get_all_employees')
 def get_all_employees(cursor: sqlite3.Cursor) -> list:
     try:
         select_statement = 'SELECT * FROM employees'
         return cursor.execute(select_statement).fetchall()
 
     except sqlite3.Error as e:
-        print("Error has occurred! Check logs for answers.")
-        print(e)
+        logger.error("Error has occurred! %s", e)
         return []
 
 
+# Keyset paging over employees ordered by id, pass the returned next_after_id back in to get the following page.
+# next_after_id is None once the last page has been returned. Unlike OFFSET paging every page costs the same, no
+# matter how deep into the table it is.
+@metrics.instrumented('db.get_employees_page')
+def get_employees_page(cursor: sqlite3.Cursor, after_id: str = None, page_size: int = 100) -> (list, str):
+    try:
+        if after_id is None:
+            rows = cursor.execute("SELECT * FROM employees ORDER BY id LIMIT ?", (page_size + 1,)).fetchall()
+        else:
+            rows = cursor.execute("SELECT * FROM employees WHERE id > ? ORDER BY id LIMIT ?",
+                                  (after_id, page_size + 1)).fetchall()
+
+        # One extra row was asked for only to find out whether there is another page
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            return rows, rows[-1][0]
+
+        return rows, None
+
+    except sqlite3.Error as e:
+        logger.error("Error has occurred! %s", e)
+        return [], None
+
+
+# Generator over every employee ordered by id, fetching batch_size rows at a time so memory stays constant.
+# Uses its own cursor so the caller's cursor stays free while iterating.
+# A database error is logged and raised again, a listing that was cut short must not pass for a complete one.
+def iter_employees(cursor: sqlite3.Cursor, batch_size: int = 500):
+    try:
+        stream_cursor = cursor.connection.cursor()
+        stream_cursor.execute("SELECT * FROM employees ORDER BY id")
+
+        try:
+            rows = stream_cursor.fetchmany(batch_size)
+
+            while rows:
+                yield from rows
+                rows = stream_cursor.fetchmany(batch_size)
+
+        finally:
+            stream_cursor.close()
+
+    except sqlite3.Error as e:
+        logger.error("Error has occurred! Employee listing stopped early. %s", e)
+        raise
+
+
+# Page cache size (negative = KiB, 64 MB) and in-memory temp storage used while a bulk import is running
+bulk_import_pragmas = {'cache_size': -65536, 'temp_store': 2}
+
+# SQLite limits the number of ? parameters in one statement, look up existing IDs this many at a time
+id_lookup_chunk = 500
+
+
+# Check a single employee tuple, returns None if it is fine or the reason it was rejected
+def validate_employee(employee) -> str:
+    if type(employee) not in (tuple, list) or len(employee) != 3:
+        return "Not a 3 item tuple"
+
+    if type(employee[0]) is not str or type(employee[1]) is not str or type(employee[2]) is not int:
+        return "Correct Format is (id (string), name (string), perm_level (int))"
+
+    return None
+
+
+# Split a batch into valid (index, employee) rows and rejected (index, employee, reason) rows
+# Index is the position in the batch plus first_index
+def _validate_employee_batch(list_of_employees, upsert: bool, first_index: int = 0) -> (list, list):
+    rejected = []
+    valid = []
+    batch_ids = set()
+
+    for index, employee in enumerate(list_of_employees, first_index):
+        reason = validate_employee(employee)
+
+        if reason is None and not upsert and employee[0] in batch_ids:
+            reason = "Duplicate ID in batch"
+
+        if reason is not None:
+            rejected.append((index, employee, reason))
+            continue
+
+        batch_ids.add(employee[0])
+        valid.append((index, tuple(employee)))
+
+    return valid, rejected
+
+
+# Insert validated rows with a single executemany, does not commit
+# Without upsert, rows whose ID is already in the table are moved to rejected instead of aborting the insert
+# Returns the number of rows inserted or updated
+def _insert_employee_batch(cursor: sqlite3.Cursor, valid: list, rejected: list, upsert: bool) -> int:
+    if upsert:
+        insert_statement = "INSERT INTO employees VALUES (?, ?, ?) " \
+                           "ON CONFLICT(id) DO UPDATE SET name = excluded.name, " \
+                           "max_perm_level = excluded.max_perm_level"
+    else:
+        insert_statement = "INSERT INTO employees VALUES (?, ?, ?)"
+
+        # Usually none of the IDs exist yet, so try the whole batch first and only look for clashes if one fails
+        if not cursor.connection.in_transaction:
+            cursor.execute("BEGIN")
+        cursor.execute("SAVEPOINT employee_batch")
+
+        try:
+            cursor.executemany(insert_statement, (employee for index, employee in valid))
+            inserted = cursor.rowcount
+            cursor.execute("RELEASE employee_batch")
+            return inserted
+
+        except sqlite3.IntegrityError:
+            cursor.execute("ROLLBACK TO employee_batch")
+            cursor.execute("RELEASE employee_batch")
+
+        ids = [employee[0] for index, employee in valid]
+        existing = set()
+
+        for start in range(0, len(ids), id_lookup_chunk):
+            chunk = ids[start:start + id_lookup_chunk]
+            select_statement = "SELECT id FROM employees WHERE id IN ({})".format(', '.join('?' * len(chunk)))
+            existing.update(row[0] for row in cursor.execute(select_statement, chunk))
+
+        if existing:
+            rejected.extend((index, employee, "ID already exists") for index, employee in valid
+                            if employee[0] in existing)
+            rejected.sort(key=lambda rejection: rejection[0])
+            valid = [(index, employee) for index, employee in valid if employee[0] not in existing]
+
+    cursor.executemany(insert_statement, (employee for index, employee in valid))
+    return cursor.rowcount
+
+
+# Apply bulk_import_pragmas and return the previous values so they can be put back afterwards
+def _apply_bulk_pragmas(cursor: sqlite3.Cursor) -> dict:
+    previous_pragmas = {name: cursor.execute('PRAGMA {}'.format(name)).fetchone()[0] for name in bulk_import_pragmas}
+
+    for name, value in bulk_import_pragmas.items():
+        cursor.execute('PRAGMA {} = {}'.format(name, value))
+
+    return previous_pragmas
+
+
+def _restore_pragmas(cursor: sqlite3.Cursor, previous_pragmas: dict) -> None:
+    for name, value in previous_pragmas.items():
+        cursor.execute('PRAGMA {} = {}'.format(name, value))
+
+
+# Write event for the rows of a bulk insert that made it in (_insert_employee_batch adds the ones it skipped to rejected)
+def _notify_written_employees(cursor: sqlite3.Cursor, valid: list, rejected: list, upsert: bool) -> None:
+    skipped = {index for index, employee, reason in rejected}
+    _notify_write(cursor, 'employees', 'update' if upsert else 'insert',
+                  [tuple(employee) for index, employee in valid if index not in skipped])
+
+
+# Bulk version of add_employee for large imports (e.g. HR sync)
+# The whole batch is validated first, then every valid row is inserted with a single executemany in one transaction.
+# Malformed rows and (without upsert) IDs that already exist are reported instead of failing the whole batch.
+# With upsert=True existing employees get their name and perm level overwritten instead of being rejected.
+# Returns True, rejected where rejected is a list of (index, employee, reason). False, rejected on a database error.
+@metrics.instrumented('db.add_employees_bulk')
+def add_employees_bulk(cursor: sqlite3.Cursor, list_of_employees, upsert: bool = False) -> (bool, list):
+    valid, rejected = _validate_employee_batch(list_of_employees, upsert)
+
+    if not valid:
+        return True, rejected
+
+    # Finish whatever the caller had open so the import runs in its own transaction
+    cursor.connection.commit()
+    previous_pragmas = _apply_bulk_pragmas(cursor)
+
+    try:
+        _insert_employee_batch(cursor, valid, rejected, upsert)
+        cursor.connection.commit()
+        _employees_changed([employee[0] for index, employee in valid], cursor)
+        _notify_written_employees(cursor, valid, rejected, upsert)
+        return True, rejected
+
+    except sqlite3.Error as e:
+        cursor.connection.rollback()
+        logger.error("Error has occurred! No employees added. %s", e)
+        return False, rejected
+
+    finally:
+        _restore_pragmas(cursor, previous_pragmas)
+
+
+# Columns expected in a CSV header / keys expected in each JSONL object
+employee_fields = ('id', 'name', 'max_perm_level')
+
+
+# Yield (employee, parse_error) for every data row of a CSV file with an id,name,max_perm_level header
+def _read_employee_csv(file):
+    for row in csv.DictReader(file):
+        try:
+            yield (row['id'], row['name'], int(row['max_perm_level'])), None
+
+        except (KeyError, TypeError, ValueError):
+            yield tuple(row.values()), "CSV row does not have id, name and integer max_perm_level"
+
+
+# Yield (employee, parse_error) for every non-blank line of a JSONL file
+# Each line is either {"id": ..., "name": ..., "max_perm_level": ...} or [id, name, max_perm_level]
+def _read_employee_jsonl(file):
+    for line in file:
+        if not line.strip():
+            continue
+
+        try:
+            record = json.loads(line)
+
+        except ValueError:
+            yield line, "Invalid JSON"
+            continue
+
+        if type(record) is dict:
+            if not all(field in record for field in employee_fields):
+                yield record, "JSON object does not have id, name and max_perm_level"
+                continue
+
+            record = [record[field] for field in employee_fields]
+
+        yield (tuple(record) if type(record) is list else record), None
+
+
+# Stream employees from a CSV or JSONL file (path or open text file) into the database in chunks of chunk_size rows.
+# Only one chunk is held in memory at a time. Each chunk is committed together with a progress marker for job_name
+# (defaults to the file's path), so if the load is interrupted, running it again with the same job_name skips the rows
+# that were already committed. The marker is removed once the whole file has been loaded.
+# Rejected rows are passed to on_reject(row_number, employee, reason) if given, row numbers start at 1.
+# Returns True, summary (rows read, added, rejected, resumed from) or False, summary if a database error stopped it.
+@metrics.instrumented('db.load_employees_from_file')
+def load_employees_from_file(cursor: sqlite3.Cursor, source, file_format: str = None, chunk_size: int = 1000,
+                             upsert: bool = False, job_name: str = None, on_reject=None) -> (bool, dict):
+    summary = {'rows_read': 0, 'added': 0, 'rejected': 0, 'resumed_from': 0}
+
+    if file_format is None:
+        path = source if type(source) is str else getattr(source, 'name', '')
+        file_format = os.path.splitext(str(path))[1].lstrip('.').lower()
+
+    if file_format not in ('csv', 'jsonl'):
+        logger.warning("Unknown employee file format '%s'. Use csv or jsonl.", file_format)
+        return False, summary
+
+    if job_name is None and type(source) is str:
+        job_name = os.path.abspath(source)
+
+    file = open(source, newline='', encoding='utf-8') if type(source) is str else source
+    reader = _read_employee_csv(file) if file_format == 'csv' else _read_employee_jsonl(file)
+    committed_rows = 0
+
+    cursor.connection.commit()
+    previous_pragmas = _apply_bulk_pragmas(cursor)
+
+    try:
+        if job_name is not None:
+            cursor.execute(
+                """CREATE TABLE IF NOT EXISTS employee_import_progress (
+                    job_name TEXT PRIMARY KEY,
+                    rows_done INTEGER NOT NULL
+                )"""
+            )
+            progress = cursor.execute("SELECT rows_done FROM employee_import_progress WHERE job_name = ?",
+                                      (job_name,)).fetchone()
+
+            if progress is not None:
+                committed_rows = progress[0]
+                summary['resumed_from'] = committed_rows
+                summary['rows_read'] = committed_rows
+
+                # Skip rows committed by the interrupted run without validating them again
+                for _ in itertools.islice(reader, committed_rows):
+                    pass
+
+        while True:
+            chunk = list(itertools.islice(reader, chunk_size))
+            if not chunk:
+                break
+
+            first_row = summary['rows_read'] + 1
+            summary['rows_read'] += len(chunk)
+
+            # Rows that could not even be parsed, then validate the rest with the same rules as add_employees_bulk
+            rejected = [(row, employee, reason) for row, (employee, reason) in enumerate(chunk, first_row)
+                        if reason is not None]
+            parsed_rows = [row for row, (employee, reason) in enumerate(chunk, first_row) if reason is None]
+            valid, invalid = _validate_employee_batch((employee for employee, reason in chunk if reason is None),
+                                                      upsert)
+
+            # _validate_employee_batch numbers rows by position among the parsed rows, map back to file row numbers
+            valid = [(parsed_rows[index], employee) for index, employee in valid]
+            rejected.extend((parsed_rows[index], employee, reason) for index, employee, reason in invalid)
+
+            if valid:
+                summary['added'] += _insert_employee_batch(cursor, valid, rejected, upsert)
+
+            if job_name is not None:
+                cursor.execute("INSERT INTO employee_import_progress VALUES (?, ?) "
+                               "ON CONFLICT(job_name) DO UPDATE SET rows_done = excluded.rows_done",
+                               (job_name, summary['rows_read']))
+
+            cursor.connection.commit()
+            committed_rows = summary['rows_read']
+            _employees_changed([employee[0] for row, employee in valid], cursor)
+            _notify_written_employees(cursor, valid, rejected, upsert)
+
+            summary['rejected'] += len(rejected)
+            if on_reject is not None:
+                for row, employee, reason in sorted(rejected, key=lambda rejection: rejection[0]):
+                    on_reject(row, employee, reason)
+
+        if job_name is not None:
+            cursor.execute("DELETE FROM employee_import_progress WHERE job_name = ?", (job_name,))
+            cursor.connection.commit()
+
+        return True, summary
+
+    except sqlite3.Error as e:
+        cursor.connection.rollback()
+        summary['rows_read'] = committed_rows
+        logger.error("Error has occurred! Employee load stopped after row %d. %s", committed_rows, e)
+        return False, summary
+
+    finally:
+        _restore_pragmas(cursor, previous_pragmas)
+
+        if type(source) is str:
+            file.close()
+
+
 '''
 ------------------------------EMPLOYEE CRUD FUNCTIONS END------------------------------
 '''
 
+'''
+------------------------------LOCKER CRUD FUNCTIONS------------------------------
+'''
+
+
+@metrics.instrumented('db.add_locker')
+def add_locker(cursor: sqlite3.Cursor, list_of_lockers: list) -> bool:
+    # Add lockers by using list of tuples [()], each individual tuple is one locker
+    # Ex: [(1, 3), (2, 5)] - (locker_number, locker_perm_level)
+    try:
+        insert_statement = "INSERT INTO locker_doors VALUES (?, ?)"
+
+        if len(list_of_lockers) < 1:
+            logger.warning("Attempting to add 0 lockers to database. Check syntax and try again.")
+            return False
+
+        for count, locker in enumerate(list_of_lockers, 1):
+            if len(locker) != 2 or type(locker[0]) is not int or type(locker[1]) is not int:
+                logger.warning("Locker #%s is not formatted correctly. Correct Format is (locker_number (int), "
+                               "perm_level (int))", count)
+                logger.warning("No lockers added.")
+
+                cursor.connection.rollback()
+                return False
+
+        cursor.executemany(insert_statement, list_of_lockers)
+        cursor.connection.commit()
+        _notify_write(cursor, 'locker_doors', 'insert', [tuple(locker) for locker in list_of_lockers])
+        return True
+
+    except sqlite3.Error as e:
+        cursor.connection.rollback()
+        logger.error("%s", e)
+        return False
+
+
+@metrics.instrumented('db.remove_locker')
+def remove_locker(cursor: sqlite3.Cursor, locker_number: int) -> bool:
+    try:
+        if type(locker_number) is not int:
+            logger.warning("Locker number is %s when it should be type int. Check formatting and try again.",
+                           type(locker_number))
+            return False
+
+        res = cursor.execute("DELETE FROM locker_doors WHERE locker_number = ?", (locker_number,))
+
+        if res.rowcount == 0:
+            logger.warning("Locker %s not found! Delete was not performed.", locker_number)
+            return False
+
+        cursor.connection.commit()
+        _notify_write(cursor, 'locker_doors', 'delete', [(locker_number,)])
+        return True
+
+    except sqlite3.Error as e:
+        cursor.connection.rollback()
+        logger.error("Error has occurred! %s", e)
+        return False
+
+
+@metrics.instrumented('db.update_locker')
+def update_locker(cursor: sqlite3.Cursor, locker_number: int, new_perm_level: int) -> bool:
+    try:
+        if type(new_perm_level) is not int:
+            logger.warning("Locker %s not updated! Perm level must be type int.", locker_number)
+            return False
+
+        res = cursor.execute("UPDATE locker_doors SET locker_perm_level = ? WHERE locker_number = ?",
+                             (new_perm_level, locker_number))
+
+        if res.rowcount == 0:
+            logger.warning("Locker %s not found! Only attempt to update lockers that exist!", locker_number)
+            return False
+
+        cursor.connection.commit()
+        _notify_write(cursor, 'locker_doors', 'update', [(locker_number, new_perm_level)])
+        return True
+
+    except sqlite3.Error as e:
+        logger.error("Error has occurred! %s", e)
+        return False
+
+
+@metrics.instrumented('db.get_locker')
+def get_locker(cursor: sqlite3.Cursor, locker_number: int) -> tuple:
+    try:
+        search_res = cursor.execute("SELECT * FROM locker_doors WHERE locker_number = ?", (locker_number,)).fetchone()
+
+        if search_res is None:
+            logger.warning("Locker %s not found!", locker_number)
+
+        return search_res
+
+    except sqlite3.Error as e:
+        logger.error("Error has occurred! %s", e)
+        return ()
+
+
+@metrics.instrumented('db.get_all_lockers')
+def get_all_lockers(cursor: sqlite3.Cursor) -> list:
+    try:
+        return cursor.execute("SELECT * FROM locker_doors").fetchall()
+
+    except sqlite3.Error as e:
+        logger.error("Error has occurred! %s", e)
+        return []
+
+
+'''
+------------------------------LOCKER CRUD FUNCTIONS END------------------------------
+'''
+
+'''
+------------------------------ITEM CRUD FUNCTIONS------------------------------
+'''
+
+
+# Check a single item tuple (item_id, name, description, min_perm_level, locker_number)
+# Returns None if it is fine or the reason it was rejected. Description and locker number may be None.
+def validate_item(item) -> str:
+    if type(item) not in (tuple, list) or len(item) != 5:
+        return "Not a 5 item tuple"
+
+    if type(item[0]) is not str or type(item[1]) is not str or type(item[2]) not in (str, type(None)) \
+            or type(item[3]) is not int or type(item[4]) not in (int, type(None)):
+        return "Correct Format is (item_id (string), name (string), description (string or None), " \
+               "min_perm_level (int), locker_number (int or None))"
+
+    return None
+
+
+@metrics.instrumented('db.add_item')
+def add_item(cursor: sqlite3.Cursor, list_of_items: list) -> bool:
+    # Add items by using list of tuples [()], each individual tuple is one item. New items are not borrowed.
+    # Ex: [('A100', 'Torque Wrench', '1/2in drive', 3, 1)]
+    try:
+        insert_statement = "INSERT INTO items (item_id, name, description, min_perm_level, locker_number) " \
+                           "VALUES (?, ?, ?, ?, ?)"
+
+        if len(list_of_items) < 1:
+            logger.warning("Attempting to add 0 items to database. Check syntax and try again.")
+            return False
+
+        for count, item in enumerate(list_of_items, 1):
+            reason = validate_item(item)
+
+            if reason is not None:
+                logger.warning("Item #%s is not formatted correctly. %s", count, reason)
+                logger.warning("No items added.")
+
+                cursor.connection.rollback()
+                return False
+
+        cursor.executemany(insert_statement, list_of_items)
+        cursor.connection.commit()
+        _notify_write(cursor, 'items', 'insert', [tuple(item) for item in list_of_items])
+        return True
+
+    except sqlite3.Error as e:
+        cursor.connection.rollback()
+        logger.error("%s", e)
+        return False
+
+
+@metrics.instrumented('db.remove_item')
+def remove_item(cursor: sqlite3.Cursor, item_id: str) -> bool:
+    try:
+        if type(item_id) is not str:
+            logger.warning("Item ID is %s when it should be type string. Check formatting and try again.",
+                           type(item_id))
+            return False
+
+        res = cursor.execute("DELETE FROM items WHERE item_id = ?", (item_id,))
+
+        if res.rowcount == 0:
+            logger.warning("Item with ID %s not found! Delete was not performed.", item_id)
+            return False
+
+        cursor.connection.commit()
+        _notify_write(cursor, 'items', 'delete', [(item_id,)])
+        return True
+
+    except sqlite3.Error as e:
+        cursor.connection.rollback()
+        logger.error("Error has occurred! %s", e)
+        return False
+
+
+# new_details = (name, description, min_perm_level, locker_number), borrowed_by is only changed by checkout/return
+@metrics.instrumented('db.update_item')
+def update_item(cursor: sqlite3.Cursor, item_id: str, new_details: tuple) -> bool:
+    try:
+        if validate_item((item_id,) + tuple(new_details)) is not None:
+            logger.warning("Item with ID %s not updated! Use a tuple with types (str, str or None, int, int or None) "
+                           "to update an item!", item_id)
+            return False
+
+        res = cursor.execute("UPDATE items SET name = ?, description = ?, min_perm_level = ?, locker_number = ? "
+                             "WHERE item_id = ?", tuple(new_details) + (item_id,))
+
+        if res.rowcount == 0:
+            logger.warning("Item with ID %s not found! Only attempt to update items that exist!", item_id)
+            return False
+
+        cursor.connection.commit()
+        _notify_write(cursor, 'items', 'update', [(item_id,) + tuple(new_details)])
+        return True
+
+    except sqlite3.Error as e:
+        logger.error("Error has occurred! %s", e)
+        return False
+
+
+@metrics.instrumented('db.get_item')
+def get_item(cursor: sqlite3.Cursor, item_id: str) -> tuple:
+    try:
+        search_res = cursor.execute("SELECT * FROM items WHERE item_id = ?", (item_id,)).fetchone()
+
+        if search_res is None:
+            logger.warning("Item with ID: %s not found!", item_id)
+
+        return search_res
+
+    except sqlite3.Error as e:
+        logger.error("Error has occurred! %s", e)
+        return ()
+
+
+@metrics.instrumented('db.get_all_items')
+def get_all_items(cursor: sqlite3.Cursor) -> list:
+    try:
+        return cursor.execute("SELECT * FROM items").fetchall()
+
+    except sqlite3.Error as e:
+        logger.error("Error has occurred! %s", e)
+        return []
+
+
+# (item_id, name, locker_number) for every item an employee currently has checked out
+@metrics.instrumented('db.get_items_held_by')
+def get_items_held_by(cursor: sqlite3.Cursor, emp_id: str) -> list:
+    try:
+        return cursor.execute(items_held_by_employee_statement, (emp_id,)).fetchall()
+
+    except sqlite3.Error as e:
+        logger.error("Error has occurred! %s", e)
+        return []
+
+
+# (item_id, name, borrowed_by) for every item stored in a locker
+@metrics.instrumented('db.get_items_in_locker')
+def get_items_in_locker(cursor: sqlite3.Cursor, locker_number: int) -> list:
+    try:
+        return cursor.execute(items_in_locker_statement, (locker_number,)).fetchall()
+
+    except sqlite3.Error as e:
+        logger.error("Error has occurred! %s", e)
+        return []
+
+
+'''
+------------------------------ITEM CRUD FUNCTIONS END------------------------------
+'''
+
+'''
+------------------------------CHECKOUT / RETURN FUNCTIONS------------------------------
+'''
+
+# Permission check, borrow and locker lookup in one statement: the item is only marked as borrowed if nobody has it
+# and the employee's max_perm_level is at least the item's min_perm_level. An unknown employee makes the sub-select
+# NULL, so the comparison fails and nothing is updated.
+checkout_statement = "UPDATE items SET borrowed_by = ? " \
+                     "WHERE item_id IN ({}) AND borrowed_by IS NULL " \
+                     "AND min_perm_level <= (SELECT max_perm_level FROM employees WHERE id = ?) " \
+                     "RETURNING item_id, locker_number"
+
+return_statement = "UPDATE items SET borrowed_by = NULL " \
+                   "WHERE item_id IN ({}) AND borrowed_by IS NOT NULL " \
+                   "RETURNING item_id, locker_number"
+
+
+# Run a checkout/return statement over item_ids in chunks, returns {item_id: locker_number} for the rows it changed
+def _update_items_returning(cursor: sqlite3.Cursor, statement: str, item_ids: list, before: tuple = (),
+                            after: tuple = ()) -> dict:
+    changed = {}
+
+    for start in range(0, len(item_ids), id_lookup_chunk):
+        chunk = item_ids[start:start + id_lookup_chunk]
+        cursor.execute(statement.format(', '.join('?' * len(chunk))), before + tuple(chunk) + after)
+        changed.update(cursor.fetchall())
+
+    return changed
+
+
+# Check out one item to an employee, returns True, locker_number (None if the item has no locker)
+# Returns False, -1 if the item does not exist, is already borrowed or the employee's perm level is too low
+def checkout_item(cursor: sqlite3.Cursor, emp_id: str, item_id: str) -> (bool, int):
+    ok, results = checkout_items(cursor, emp_id, [item_id])
+
+    if not ok or item_id not in results:
+        return False, -1
+
+    return True, results[item_id]
+
+
+# Return one item, returns True, locker_number it goes back to or False, -1 if it was not checked out
+def return_item(cursor: sqlite3.Cursor, item_id: str) -> (bool, int):
+    ok, results = return_items(cursor, [item_id])
+
+    if not ok or item_id not in results:
+        return False, -1
+
+    return True, results[item_id]
+
+
+# Check out many items to one employee in a single transaction (e.g. start of shift)
+# Returns True, {item_id: locker_number} for the items that were checked out, items that could not be checked out
+# are left out of the dict. False, {} on a database error, in which case nothing was checked out.
+@metrics.instrumented('db.checkout_items')
+def checkout_items(cursor: sqlite3.Cursor, emp_id: str, item_ids: list) -> (bool, dict):
+    try:
+        # Read once, a generator would be used up by the type check
+        item_ids = list(item_ids)
+
+        if type(emp_id) is not str or any(type(item_id) is not str for item_id in item_ids):
+            logger.warning("Employee and item IDs must be type string. Check formatting and try again.")
+            return False, {}
+
+        checked_out = _update_items_returning(cursor, checkout_statement, item_ids, before=(emp_id,),
+                                              after=(emp_id,))
+        cursor.connection.commit()
+        _notify_write(cursor, 'items', 'checkout', [(item_id, locker_number, emp_id)
+                                                    for item_id, locker_number in checked_out.items()])
+
+        if len(checked_out) != len(set(item_ids)):
+            logger.warning("%s item(s) not checked out to %s! Items must exist, not be borrowed and not need a higher "
+                           "perm level.", len(set(item_ids)) - len(checked_out), emp_id)
+
+        return True, checked_out
+
+    except sqlite3.Error as e:
+        cursor.connection.rollback()
+        logger.error("Error has occurred! %s", e)
+        return False, {}
+
+
+# Return many items in a single transaction (e.g. end of shift)
+# Returns True, {item_id: locker_number} for the items that were returned, False, {} on a database error
+@metrics.instrumented('db.return_items')
+def return_items(cursor: sqlite3.Cursor, item_ids: list) -> (bool, dict):
+    try:
+        item_ids = list(item_ids)
+
+        if any(type(item_id) is not str for item_id in item_ids):
+            logger.warning("Item IDs must be type string. Check formatting and try again.")
+            return False, {}
+
+        returned = _update_items_returning(cursor, return_statement, item_ids)
+        cursor.connection.commit()
+        _notify_write(cursor, 'items', 'return', list(returned.items()))
+        return True, returned
+
+    except sqlite3.Error as e:
+        cursor.connection.rollback()
+        logger.error("Error has occurred! %s", e)
+        return False, {}
+
+
+# Permission check and target locker for handing an item to an employee, one indexed join on three primary keys.
+# The employee needs a perm level at least as high as both the item and its locker, and the item must be free
+# or already borrowed by that same employee.
+unlock_target_statement = "SELECT items.locker_number FROM items " \
+                          "JOIN employees ON employees.id = ? " \
+                          "JOIN locker_doors ON locker_doors.locker_number = items.locker_number " \
+                          "WHERE items.item_id = ? " \
+                          "AND items.min_perm_level <= employees.max_perm_level " \
+                          "AND locker_doors.locker_perm_level <= employees.max_perm_level " \
+                          "AND (items.borrowed_by IS NULL OR items.borrowed_by = employees.id)"
+
+
+# Returns True, locker_number if the employee may open the locker holding the item, False, -1 if not
+@metrics.instrumented('db.get_unlock_target')
+def get_unlock_target(cursor: sqlite3.Cursor, emp_id: str, item_id: str) -> (bool, int):
+    try:
+        search_res = cursor.execute(unlock_target_statement, (emp_id, item_id)).fetchone()
+
+        if search_res is None:
+            logger.warning("Employee %s is not allowed to open the locker for item %s.", emp_id, item_id)
+            return False, -1
+
+        return True, search_res[0]
+
+    except sqlite3.Error as e:
+        logger.error("Error has occurred! %s", e)
+        return False, -1
+
+
+'''
+------------------------------CHECKOUT / RETURN FUNCTIONS END------------------------------
+'''
+
 '''ldb = "locker.db"
 
 temp_emps = [("12345678", "Jake Enoch", 5)]
@@ -0,0 +1,340 @@
+import logging
+import sqlite3
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from database import locker_db
+
+logger = logging.getLogger(__name__)
+
+"""
+#--------------------LOCKER SHARDS--------------------#
+
+Splits one logical locker database over several SQLite files, e.g. one per site or per bank of lockers, so a burst
+of writes at one site only locks that site's file.
+
+    - lockers are placed by locker number range, items go to the shard of the locker they are stored in
+    - employees are copied to every shard, so the permission checks and the items.borrowed_by foreign key still
+      work inside one file (get_unlock_target / checkout stay single-shard queries)
+
+Every shard is opened through its own LockerDB (WAL, one connection per thread). Reads that have to look at every
+shard (all items, items held by an employee, finding an item by ID) run on a thread pool, one task per shard, and the
+results are merged. attached_connection() gives a read-only style connection with every shard ATTACHed for ad hoc
+cross-site SQL.
+
+Employee changes are applied to every shard with the commits held back (one LockerDB.batch() per shard, taken in
+shard name order) and only committed once every shard has accepted them, otherwise every shard is rolled back, so the
+copies stay identical (e.g. removing an employee who still holds an item in one shard changes no shard). Checkouts
+spanning sites commit shard by shard, there is no cross-shard transaction for them. A shard that fails is logged and
+the call returns False.
+
+Example:
+
+    shards = LockerShards({'north': 'north.db', 'south': 'south.db'},
+                          locker_ranges=[(1, 240, 'north'), (241, 480, 'south')])
+    shards.create_database()
+    shards.add_employee([("12345678", "Jake Enoch", 5)])
+    shards.add_locker([(1, 2), (300, 2)])
+    shards.checkout_items("12345678", ["A100", "B200"])   # True, {'A100': 1, 'B200': 300}
+
+#--------------------LOCKER SHARDS END--------------------#
+"""
+
+find_items_statement = "SELECT item_id FROM items WHERE item_id IN ({})"
+
+
+# Raised inside the per-shard batches to roll every shard back
+class _ShardWriteRejected(Exception):
+    pass
+
+
+class LockerShards:
+    # shards        - shard name -> SQLite file
+    # locker_ranges - (first_locker, last_locker, shard name), inclusive and not overlapping
+    def __init__(self, shards: dict, locker_ranges: list, max_workers: int = None, **db_options):
+        self.dbs = {name: locker_db.LockerDB(db_name, **db_options) for name, db_name in shards.items()}
+
+        self.ranges = sorted(locker_ranges)
+        for first, last, name in self.ranges:
+            if name not in self.dbs:
+                raise ValueError("Locker range {}-{} points at unknown shard {}".format(first, last, name))
+        self._range_starts = [first for first, last, name in self.ranges]
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or len(self.dbs),
+                                           thread_name_prefix='locker-shard')
+
+    # Shard holding a locker number, None if no range covers it
+    def shard_for_locker(self, locker_number: int) -> str:
+        index = bisect_right(self._range_starts, locker_number) - 1
+
+        if index >= 0:
+            first, last, name = self.ranges[index]
+            if locker_number <= last:
+                return name
+
+        return None
+
+    def cursor(self, shard: str) -> sqlite3.Cursor:
+        return self.dbs[shard].cursor()
+
+    # Run func(cursor, *args) on every shard in parallel, returns {shard: result}
+    def fan_out(self, func, *args) -> dict:
+        return self.run_per_shard(func, {name: args for name in self.dbs})
+
+    # Run func(cursor, *args_by_shard[shard]) on each listed shard in parallel, returns {shard: result}
+    # The cursor is opened on the pool thread that runs the call, LockerDB connections are per thread.
+    def run_per_shard(self, func, args_by_shard: dict) -> dict:
+        futures = {name: self.executor.submit(lambda name=name, args=args: func(self.dbs[name].cursor(), *args))
+                   for name, args in args_by_shard.items()}
+
+        return {name: future.result() for name, future in futures.items()}
+
+    # Group rows by the shard of the locker number at position locker_index
+    # Returns {shard: rows}, None (nothing is written) if any row's locker is outside every range
+    def _split_by_locker(self, rows: list, locker_index: int) -> dict:
+        grouped = {}
+
+        for row in rows:
+            locker_number = row[locker_index] if len(row) > locker_index else None
+            shard = self.shard_for_locker(locker_number) if type(locker_number) is int else None
+
+            if shard is None:
+                logger.warning("Locker %s is not in any shard's locker range. Nothing added.", locker_number)
+                return None
+
+            grouped.setdefault(shard, []).append(row)
+
+        return grouped
+
+    def _all_shards_ok(self, results: dict, action: str) -> bool:
+        failed = sorted(name for name, ok in results.items() if not ok)
+
+        if failed:
+            logger.error("%s failed on shard(s) %s.", action, ', '.join(failed))
+            return False
+
+        return True
+
+    def create_database(self) -> bool:
+        return self._all_shards_ok({name: db.create_database() for name, db in self.dbs.items()}, "Create database")
+
+    # Every thread's connection to every shard, and the fan-out threads
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+
+        for db in self.dbs.values():
+            db.close()
+
+    # Connection with every shard attached as schema "shard_<name>" for cross-site SQL, e.g.
+    #     SELECT * FROM shard_north.items UNION ALL SELECT * FROM shard_south.items
+    # SQLite attaches at most 10 databases by default. The caller closes the connection.
+    def attached_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(':memory:')
+
+        for name, db in self.dbs.items():
+            conn.execute("ATTACH DATABASE ? AS {}".format(self._schema(name)), (db.db_name,))
+
+        return conn
+
+    @staticmethod
+    def _schema(name: str) -> str:
+        return '"shard_{}"'.format(name.replace('"', '""'))
+
+    '''
+    ------------------------------EMPLOYEES (copied to every shard)------------------------------
+    '''
+
+    # Run func(cursor, *args) on every shard in one batch per shard, commit them all only if succeeded(result) holds
+    # for every shard, otherwise roll every shard back.
+    # Returns True, the first shard's result or False, the failing shard's result (None if a commit failed).
+    # Runs on the calling thread, the batches are opened in shard name order so concurrent calls can't deadlock.
+    def _write_every_shard(self, action: str, func, *args, succeeded=bool) -> (bool, object):
+        results = []
+
+        try:
+            with ExitStack() as stack:
+                for name in sorted(self.dbs):
+                    result = func(stack.enter_context(self.dbs[name].batch()), *args)
+                    results.append(result)
+
+                    if not succeeded(result):
+                        raise _ShardWriteRejected(name)
+
+        except _ShardWriteRejected as e:
+            logger.error("%s failed on shard %s. No shard was changed.", action, e)
+            return False, results[-1]
+
+        # A commit failing after others went through, the shards that had not committed yet were rolled back
+        except sqlite3.Error as e:
+            logger.error("%s failed while committing, shards may differ! %s", action, e)
+            return False, None
+
+        return True, results[0] if results else None
+
+    def add_employee(self, list_of_employees: list) -> bool:
+        return self._write_every_shard("Add employee", locker_db.add_employee, list_of_employees)[0]
+
+    def add_employees_bulk(self, list_of_employees, upsert: bool = False) -> (bool, list):
+        employees = list(list_of_employees)
+        ok, result = self._write_every_shard("Bulk employee import", locker_db.add_employees_bulk, employees, upsert,
+                                             succeeded=lambda result: result[0])
+
+        # Every shard validates the same rows, report the rejections once
+        return ok, result[1] if result is not None else []
+
+    def remove_employee(self, emp_id: str) -> bool:
+        return self._write_every_shard("Remove employee", locker_db.remove_employee, emp_id)[0]
+
+    def update_employee(self, emp_id: str, new_details: tuple) -> bool:
+        return self._write_every_shard("Update employee", locker_db.update_employee, emp_id, new_details)[0]
+
+    # Any shard has the full employee table, read from the first one
+    def get_employee(self, emp_id: str) -> tuple:
+        return locker_db.get_employee(self.cursor(next(iter(self.dbs))), emp_id)
+
+    def get_all_employees(self) -> list:
+        return locker_db.get_all_employees(self.cursor(next(iter(self.dbs))))
+
+    '''
+    ------------------------------LOCKERS------------------------------
+    '''
+
+    def add_locker(self, list_of_lockers: list) -> bool:
+        grouped = self._split_by_locker(list_of_lockers, 0)
+        if not grouped:
+            return False
+
+        return self._all_shards_ok({name: locker_db.add_locker(self.cursor(name), lockers)
+                                    for name, lockers in grouped.items()}, "Add locker")
+
+    def remove_locker(self, locker_number: int) -> bool:
+        shard = self.shard_for_locker(locker_number)
+        return shard is not None and locker_db.remove_locker(self.cursor(shard), locker_number)
+
+    def update_locker(self, locker_number: int, new_perm_level: int) -> bool:
+        shard = self.shard_for_locker(locker_number)
+        return shard is not None and locker_db.update_locker(self.cursor(shard), locker_number, new_perm_level)
+
+    def get_locker(self, locker_number: int) -> tuple:
+        shard = self.shard_for_locker(locker_number)
+        return None if shard is None else locker_db.get_locker(self.cursor(shard), locker_number)
+
+    def get_all_lockers(self) -> list:
+        return sorted(locker for lockers in self.fan_out(locker_db.get_all_lockers).values() for locker in lockers)
+
+    '''
+    ------------------------------ITEMS------------------------------
+    '''
+
+    # Items are placed by their locker (item tuple position 4), an item needs a locker to know its shard
+    def add_item(self, list_of_items: list) -> bool:
+        for count, item in enumerate(list_of_items, 1):
+            reason = locker_db.validate_item(item)
+
+            if reason is not None:
+                logger.warning("Item #%s is not formatted correctly. %s", count, reason)
+                return False
+
+        grouped = self._split_by_locker(list_of_items, 4)
+        if not grouped:
+            return False
+
+        return self._all_shards_ok({name: locker_db.add_item(self.cursor(name), items)
+                                    for name, items in grouped.items()}, "Add item")
+
+    # {shard: [item_ids]} for the items that exist, one indexed lookup per shard run in parallel
+    def locate_items(self, item_ids: list) -> dict:
+        item_ids = list(item_ids)
+
+        def find(cursor: sqlite3.Cursor) -> list:
+            found = []
+            for start in range(0, len(item_ids), locker_db.id_lookup_chunk):
+                chunk = item_ids[start:start + locker_db.id_lookup_chunk]
+                found.extend(row[0] for row in cursor.execute(find_items_statement.format(
+                    ', '.join('?' * len(chunk))), chunk))
+            return found
+
+        return {name: found for name, found in self.fan_out(find).items() if found}
+
+    def _item_shard(self, item_id: str) -> str:
+        located = self.locate_items([item_id])
+        return next(iter(located), None)
+
+    def get_item(self, item_id: str) -> tuple:
+        shard = self._item_shard(item_id)
+
+        if shard is None:
+            logger.warning("Item with ID: %s not found!", item_id)
+            return None
+
+        return locker_db.get_item(self.cursor(shard), item_id)
+
+    def remove_item(self, item_id: str) -> bool:
+        shard = self._item_shard(item_id)
+
+        if shard is None:
+            logger.warning("Item with ID %s not found! Delete was not performed.", item_id)
+            return False
+
+        return locker_db.remove_item(self.cursor(shard), item_id)
+
+    # Moving an item to a locker in another shard is not supported, remove and add it instead
+    def update_item(self, item_id: str, new_details: tuple) -> bool:
+        shard = self._item_shard(item_id)
+
+        if shard is None:
+            logger.warning("Item with ID %s not found! Only attempt to update items that exist!", item_id)
+            return False
+
+        locker_number = new_details[3] if len(new_details) == 4 else None
+        if locker_number is not None and self.shard_for_locker(locker_number) != shard:
+            logger.warning("Item %s not updated! Locker %s is in another shard.", item_id, locker_number)
+            return False
+
+        return locker_db.update_item(self.cursor(shard), item_id, new_details)
+
+    def get_all_items(self) -> list:
+        return sorted(item for items in self.fan_out(locker_db.get_all_items).values() for item in items)
+
+    def get_items_held_by(self, emp_id: str) -> list:
+        return sorted(item for items in self.fan_out(locker_db.get_items_held_by, emp_id).values() for item in items)
+
+    def get_items_in_locker(self, locker_number: int) -> list:
+        shard = self.shard_for_locker(locker_number)
+        return [] if shard is None else locker_db.get_items_in_locker(self.cursor(shard), locker_number)
+
+    '''
+    ------------------------------CHECKOUT / RETURN------------------------------
+    '''
+
+    # Same contract as locker_db.checkout_items, each shard's items are checked out in that shard's own transaction
+    def checkout_items(self, emp_id: str, item_ids: list) -> (bool, dict):
+        located = self.locate_items(item_ids)
+        results = self.run_per_shard(locker_db.checkout_items, {name: (emp_id, found)
+                                                                for name, found in located.items()})
+
+        return self._merge_item_results(results, "Checkout")
+
+    def return_items(self, item_ids: list) -> (bool, dict):
+        located = self.locate_items(item_ids)
+        results = self.run_per_shard(locker_db.return_items, {name: (found,) for name, found in located.items()})
+
+        return self._merge_item_results(results, "Return")
+
+    def _merge_item_results(self, results: dict, action: str) -> (bool, dict):
+        merged = {}
+
+        for ok, items in results.values():
+            merged.update(items)
+
+        return self._all_shards_ok({name: ok for name, (ok, items) in results.items()}, action), merged
+
+    def get_unlock_target(self, emp_id: str, item_id: str) -> (bool, int):
+        shard = self._item_shard(item_id)
+
+        if shard is None:
+            logger.warning("Employee %s is not allowed to open the locker for item %s.", emp_id, item_id)
+            return False, -1
+
+        return locker_db.get_unlock_target(self.cursor(shard), emp_id, item_id)
@@ -0,0 +1,333 @@
+import logging
+import sqlite3
+import threading
+from array import array
+
+from database import locker_db
+
+logger = logging.getLogger(__name__)
+
+"""
+#--------------------LOCKER SNAPSHOT--------------------#
+
+In-memory copy of the locker state for read-heavy callers (dashboards, kiosks) so "which lockers are free, which
+items are out, who has what" is answered without SQL or a QA on the bus.
+
+Loaded once from the database, after that it is kept up to date incrementally:
+    - locker_db write listener: every committed locker and item write made through locker_db
+    - DoorMonitor listener: door open/close events from the pollers
+
+Layout:
+    - per-locker arrays indexed by locker number: perm level and number of items stored in the locker right now
+    - int bitsets (bit n = locker n) for lockers that exist, are occupied (hold at least one item) and have their
+      door open
+    - one ItemRecord (__slots__) per item, plus item_id sets per employee and per locker
+
+Changes made outside locker_db (another process, raw SQL) are not seen, call load() again to resync.
+
+Example:
+
+    snapshot = LockerSnapshot()
+    snapshot.load(cursor)
+    snapshot.attach()
+    snapshot.watch_doors(monitor)
+
+    snapshot.free_lockers()
+    snapshot.items_held_by("12345678")
+
+#--------------------LOCKER SNAPSHOT END--------------------#
+"""
+
+# Same as lock_controls.locks_per_board, locker n is door ((n - 1) % 24) + 1 on board ((n - 1) // 24) + 1
+locks_per_board = 24
+
+
+class ItemRecord:
+    __slots__ = ('item_id', 'name', 'description', 'min_perm_level', 'borrowed_by', 'locker_number')
+
+    def __init__(self, item_id: str, name: str, description: str, min_perm_level: int, borrowed_by: str,
+                 locker_number: int):
+        self.item_id = item_id
+        self.name = name
+        self.description = description
+        self.min_perm_level = min_perm_level
+        self.borrowed_by = borrowed_by
+        self.locker_number = locker_number
+
+    # Same column order as a row of the items table
+    def as_tuple(self) -> tuple:
+        return (self.item_id, self.name, self.description, self.min_perm_level, self.borrowed_by, self.locker_number)
+
+    def __repr__(self) -> str:
+        return 'ItemRecord{}'.format(self.as_tuple())
+
+
+# Locker numbers of the set bits, lowest first
+def _bits(mask: int) -> list:
+    numbers = []
+
+    while mask:
+        low = mask & -mask
+        numbers.append(low.bit_length() - 1)
+        mask ^= low
+
+    return numbers
+
+
+class LockerSnapshot:
+    def __init__(self):
+        self.lock = threading.RLock()
+
+        # Indexed by locker number, grown on demand
+        self.perm_levels = array('i')
+        self.stored_counts = array('i')
+
+        self.existing = 0
+        self.occupied = 0
+        self.open = 0
+
+        self.items = {}
+        self.held_by = {}
+        self.locker_items = {}
+
+        # Bumped on every change so pollers can tell whether anything moved since they last looked
+        self.version = 0
+
+    def _grow(self, locker_number: int) -> None:
+        missing = locker_number + 1 - len(self.perm_levels)
+
+        if missing > 0:
+            self.perm_levels.extend([-1] * missing)
+            self.stored_counts.extend([0] * missing)
+
+    # Rebuild everything from the database, e.g. at start up or after changes made outside locker_db
+    def load(self, cursor: sqlite3.Cursor) -> bool:
+        try:
+            lockers = cursor.execute("SELECT locker_number, locker_perm_level FROM locker_doors").fetchall()
+            items = cursor.execute("SELECT item_id, name, description, min_perm_level, borrowed_by, locker_number "
+                                   "FROM items").fetchall()
+
+        except sqlite3.Error as e:
+            logger.error("Error has occurred! %s", e)
+            return False
+
+        with self.lock:
+            self.perm_levels = array('i')
+            self.stored_counts = array('i')
+            self.existing = 0
+            self.occupied = 0
+            self.items = {}
+            self.held_by = {}
+            self.locker_items = {}
+
+            for locker_number, perm_level in lockers:
+                self._set_locker(locker_number, perm_level)
+
+            for row in items:
+                self._add_item(ItemRecord(*row))
+
+            self.version += 1
+
+        return True
+
+    # Follow the writes made through locker_db from now on
+    def attach(self) -> None:
+        locker_db.add_write_listener(self.apply_write)
+
+    def detach(self) -> None:
+        locker_db.remove_write_listener(self.apply_write)
+
+    # Follow door events from a DoorMonitor, the monitor's current mask is applied straight away
+    def watch_doors(self, monitor) -> None:
+        mask = monitor.mask
+
+        if mask is not None:
+            with self.lock:
+                for door in range(1, locks_per_board + 1):
+                    self._set_door(monitor.board_addr, door, not mask & (1 << (door - 1)))
+                self.version += 1
+
+        monitor.add_listener(self.apply_door_event)
+
+    def unwatch_doors(self, monitor) -> None:
+        monitor.remove_listener(self.apply_door_event)
+
+    '''
+    ------------------------------UPDATES------------------------------
+    '''
+
+    def _set_locker(self, locker_number: int, perm_level: int) -> None:
+        self._grow(locker_number)
+        self.perm_levels[locker_number] = perm_level
+        self.existing |= 1 << locker_number
+
+    def _remove_locker(self, locker_number: int) -> None:
+        if locker_number < len(self.perm_levels):
+            self.perm_levels[locker_number] = -1
+        self.existing &= ~(1 << locker_number)
+
+    # An item counts as stored in its locker while nobody has it checked out
+    def _store(self, record: ItemRecord, amount: int) -> None:
+        locker_number = record.locker_number
+        if locker_number is None or record.borrowed_by is not None:
+            return
+
+        self._grow(locker_number)
+        self.stored_counts[locker_number] += amount
+
+        if self.stored_counts[locker_number] > 0:
+            self.occupied |= 1 << locker_number
+        else:
+            self.occupied &= ~(1 << locker_number)
+
+    def _add_item(self, record: ItemRecord) -> None:
+        self.items[record.item_id] = record
+
+        if record.locker_number is not None:
+            self.locker_items.setdefault(record.locker_number, set()).add(record.item_id)
+        if record.borrowed_by is not None:
+            self.held_by.setdefault(record.borrowed_by, set()).add(record.item_id)
+
+        self._store(record, 1)
+
+    def _remove_item(self, item_id: str) -> ItemRecord:
+        record = self.items.pop(item_id, None)
+        if record is None:
+            return None
+
+        self._store(record, -1)
+
+        if record.locker_number is not None:
+            self._discard(self.locker_items, record.locker_number, item_id)
+        if record.borrowed_by is not None:
+            self._discard(self.held_by, record.borrowed_by, item_id)
+
+        return record
+
+    @staticmethod
+    def _discard(index: dict, key, item_id: str) -> None:
+        item_ids = index.get(key)
+
+        if item_ids is not None:
+            item_ids.discard(item_id)
+            if not item_ids:
+                del index[key]
+
+    def _set_borrowed_by(self, item_id: str, emp_id: str) -> None:
+        record = self._remove_item(item_id)
+
+        if record is not None:
+            record.borrowed_by = emp_id
+            self._add_item(record)
+
+    def _set_door(self, board_addr: int, door: int, is_open: bool) -> None:
+        locker_number = (board_addr - 1) * locks_per_board + door
+
+        if is_open:
+            self.open |= 1 << locker_number
+        else:
+            self.open &= ~(1 << locker_number)
+
+    # locker_db write listener
+    def apply_write(self, event) -> None:
+        with self.lock:
+            if event.table == 'locker_doors':
+                if event.action in ('insert', 'update'):
+                    for locker_number, perm_level in event.rows:
+                        self._set_locker(locker_number, perm_level)
+                elif event.action == 'delete':
+                    for locker_number, in event.rows:
+                        self._remove_locker(locker_number)
+                elif event.action == 'wipe':
+                    for locker_number in _bits(self.existing):
+                        self._remove_locker(locker_number)
+
+            elif event.table == 'items':
+                if event.action == 'insert':
+                    for item_id, name, description, min_perm_level, locker_number in event.rows:
+                        self._remove_item(item_id)
+                        self._add_item(ItemRecord(item_id, name, description, min_perm_level, None, locker_number))
+                elif event.action == 'update':
+                    for item_id, name, description, min_perm_level, locker_number in event.rows:
+                        previous = self._remove_item(item_id)
+                        borrowed_by = previous.borrowed_by if previous is not None else None
+                        self._add_item(ItemRecord(item_id, name, description, min_perm_level, borrowed_by,
+                                                  locker_number))
+                elif event.action == 'delete':
+                    for item_id, in event.rows:
+                        self._remove_item(item_id)
+                elif event.action == 'checkout':
+                    for item_id, locker_number, emp_id in event.rows:
+                        self._set_borrowed_by(item_id, emp_id)
+                elif event.action == 'return':
+                    for item_id, locker_number in event.rows:
+                        self._set_borrowed_by(item_id, None)
+                elif event.action == 'wipe':
+                    for item_id in list(self.items):
+                        self._remove_item(item_id)
+
+            else:
+                return
+
+            self.version += 1
+
+    # DoorMonitor listener
+    def apply_door_event(self, event) -> None:
+        with self.lock:
+            self._set_door(event.board_addr, event.door, event.is_open)
+            self.version += 1
+
+    '''
+    ------------------------------READS------------------------------
+    '''
+
+    # Lockers with nothing stored in them
+    def free_lockers(self) -> list:
+        return _bits(self.existing & ~self.occupied)
+
+    # Lockers with at least one item stored in them
+    def occupied_lockers(self) -> list:
+        return _bits(self.existing & self.occupied)
+
+    # Lockers whose door was last reported open by a door poller
+    def open_lockers(self) -> list:
+        return _bits(self.open)
+
+    def is_locker_free(self, locker_number: int) -> bool:
+        bit = 1 << locker_number
+        return bool(self.existing & bit) and not self.occupied & bit
+
+    def is_door_open(self, locker_number: int) -> bool:
+        return bool(self.open & (1 << locker_number))
+
+    # Perm level of a locker, None if it does not exist
+    def locker_perm_level(self, locker_number: int):
+        if not self.existing & (1 << locker_number):
+            return None
+        return self.perm_levels[locker_number]
+
+    def get_item(self, item_id: str) -> ItemRecord:
+        return self.items.get(item_id)
+
+    # Items that are checked out to someone
+    def items_out(self) -> list:
+        with self.lock:
+            return [self.items[item_id] for item_ids in self.held_by.values() for item_id in item_ids]
+
+    def items_held_by(self, emp_id: str) -> list:
+        with self.lock:
+            return [self.items[item_id] for item_id in self.held_by.get(emp_id, ())]
+
+    # Every item assigned to a locker, including the ones that are checked out
+    def items_in_locker(self, locker_number: int) -> list:
+        with self.lock:
+            return [self.items[item_id] for item_id in self.locker_items.get(locker_number, ())]
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {'lockers': bin(self.existing).count('1'),
+                    'free_lockers': bin(self.existing & ~self.occupied).count('1'),
+                    'open_doors': bin(self.open).count('1'),
+                    'items': len(self.items),
+                    'items_out': sum(len(item_ids) for item_ids in self.held_by.values()),
+                    'version': self.version}
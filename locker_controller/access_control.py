@@ -0,0 +1,103 @@
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from database import locker_db
+from locker_controller import lock_controls
+from telemetry import metrics
+
+"""
+#--------------------ACCESS CONTROL--------------------#
+
+Badge swipe to open door in one call: the permission check and target locker come from a single indexed join
+(locker_db.get_unlock_target), the unlock frame comes straight out of the precomputed frame table and goes out on the
+already open port session.
+
+Time spent in each stage is recorded so slow swipes can be traced to the database, the frame lookup or the bus:
+    db     - permission check + locker lookup
+    frame  - unlock frame lookup
+    serial - write + reply from the board
+    total  - the whole call
+
+#--------------------ACCESS CONTROL END--------------------#
+"""
+
+unlock_stages = ('db', 'frame', 'serial', 'total')
+
+# Each stage is also recorded in telemetry.metrics as unlock.<stage>
+stage_metric_names = {stage: 'unlock.' + stage for stage in unlock_stages}
+
+# Latest samples per stage in nanoseconds
+latency_samples = 1024
+_stage_latency = {stage: deque(maxlen=latency_samples) for stage in unlock_stages}
+_stage_latency_lock = threading.Lock()
+
+
+def _record_stages(timings: dict) -> None:
+    with _stage_latency_lock:
+        for stage, elapsed in timings.items():
+            _stage_latency[stage].append(elapsed)
+
+    for stage, elapsed in timings.items():
+        metrics.record(stage_metric_names[stage], elapsed)
+
+
+# Summary of the recorded samples per stage: {stage: {'count', 'p50_ms', 'p99_ms', 'max_ms'}}
+def unlock_latency_summary() -> dict:
+    with _stage_latency_lock:
+        samples = {stage: sorted(values) for stage, values in _stage_latency.items()}
+
+    summary = {}
+    for stage, values in samples.items():
+        if not values:
+            summary[stage] = {'count': 0, 'p50_ms': None, 'p99_ms': None, 'max_ms': None}
+            continue
+
+        summary[stage] = {'count': len(values),
+                          'p50_ms': values[len(values) // 2] / 1e6,
+                          'p99_ms': values[min(len(values) - 1, len(values) * 99 // 100)] / 1e6,
+                          'max_ms': values[-1] / 1e6}
+
+    return summary
+
+
+def reset_unlock_latency() -> None:
+    with _stage_latency_lock:
+        for values in _stage_latency.values():
+            values.clear()
+
+
+# Check that the employee may take the item and open the locker it is in
+# Returns the send_command result (True, reply) if the door was unlocked, False, -1 if access was denied or the
+# board did not answer
+def authorize_and_unlock(cursor: sqlite3.Cursor, port: str, emp_id: str, item_id: str):
+    timings = {}
+    start = time.perf_counter_ns()
+
+    allowed, locker_number = locker_db.get_unlock_target(cursor, emp_id, item_id)
+    db_done = time.perf_counter_ns()
+    timings['db'] = db_done - start
+
+    if not allowed:
+        timings['total'] = db_done - start
+        _record_stages(timings)
+        return False, -1
+
+    board_addr, lock_addr = lock_controls.locker_address(locker_number)
+    found, frame = lock_controls.get_command_frame(board_addr, lock_addr, 'UI')
+    frame_done = time.perf_counter_ns()
+    timings['frame'] = frame_done - db_done
+
+    if not found:
+        timings['total'] = frame_done - start
+        _record_stages(timings)
+        return False, -1
+
+    result = lock_controls.send_command(port, frame, 'UI')
+    serial_done = time.perf_counter_ns()
+    timings['serial'] = serial_done - frame_done
+    timings['total'] = serial_done - start
+
+    _record_stages(timings)
+    return result
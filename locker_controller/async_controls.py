@@ -0,0 +1,173 @@
+import asyncio
+import functools
+import logging
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from locker_controller import lock_controls
+
+logger = logging.getLogger(__name__)
+
+"""
+#--------------------ASYNC COMMAND ENGINE--------------------#
+
+asyncio front end for send_command. Every port gets its own command queue and a single worker thread that owns
+the blocking serial I/O for that port, so one event loop can have a command in flight on every port at the same time.
+
+RS485 is half-duplex, so commands for boards that share a port are still sent one after another - the queue keeps
+them in order and the next frame goes out as soon as the previous reply has been matched. Replies are matched to their
+command by header, board address and lock address (see lock_controls.reply_matches), stray frames are skipped.
+
+Example:
+
+    results = await async_send_commands([('COM3', unlock_frame, 'UI'), ('COM4', lock_controls.query_all_doors, 'QA')])
+
+#--------------------ASYNC COMMAND ENGINE END--------------------#
+"""
+
+
+# Command queue + worker for a single port
+class PortWorker:
+    def __init__(self, port: str, max_pending: int = 256, max_batch: int = 32):
+        self.port = port
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rs485-{}'.format(port))
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    # Queue a command and wait for its (bool, response) result
+    async def submit(self, command: bytes, cmd_type: str):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((command, cmd_type, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self.queue.get()]
+
+            # Hand everything already queued to the port thread in one go instead of one executor hop per command
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            # Caller gave up waiting, don't put the frame on the bus
+            live = [(command, cmd_type, future) for command, cmd_type, future in batch if not future.cancelled()]
+
+            try:
+                if live:
+                    results = await loop.run_in_executor(self.executor, self._send_batch, live)
+
+                    for (command, cmd_type, future), result in zip(live, results):
+                        if future.done():
+                            continue
+                        if isinstance(result, Exception):
+                            future.set_exception(result)
+                        else:
+                            future.set_result(result)
+
+            except asyncio.CancelledError:
+                for command, cmd_type, future in live:
+                    if not future.done():
+                        future.set_result((False, -1))
+                raise
+
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    # Runs on the port thread, commands still go out one after another
+    def _send_batch(self, batch: list) -> list:
+        results = []
+
+        for command, cmd_type, future in batch:
+            try:
+                results.append(lock_controls.send_command(self.port, command, cmd_type))
+            except Exception as e:
+                results.append(e)
+
+        return results
+
+    async def close(self) -> None:
+        self.task.cancel()
+
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+        # Fail anything still waiting in the queue instead of leaving callers hanging
+        while not self.queue.empty():
+            command, cmd_type, future = self.queue.get_nowait()
+            if not future.done():
+                future.set_result((False, -1))
+
+        # Waiting for the command in flight (up to the UA timeout) must not block the event loop
+        await asyncio.get_running_loop().run_in_executor(None, functools.partial(self.executor.shutdown, wait=True))
+
+
+# Owns one PortWorker per port for the event loop it was created on
+class AsyncCommandEngine:
+    def __init__(self, max_pending: int = 256):
+        self.max_pending = max_pending
+        self.workers = {}
+
+    def worker(self, port: str) -> PortWorker:
+        worker = self.workers.get(port)
+
+        if worker is None:
+            worker = PortWorker(port, self.max_pending)
+            self.workers[port] = worker
+
+        return worker
+
+    async def send(self, port: str, command: bytes, cmd_type: str):
+        if cmd_type not in lock_controls.reply_sizes:
+            logger.warning('Command not recognized! Check spelling and letter order.')
+            return False, -1
+
+        return await self.worker(port).submit(command, cmd_type)
+
+    # Send a batch of (port, command, cmd_type) requests, results come back in the same order as the requests
+    async def send_many(self, requests) -> list:
+        return list(await asyncio.gather(*(self.send(port, command, cmd_type)
+                                           for port, command, cmd_type in requests)))
+
+    async def close(self) -> None:
+        workers = list(self.workers.values())
+        self.workers.clear()
+
+        for worker in workers:
+            await worker.close()
+
+
+# One default engine per running event loop
+_engines = weakref.WeakKeyDictionary()
+
+
+def get_engine() -> AsyncCommandEngine:
+    loop = asyncio.get_running_loop()
+    engine = _engines.get(loop)
+
+    if engine is None:
+        engine = AsyncCommandEngine()
+        _engines[loop] = engine
+
+    return engine
+
+
+# Async version of lock_controls.send_command, same (bool, response) return contract
+async def async_send_command(port: str, command: bytes, cmd_type: str):
+    return await get_engine().send(port, command, cmd_type)
+
+
+async def async_send_commands(requests) -> list:
+    return await get_engine().send_many(requests)
+
+
+# Stop the default engine's workers for the running loop, call before the loop shuts down
+async def close_engine() -> None:
+    engine = _engines.pop(asyncio.get_running_loop(), None)
+
+    if engine is not None:
+        await engine.close()
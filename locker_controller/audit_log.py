@@ -0,0 +1,253 @@
+import collections
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+from locker_controller import lock_controls
+
+logger = logging.getLogger(__name__)
+
+"""
+#--------------------AUDIT LOG--------------------#
+
+Append-only binary log of every command and reply frame that went through lock_controls.send_command, for working out
+after the fact what happened on the bus ("when did door 17 last open?").
+
+Records are a fixed 48 bytes, little endian:
+
+    timestamp_ns (8) | latency_us (4) | status (1) | cmd_code (1) | command_len (1) | reply_len (1) |
+    command (8) | reply (8) | port (16)
+
+status is one of status_reply / status_timeout / status_port_error, cmd_code is the index of the command type in
+cmd_types. Every file starts with a 64 byte header (magic, version, record size, capacity, record count) and is
+preallocated and memory mapped at its full size, so writing a record is one struct.pack_into into the mapping.
+When a file is full the next one is started, only the newest max_files files are kept.
+
+Readers map the files read-only and view the records as a numpy structured array without copying them, so millions
+of records can be filtered with vectorized comparisons.
+
+Example:
+
+    lock_controls.set_audit_log(AuditLog('audit'))
+    ...
+    last_door_open('audit', board_addr=1, door=17)   # AuditRecord(...) or None
+
+#--------------------AUDIT LOG END--------------------#
+"""
+
+cmd_types = ('UI', 'QI', 'QA', 'UA')
+_cmd_code_of = {cmd_type: code for code, cmd_type in enumerate(cmd_types)}
+
+status_reply = lock_controls.audit_reply
+status_timeout = lock_controls.audit_timeout
+status_port_error = lock_controls.audit_port_error
+
+magic = b'RPGAUDIT'
+version = 1
+header = struct.Struct('<8sHHII')
+header_size = 64
+record = struct.Struct('<QIBBBB8s8s16s')
+record_dtype = np.dtype([('timestamp_ns', '<u8'), ('latency_us', '<u4'), ('status', 'u1'), ('cmd_code', 'u1'),
+                         ('command_len', 'u1'), ('reply_len', 'u1'), ('command', 'u1', (8,)), ('reply', 'u1', (8,)),
+                         ('port', 'S16')])
+
+# Byte offset of the record count in the header
+_count_offset = 16
+
+AuditRecord = collections.namedtuple('AuditRecord', ['timestamp_ns', 'latency_us', 'status', 'cmd_type', 'command',
+                                                     'reply', 'port'])
+
+
+def _file_name(sequence: int) -> str:
+    return 'audit-{:06d}.log'.format(sequence)
+
+
+# Log files in a directory, oldest first
+def list_log_files(directory: str) -> list:
+    if not os.path.isdir(directory):
+        return []
+
+    names = sorted(name for name in os.listdir(directory) if name.startswith('audit-') and name.endswith('.log'))
+    return [os.path.join(directory, name) for name in names]
+
+
+class AuditLog:
+    def __init__(self, directory: str, records_per_file: int = 1 << 20, max_files: int = 8):
+        self.directory = directory
+        self.records_per_file = records_per_file
+        self.max_files = max_files
+        self.lock = threading.Lock()
+        self.file = None
+        self.map = None
+        self.count = 0
+        self.sequence = 0
+        # Port names encoded once, send_command only ever sees a handful of ports
+        self._port_names = {}
+
+        os.makedirs(directory, exist_ok=True)
+
+        # Carry on in the newest file after a restart if it still has room
+        files = list_log_files(directory)
+        if files:
+            self.sequence = int(os.path.basename(files[-1])[6:12])
+            if not self._open(files[-1]):
+                self._rotate()
+        else:
+            self._create(os.path.join(directory, _file_name(self.sequence)))
+
+    def _create(self, path: str) -> None:
+        size = header_size + record.size * self.records_per_file
+
+        with open(path, 'wb') as file:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(file.fileno(), 0, size)
+            else:
+                file.truncate(size)
+
+            file.write(header.pack(magic, version, record.size, self.records_per_file, 0))
+
+        self._open(path)
+
+    # Map an existing file for appending, False if it is full or not an audit log
+    def _open(self, path: str) -> bool:
+        self.file = open(path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        file_magic, file_version, record_size, capacity, count = header.unpack_from(self.map)
+
+        if file_magic != magic or record_size != record.size or count >= capacity:
+            self._close_file()
+            return False
+
+        self.records_per_file = capacity
+        self.count = count
+        return True
+
+    def _close_file(self) -> None:
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.map = None
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _rotate(self) -> None:
+        self._close_file()
+        self.sequence += 1
+        self._create(os.path.join(self.directory, _file_name(self.sequence)))
+
+        for path in list_log_files(self.directory)[:-self.max_files]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning('Could not remove old audit log %s: %s', path, e)
+
+    def record(self, port: str, cmd_type: str, command: bytes, reply: bytes, latency_ns: int, status: int) -> None:
+        port_name = self._port_names.get(port)
+        if port_name is None:
+            port_name = self._port_names[port] = port.encode()[:16]
+
+        with self.lock:
+            if self.map is None:
+                return
+
+            if self.count >= self.records_per_file:
+                self._rotate()
+
+            record.pack_into(self.map, header_size + self.count * record.size, time.time_ns(),
+                             min(latency_ns // 1000, 0xFFFFFFFF), status, _cmd_code_of.get(cmd_type, 0xFF),
+                             len(command), len(reply), command, reply, port_name)
+
+            # Count goes in after the record so a reader never sees a half written record
+            self.count += 1
+            struct.pack_into('<I', self.map, _count_offset, self.count)
+
+    def flush(self) -> None:
+        with self.lock:
+            if self.map is not None:
+                self.map.flush()
+
+    def close(self) -> None:
+        with self.lock:
+            self._close_file()
+
+
+# Records of one file as a read-only numpy structured array backed by the file itself (no copy)
+def read_records(path: str) -> np.ndarray:
+    with open(path, 'rb') as file:
+        file_magic, file_version, record_size, capacity, count = header.unpack(file.read(header.size))
+
+    if file_magic != magic or record_size != record.size:
+        logger.warning('%s is not an audit log file.', path)
+        return np.zeros(0, dtype=record_dtype)
+
+    if count == 0:
+        return np.zeros(0, dtype=record_dtype)
+
+    return np.memmap(path, dtype=record_dtype, mode='r', offset=header_size, shape=(count,))
+
+
+def to_audit_record(row) -> AuditRecord:
+    cmd_code = int(row['cmd_code'])
+
+    return AuditRecord(timestamp_ns=int(row['timestamp_ns']),
+                       latency_us=int(row['latency_us']),
+                       status=int(row['status']),
+                       cmd_type=cmd_types[cmd_code] if cmd_code < len(cmd_types) else None,
+                       command=row['command'][:row['command_len']].tobytes(),
+                       reply=row['reply'][:row['reply_len']].tobytes(),
+                       port=row['port'].decode(errors='replace'))
+
+
+# Every record in a directory, oldest first
+def iter_records(directory: str):
+    for path in list_log_files(directory):
+        for row in read_records(path):
+            yield to_audit_record(row)
+
+
+# Rows where the reply shows board_addr's door open: a UI/QI reply for the door with open_indicator, a QA reply with
+# the door's bit cleared or the echo of an unlock all. No rows for a door number that is not 1-24.
+def _door_open_rows(records: np.ndarray, board_addr: int, door: int, port: str = None) -> np.ndarray:
+    if not lock_controls.door_bit(door):
+        return np.zeros(len(records), dtype=bool)
+
+    reply = records['reply']
+    cmd_code = records['cmd_code']
+
+    rows = (records['status'] == status_reply) & (reply[:, 1] == board_addr)
+    if port is not None:
+        rows &= records['port'] == port.encode()[:16]
+
+    single = (((cmd_code == _cmd_code_of['UI']) | (cmd_code == _cmd_code_of['QI'])) & (reply[:, 2] == door)
+              & (reply[:, 3] == lock_controls.open_indicator))
+
+    # QA groups are doors 17-24, 9-16, 1-8 in reply bytes 2, 3, 4 - 1 = locked, 0 = open
+    group_byte = 4 - (door - 1) // 8
+    queried = (cmd_code == _cmd_code_of['QA']) & ((reply[:, group_byte] & (1 << (door - 1) % 8)) == 0)
+
+    return rows & (single | queried | (cmd_code == _cmd_code_of['UA']))
+
+
+# Latest record showing the door open, None if the logs never saw it open or the door number is not 1-24
+def last_door_open(directory: str, board_addr: int, door: int, port: str = None):
+    if not lock_controls.door_bit(door):
+        logger.warning('Door %s is not on a board, door numbers are 1-%s.', door, lock_controls.locks_per_board)
+        return None
+
+    for path in reversed(list_log_files(directory)):
+        records = read_records(path)
+        if records.size == 0:
+            continue
+
+        matches = np.flatnonzero(_door_open_rows(records, board_addr, door, port))
+        if matches.size:
+            return to_audit_record(records[matches[-1]])
+
+    return None
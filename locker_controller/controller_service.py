@@ -0,0 +1,364 @@
+import argparse
+import asyncio
+import errno
+import logging
+import os
+import signal
+import socket
+import stat
+import struct
+import threading
+import time
+
+from locker_controller import async_controls
+from locker_controller import lock_controls
+from telemetry import metrics
+
+logger = logging.getLogger(__name__)
+
+"""
+#--------------------CONTROLLER SERVICE--------------------#
+
+Long-running daemon that owns the RS485 ports so scripts no longer open the serial port themselves. Clients talk to it
+over a Unix domain socket, any number of client processes can be connected at once. Commands for the same port are
+queued and sent one after another by the async command engine (see async_controls), commands for different ports are
+in flight at the same time, and the port sessions stay open between requests.
+
+Wire protocol, all integers big endian. Every message is a 2 byte payload length followed by the payload:
+
+    request:  request_id (4) | cmd_code (1) | port name length (1) | port name | command frame
+    response: request_id (4) | status (1) | reply frame
+
+cmd_code is the index of the command type in cmd_codes, status is one of status_ok / status_failed / status_rejected.
+A client may write many requests before reading any responses, responses carry the request_id of their request and
+can come back in a different order when the requests were for different ports.
+
+Only the ports given with --port (or --simulate) are served. The socket file is created with socket_mode (owner and
+group read/write), run the daemon as the user/group allowed to drive the doors. A second daemon on the same socket
+path refuses to start while the first one still accepts connections.
+
+Start the daemon:
+
+    python -m locker_controller.controller_service --socket /tmp/rpg_locker.sock --port COM3
+    python -m locker_controller.controller_service --simulate SIM0   # simulated board for testing
+
+Use it from another process, same (bool, response) contract as lock_controls.send_command:
+
+    with ControllerClient('/tmp/rpg_locker.sock') as client:
+        client.send_command('COM3', frame, 'UI')
+
+#--------------------CONTROLLER SERVICE END--------------------#
+"""
+
+default_socket_path = '/tmp/rpg_locker.sock'
+
+# Permissions of the socket file, set before the daemon starts accepting connections
+socket_mode = 0o660
+
+cmd_codes = ('UI', 'QI', 'QA', 'UA')
+_cmd_code_of = {cmd_type: code for code, cmd_type in enumerate(cmd_codes)}
+
+status_ok = 0
+status_failed = 1
+status_rejected = 2
+
+length_prefix = struct.Struct('>H')
+request_header = struct.Struct('>IBB')
+response_header = struct.Struct('>IB')
+
+request_metric_name = 'service.request'
+
+
+def encode_request(request_id: int, port: str, command: bytes, cmd_type: str) -> bytes:
+    port_name = port.encode()
+    payload_size = request_header.size + len(port_name) + len(command)
+
+    return (length_prefix.pack(payload_size) + request_header.pack(request_id, _cmd_code_of[cmd_type], len(port_name))
+            + port_name + command)
+
+
+# payload -> (request_id, port, command, cmd_type), cmd_type is None for an unknown cmd_code
+def decode_request(payload: bytes):
+    request_id, cmd_code, port_size = request_header.unpack_from(payload)
+    start = request_header.size
+    port = payload[start:start + port_size].decode(errors='replace')
+    cmd_type = cmd_codes[cmd_code] if cmd_code < len(cmd_codes) else None
+
+    return request_id, port, bytes(payload[start + port_size:]), cmd_type
+
+
+def encode_response(request_id: int, status: int, reply: bytes = b'') -> bytes:
+    return length_prefix.pack(response_header.size + len(reply)) + response_header.pack(request_id, status) + reply
+
+
+# Remove a socket file left behind by a daemon that was killed, refuse if a daemon is still serving on it
+def _clear_stale_socket(socket_path: str) -> None:
+    try:
+        mode = os.stat(socket_path).st_mode
+    except FileNotFoundError:
+        return
+
+    if not stat.S_ISSOCK(mode):
+        raise OSError(errno.EEXIST, 'Not a socket, refusing to replace it', socket_path)
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except ConnectionRefusedError:
+        os.unlink(socket_path)
+        return
+    finally:
+        probe.close()
+
+    raise OSError(errno.EADDRINUSE, 'Another controller service is listening on this socket', socket_path)
+
+
+class ControllerService:
+    # ports - port names clients may use, requests for any other port are rejected
+    def __init__(self, socket_path: str = default_socket_path, ports=(), max_pending: int = 256):
+        self.ports = set(ports or ())
+        if not self.ports:
+            raise ValueError('ControllerService needs at least one allowed port')
+
+        self.socket_path = socket_path
+        self.engine = async_controls.AsyncCommandEngine(max_pending)
+        self.server = None
+        self._owns_socket = False
+        self.connections = 0
+        self.requests = 0
+
+    async def start(self) -> None:
+        _clear_stale_socket(self.socket_path)
+
+        # Bind and set the permissions before listen() so no connection is accepted with the default mode
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.bind(self.socket_path)
+            os.chmod(self.socket_path, socket_mode)
+        except OSError:
+            sock.close()
+            raise
+
+        self.server = await asyncio.start_unix_server(self._handle_client, sock=sock)
+        self._owns_socket = True
+        logger.info('Controller service listening on %s', self.socket_path)
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+        await self.engine.close()
+        lock_controls.close_all_port_sessions()
+
+        if self._owns_socket:
+            self._owns_socket = False
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+        logger.info('Controller service stopped')
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        pending = set()
+
+        try:
+            while True:
+                try:
+                    size = length_prefix.unpack(await reader.readexactly(length_prefix.size))[0]
+                    payload = await reader.readexactly(size)
+                except asyncio.IncompleteReadError:
+                    break
+
+                # Nothing after a malformed request can be trusted to be framed right, hang up so the client
+                # fails straight away instead of waiting for a response that never comes
+                try:
+                    request = decode_request(payload)
+                except (struct.error, IndexError):
+                    logger.warning('Malformed controller request, closing the connection')
+                    break
+
+                # Every request runs as its own task so a slow port doesn't hold up replies from the others
+                task = asyncio.ensure_future(self._handle_request(request, writer))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+
+        except (ConnectionError, OSError) as e:
+            logger.warning('Controller client connection lost: %s', e)
+
+        finally:
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+            writer.close()
+            self.connections -= 1
+
+    async def _handle_request(self, request: tuple, writer: asyncio.StreamWriter) -> None:
+        start = time.perf_counter_ns()
+        self.requests += 1
+        request_id, port, command, cmd_type = request
+
+        ok = False
+
+        if cmd_type is None or port not in self.ports or len(command) != lock_controls.command_size:
+            logger.warning('Rejected controller request for port %s', port)
+            response = encode_response(request_id, status_rejected)
+
+        else:
+            # Every request gets an answer, otherwise its client waits for its whole socket timeout
+            try:
+                ok, reply = await self.engine.send(port, command, cmd_type)
+            except Exception as e:
+                logger.error('Controller request for port %s failed. %s', port, e)
+
+            response = encode_response(request_id, status_ok, reply) if ok else encode_response(request_id,
+                                                                                               status_failed)
+
+        metrics.record(request_metric_name, time.perf_counter_ns() - start, ok)
+
+        if not writer.is_closing():
+            writer.write(response)
+            try:
+                await writer.drain()
+            except (ConnectionError, OSError):
+                pass
+
+
+# Blocking client, safe to share between threads (requests from different threads are sent one batch at a time)
+# If a batch times out or the daemon breaks the protocol the connection is closed, open a new client to carry on.
+class ControllerClient:
+    def __init__(self, socket_path: str = default_socket_path, timeout: float = 30.0):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+
+        try:
+            self.sock.connect(socket_path)
+        except OSError:
+            self.sock.close()
+            raise
+
+        self.reader = self.sock.makefile('rb')
+        self.lock = threading.Lock()
+        self.next_id = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.reader.close()
+        self.sock.close()
+
+    def send_command(self, port: str, command: bytes, cmd_type: str):
+        return self.send_commands([(port, command, cmd_type)])[0]
+
+    # Pipeline a batch of (port, command, cmd_type) requests, results come back in the same order as the requests
+    def send_commands(self, requests) -> list:
+        results = [(False, -1)] * len(requests)
+        if not requests:
+            return results
+
+        with self.lock:
+            index_of = {}
+            messages = []
+
+            for index, (port, command, cmd_type) in enumerate(requests):
+                if cmd_type not in _cmd_code_of:
+                    logger.warning('Command not recognized! Check spelling and letter order.')
+                    continue
+
+                request_id = self.next_id
+                self.next_id = (self.next_id + 1) & 0xFFFFFFFF
+                index_of[request_id] = index
+                messages.append(encode_request(request_id, port, command, cmd_type))
+
+            # Responses still owed after a timeout would be read as the answers to the next batch
+            try:
+                self.sock.sendall(b''.join(messages))
+
+                for _ in range(len(messages)):
+                    size = length_prefix.unpack(self._read(length_prefix.size))[0]
+                    payload = self._read(size)
+                    request_id, status = response_header.unpack_from(payload)
+
+                    if request_id not in index_of:
+                        raise ConnectionError('Controller service answered an unknown request')
+
+                    if status == status_ok:
+                        results[index_of[request_id]] = (True, payload[response_header.size:])
+
+            except (OSError, struct.error):
+                self.close()
+                raise
+
+        return results
+
+    def _read(self, size: int) -> bytes:
+        data = self.reader.read(size)
+        if len(data) != size:
+            raise ConnectionError('Controller service closed the connection')
+        return data
+
+
+# Wait until a daemon accepts connections on socket_path, returns False if it didn't come up in time
+def wait_for_service(socket_path: str = default_socket_path, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        try:
+            ControllerClient(socket_path, timeout=1.0).close()
+            return True
+        except OSError:
+            time.sleep(0.01)
+
+    return False
+
+
+# Run the daemon until SIGINT/SIGTERM
+# ports    - serial ports clients may use
+# simulate - port names to back with a simulated bus (boards 1 and 2) instead of real hardware, always allowed
+def run_service(socket_path: str = default_socket_path, ports=(), simulate=()) -> None:
+    if simulate:
+        from locker_controller import simulated_board
+
+        for port in simulate:
+            simulated_board.install_simulated_port(port, boards=[1, 2])
+
+    async def serve():
+        service = ControllerService(socket_path, list(ports or ()) + list(simulate))
+        stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, stopped.set)
+
+        await service.start()
+        try:
+            await stopped.wait()
+        finally:
+            await service.stop()
+
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='RS485 locker controller daemon.')
+    parser.add_argument('--socket', default=default_socket_path, help='Unix domain socket to listen on')
+    parser.add_argument('--port', action='append', dest='ports', default=[],
+                        help='Serial port clients may use, repeatable')
+    parser.add_argument('--simulate', action='append', default=[], help='Serve a simulated port with this name')
+    parser.add_argument('--log', default='controller_service.log', help='Log file')
+    args = parser.parse_args()
+
+    if not args.ports and not args.simulate:
+        parser.error('give at least one --port (or --simulate) the service may use')
+
+    metrics.configure_logging(args.log)
+
+    try:
+        run_service(args.socket, args.ports, args.simulate)
+    finally:
+        metrics.stop_logging()
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from locker_controller import frame_parser
+from locker_controller import lock_controls
+
+logger = logging.getLogger(__name__)
+
+"""
+#--------------------DOOR STATE MONITOR--------------------#
+
+Polls one board with a single Query All (QA) frame on a fixed interval and keeps the result as a 24-bit integer mask
+(see lock_controls.decode_door_mask). Status questions like "is door 17 open" are answered from the cached mask, so
+any number of callers can ask as often as they like without putting a single frame on the RS485 bus.
+
+Doors that changed between two consecutive polls are published as DoorEvents to every listener, so consumers can
+share one incremental stream instead of each running their own polling loop.
+
+Example:
+
+    monitor = DoorMonitor('COM3', interval=0.5)
+    monitor.start()
+    monitor.is_door_open(17)
+
+    for event in monitor.events():
+        print(event.door, event.is_open, event.timestamp)
+
+#--------------------DOOR STATE MONITOR END--------------------#
+"""
+
+# Every door locked
+all_doors_closed = (1 << 24) - 1
+
+# A single door opening or closing, timestamp is when the poll that saw the change completed
+DoorEvent = namedtuple('DoorEvent', ['port', 'board_addr', 'door', 'is_open', 'timestamp'])
+
+
+# Doors whose state differs between two door masks, as a list of (door, is_open)
+# XOR of the two masks leaves only the changed bits, which are then peeled off lowest first
+def diff_door_masks(previous: int, current: int) -> list:
+    changes = []
+    changed = previous ^ current
+
+    while changed:
+        bit = changed & -changed
+        changes.append((bit.bit_length(), not current & bit))
+        changed ^= bit
+
+    return changes
+
+
+class DoorMonitor:
+    def __init__(self, port: str, interval: float = 0.5, board_addr: int = 1):
+        self.port = port
+        self.interval = interval
+        self.board_addr = board_addr
+        self.command = lock_controls.generate_query_all_code(board_addr)
+
+        # Latest door mask (None until the first successful poll) and when it was read
+        self.mask = None
+        self.updated_at = None
+        self.failed_polls = 0
+
+        self._listeners = []
+        self._listeners_lock = threading.Lock()
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Send one QA frame and update the cached mask, return False if the board did not answer
+    def poll_once(self) -> bool:
+        sent, reply = lock_controls.send_command(self.port, self.command, 'QA')
+
+        if sent:
+            # Only a checksum-valid QA reply from this board may change the cached mask
+            decoded, status = frame_parser.parse_reply(reply)
+
+            if decoded and type(status) is frame_parser.StatusReply and status.board_addr == self.board_addr:
+                mask = status.mask
+                previous = self.mask
+                self.mask = mask
+                self.updated_at = time.time()
+
+                if previous is not None and previous != mask:
+                    self._publish([DoorEvent(self.port, self.board_addr, door, is_open, self.updated_at)
+                                   for door, is_open in diff_door_masks(previous, mask)])
+                return True
+
+        self.failed_polls += 1
+        return False
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            started = time.monotonic()
+
+            # An unexpected error on one poll must not end the polling thread
+            try:
+                self.poll_once()
+            except Exception as e:
+                logger.error('Door poll on %s failed. %s', self.port, e)
+                self.failed_polls += 1
+
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='door-monitor-{}'.format(self.port), daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # True if the door is open, False if locked, None if no poll has succeeded yet or the door number is not 1-24
+    def is_door_open(self, door: int):
+        mask = self.mask
+        bit = lock_controls.door_bit(door)
+        if mask is None or not bit:
+            return None
+
+        return not mask & bit
+
+    # Door numbers (1-24) that are currently open
+    def open_doors(self) -> list:
+        mask = self.mask
+        if mask is None:
+            return []
+
+        open_mask = ~mask & all_doors_closed
+        return [door for door in range(1, 25) if open_mask & lock_controls.door_bit(door)]
+
+    # Listeners are called with each DoorEvent from the polling thread, they should return quickly
+    def add_listener(self, listener) -> None:
+        with self._listeners_lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener) -> None:
+        with self._listeners_lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def _publish(self, events: list) -> None:
+        with self._listeners_lock:
+            listeners = list(self._listeners)
+
+        for listener in listeners:
+            try:
+                for event in events:
+                    listener(event)
+
+            # A broken consumer must not stop the poller or the other consumers
+            except Exception as e:
+                logger.error('Door event listener failed, removing it. %s', e)
+                self.remove_listener(listener)
+
+    # Blocking stream of DoorEvents, stops after timeout seconds without a change (None = wait forever)
+    def events(self, timeout: float = None):
+        pending = queue.Queue()
+        listener = pending.put
+        self.add_listener(listener)
+
+        try:
+            while True:
+                try:
+                    yield pending.get(timeout=timeout)
+                except queue.Empty:
+                    return
+
+        finally:
+            self.remove_listener(listener)
+
+    # Async iterator version of events() for use inside an event loop
+    async def async_events(self):
+        loop = asyncio.get_running_loop()
+        pending = asyncio.Queue()
+
+        def listener(event):
+            loop.call_soon_threadsafe(pending.put_nowait, event)
+
+        self.add_listener(listener)
+
+        try:
+            while True:
+                yield await pending.get()
+
+        finally:
+            self.remove_listener(listener)
@@ -0,0 +1,145 @@
+import collections
+import logging
+
+from locker_controller import lock_controls
+
+logger = logging.getLogger(__name__)
+
+"""
+#--------------------FRAME PARSER--------------------#
+
+Strict parser for reply frames. The frame type comes from the header and function code, not the length, and the
+XOR check byte is verified (computed the same way as generate_check_code) before anything is read out of the frame,
+so a corrupted reply is rejected instead of turning into a wrong door state.
+
+Frames are read in place through a memoryview (bytes, bytearray, memoryview, mmap or a slice of a larger buffer all
+work), no intermediate bytes objects are made. Each valid frame becomes one small immutable record:
+
+    LockReply(cmd_type, board_addr, lock_addr, is_open)     UI / QI reply, [header, board, lock, status, check]
+    UnlockAllReply(board_addr)                              UA reply, echo of [0x8A, board, 0x00, 0x11, check]
+    StatusReply(board_addr, mask)                           QA reply, [0x80, board, g3, g2, g1, 0x33, check]
+
+mask uses the same layout as lock_controls.decode_door_mask: bit (n - 1) is door n, 1 = locked door, 0 = open door.
+
+Example:
+
+    ok, reply = parse_reply(port_resp)   # True, LockReply(cmd_type='UI', board_addr=1, lock_addr=3, is_open=True)
+
+#--------------------FRAME PARSER END--------------------#
+"""
+
+LockReply = collections.namedtuple('LockReply', ['cmd_type', 'board_addr', 'lock_addr', 'is_open'])
+UnlockAllReply = collections.namedtuple('UnlockAllReply', ['board_addr'])
+
+
+class StatusReply(collections.namedtuple('StatusReply', ['board_addr', 'mask'])):
+    __slots__ = ()
+
+    # None for a door number that is not 1-24
+    def is_door_open(self, door: int) -> bool:
+        bit = lock_controls.door_bit(door)
+        return not self.mask & bit if bit else None
+
+
+lock_reply_size = lock_controls.reply_sizes['UI']
+status_reply_size = lock_controls.reply_sizes['QA']
+_lock_states = (lock_controls.open_indicator, lock_controls.closed_indicator)
+
+
+# Reply type from the header and function code, None if it is not a well formed reply frame.
+# Does not check the check byte, see parse_reply.
+def frame_type(frame, start: int = 0, end: int = None) -> str:
+    view = memoryview(frame)
+    size = (len(view) if end is None else end) - start
+
+    if size == lock_reply_size:
+        header = view[start]
+
+        if header == lock_controls.unlock_header:
+            lock_addr = view[start + 2]
+
+            if lock_addr == 0:
+                return 'UA' if view[start + 3] == lock_controls.fxn_code_unlock else None
+
+            if lock_addr <= lock_controls.locks_per_board and view[start + 3] in _lock_states:
+                return 'UI'
+
+        elif header == lock_controls.indv_query_header:
+            lock_addr = view[start + 2]
+
+            if 1 <= lock_addr <= lock_controls.locks_per_board and view[start + 3] in _lock_states:
+                return 'QI'
+
+    elif size == status_reply_size:
+        if view[start] == lock_controls.indv_query_header and view[start + 5] == lock_controls.indv_query_fxn:
+            return 'QA'
+
+    return None
+
+
+# Same check as lock_controls.frame_checksum_ok over frame[start:end] without slicing it out
+def checksum_ok(view: memoryview, start: int, end: int) -> bool:
+    check = 0
+    for index in range(start, end):
+        check ^= view[index]
+
+    return check == 0
+
+
+# Parse frame[start:end] (the whole frame by default) into a reply record
+# Returns True, record or False, None if the frame type is unknown or the check byte is wrong
+def parse_reply(frame, start: int = 0, end: int = None) -> (bool, tuple):
+    try:
+        view = memoryview(frame)
+    except TypeError:
+        logger.warning('Error! Reply is not a bytes-like object.')
+        return False, None
+
+    end = len(view) if end is None else end
+    cmd_type = frame_type(view, start, end)
+
+    if cmd_type is None:
+        logger.warning('Error! Not a recognized reply frame.')
+        return False, None
+
+    if not checksum_ok(view, start, end):
+        logger.warning('Error! Reply check byte does not match, frame is corrupted.')
+        return False, None
+
+    return True, _record(view, start, cmd_type)
+
+
+def _record(view: memoryview, start: int, cmd_type: str) -> tuple:
+    board_addr = view[start + 1]
+
+    if cmd_type == 'QA':
+        #                  g1(17-24)                    g2(9-16)                 g3(1-8)
+        mask = (view[start + 2] << 16) | (view[start + 3] << 8) | view[start + 4]
+        return StatusReply(board_addr, mask)
+
+    if cmd_type == 'UA':
+        return UnlockAllReply(board_addr)
+
+    return LockReply(cmd_type, board_addr, view[start + 2], view[start + 3] == lock_controls.open_indicator)
+
+
+# Records for every valid reply in a buffer of back-to-back frames (e.g. a capture of the bus), in order.
+# Bytes that do not start a valid frame are skipped one at a time until the next valid frame lines up.
+def parse_replies(buffer):
+    view = memoryview(buffer)
+    position = 0
+    size = len(view)
+
+    while position < size:
+        for frame_size in (status_reply_size, lock_reply_size):
+            end = position + frame_size
+            if end > size:
+                continue
+
+            cmd_type = frame_type(view, position, end)
+            if cmd_type is not None and checksum_ok(view, position, end):
+                yield _record(view, position, cmd_type)
+                position = end
+                break
+        else:
+            position += 1
@@ -1,6 +1,17 @@
+import atexit
+import logging
+import struct
+import threading
+import time
+from collections import deque
+
 import serial.rs485
 import serial
 
+from telemetry import metrics
+
+logger = logging.getLogger(__name__)
+
 """
 #--------------------CONSTANTS BEGIN--------------------#
 """
@@ -24,6 +35,28 @@ closed_indicator = 17  # 0x11, also used to indicate failed unlock sequence for
 # Lock status query for all locks
 steps = [0x01, 0x02, 0x04, 0x08, 0x10, 0x20, 0x40, 0x80]
 
+# Serial settings shared by every port session
+baud_rate = 9600
+default_timeout = 0.75  # Seconds to wait for UI/QI/QA replies
+unlock_all_timeout = 10  # UA only replies once the board has cycled all 24 doors
+
+# Expected reply length for each command type
+reply_sizes = {'UI': 5, 'QI': 5, 'QA': 7, 'UA': 5}
+
+# Every command frame is [header, board_addr, lock_addr, fxn_code, check]
+command_size = 5
+
+# Adaptive read timeouts: once a board has answered adaptive_min_samples times, a command to it waits
+# p99 response time * adaptive_timeout_multiplier + adaptive_timeout_margin (never less than adaptive_min_timeout
+# and never more than the fixed timeouts above). Every timeout in a row doubles the wait until the board answers again,
+# at most adaptive_max_doublings times.
+adaptive_timeouts = True
+adaptive_min_samples = 20
+adaptive_min_timeout = 0.05
+adaptive_timeout_multiplier = 3.0
+adaptive_timeout_margin = 0.01
+adaptive_max_doublings = 8
+
 """
 Each of these represent the value that is added to a running total for 3 groups of 8 doors.
 Easy solution to check which doors are open for each group of doors is to convert the returned value into 
@@ -69,24 +102,84 @@ def generate_check_code(header: bytes, board_addr: int, lock_addr: int, lock_sta
         return True, checksum
 
     except TypeError:
-        print('Input number must be some sort of integer representation (binary, hex, decimal).')
+        logger.warning('Input number must be some sort of integer representation (binary, hex, decimal).')
         return False, -1
 
 
 # Generate a hex code string that can be sent to a COM port to unlock an indiv. door
 # Can also be used to generate an indiv. query command code - only difference is header + function code
+# UI/QI frames come straight out of the precomputed frame table, anything else is built on the spot
 def generate_unlock_code(header: bytes, board_addr: int, lock_addr: int, function_code: bytes) -> (bool, bytes):
     # Pattern: [Cmd header, board address, lock address, fxn_code, check]
+    try:
+        cached = _frame_codes_table.get((header, board_addr, lock_addr, function_code))
+        if cached is not None:
+            return cached
+
+    except TypeError:
+        # Unhashable input, let generate_check_code report it
+        pass
 
     check_code = generate_check_code(header=header,
                                      board_addr=board_addr,
                                      lock_addr=lock_addr,
                                      lock_state=function_code)
     if not check_code[0]:
-        print('Check Code < 0. An error has occurred! Check logs.')
+        logger.error('Check Code < 0. An error has occurred!')
+        return False, b''
+
+    return True, bytes([header, board_addr, lock_addr, function_code, check_code[1]])
+
+
+"""
+Every valid UI and QI frame is known ahead of time (24 locks per board, 2 command types), so they are built once per
+board and looked up afterwards instead of being rebuilt for every unlock. The default board is built at import, any
+other board the first time one of its frames is asked for.
+"""
+locks_per_board = 24
+
+# Header + function code for each per-lock command type
+frame_codes = {'UI': (unlock_header, fxn_code_unlock), 'QI': (indv_query_header, indv_query_fxn)}
+
+# (board_addr, lock_addr, cmd_type) -> (True, frame)
+_frame_table = {}
+
+# (header, board_addr, lock_addr, function_code) -> (True, frame), used by generate_unlock_code
+_frame_codes_table = {}
+
+
+def build_frame_table(board_addr: int) -> None:
+    for cmd_type, (header, function_code) in frame_codes.items():
+        for lock_addr in range(1, locks_per_board + 1):
+            entry = (True, bytes([header, board_addr, lock_addr, function_code,
+                                  header ^ board_addr ^ lock_addr ^ function_code]))
+
+            _frame_table[(board_addr, lock_addr, cmd_type)] = entry
+            _frame_codes_table[(header, board_addr, lock_addr, function_code)] = entry
+
+
+# Board and lock address for a locker number - lockers 1-24 are on board 1, 25-48 on board 2 and so on
+def locker_address(locker_number: int) -> (int, int):
+    return (locker_number - 1) // locks_per_board + 1, (locker_number - 1) % locks_per_board + 1
+
+
+# Look up the UI or QI frame for a lock, returns True, frame or False, b'' for an invalid board/lock/command
+def get_command_frame(board_addr: int, lock_addr: int, cmd_type: str) -> (bool, bytes):
+    entry = _frame_table.get((board_addr, lock_addr, cmd_type))
+    if entry is not None:
+        return entry
+
+    if cmd_type not in frame_codes or type(board_addr) != int or not 0 <= board_addr <= 0xFF \
+            or type(lock_addr) != int or not 1 <= lock_addr <= locks_per_board:
+        logger.warning('No %s frame for board %s lock %s. Check the addresses and command type.', cmd_type, board_addr,
+                       lock_addr)
         return False, b''
 
-    return True, bytes([header, board_code, lock_addr, function_code, check_code[1]])
+    build_frame_table(board_addr)
+    return _frame_table[(board_addr, lock_addr, cmd_type)]
+
+
+build_frame_table(board_code)
 
 
 # Convert a hex bytestring into binary: b'\x8a\x01\x0b\x00\x80' to a list of 8-bit binary sequences
@@ -94,7 +187,7 @@ def bytes_to_binary(byte_str: bytes) -> (bool, list):
     bin_vals = []
 
     if type(byte_str) != bytes:
-        print('Error! These are not bytes.')
+        logger.warning('Error! These are not bytes.')
         return False, bin_vals
 
     try:
@@ -112,65 +205,368 @@ def bytes_to_binary(byte_str: bytes) -> (bool, list):
         return True, bin_vals
 
     except TypeError as e1:
-        print('Incorrect format for input - check that input is Bytes.')
-        print(e1)
+        logger.warning('Incorrect format for input - check that input is Bytes. %s', e1)
         return False, bin_vals
 
 
+# Generate the Query All command for a board, for board 1 this is the same as query_all_doors
+def generate_query_all_code(board_addr: int) -> bytes:
+    return bytes([indv_query_header, board_addr, 0, indv_query_fxn,
+                  indv_query_header ^ board_addr ^ indv_query_fxn])
+
+
+# Bit for a door (1-24) inside a 24-bit door mask - steps gives the bit inside a group of 8 doors
+# and each group sits 8 bits higher than the one before it (doors 1-8 in the low byte)
+# 0 for a door number that is not on a board, so it never matches a door in a mask
+def door_bit(door: int) -> int:
+    if type(door) is not int or not 1 <= door <= locks_per_board:
+        return 0
+
+    return steps[(door - 1) % 8] << (8 * ((door - 1) // 8))
+
+
+# Decode a QA reply straight into a 24-bit door mask without going through bytes_to_binary
+# Bit (n - 1) is door n, 1 = locked door, 0 = open door
+# A frame with the wrong header, function code or check byte is rejected (see frame_parser for the other replies)
+def decode_door_mask(reply: bytes) -> (bool, int):
+    if type(reply) not in (bytes, bytearray, memoryview) or len(reply) != reply_sizes['QA'] \
+            or reply[0] != indv_query_header or reply[5] != indv_query_fxn:
+        logger.warning('Error! Not a Query All reply.')
+        return False, -1
+
+    if not frame_checksum_ok(reply):
+        logger.warning('Error! Query All reply check byte does not match, frame is corrupted.')
+        return False, -1
+
+    #         g1(17-24)           g2(9-16)          g3(1-8)
+    return True, (reply[2] << 16) | (reply[3] << 8) | reply[4]
+
+
+# Every command and reply ends with a check byte that is the XOR of the bytes before it,
+# so XOR-ing a whole valid frame together gives 0
+def frame_checksum_ok(frame) -> bool:
+    check = 0
+    for value in frame:
+        check ^= value
+
+    return check == 0 and len(frame) > 1
+
+
+# Recent response times of one board for one kind of command, used to pick a read timeout
+class ResponseTimeTracker:
+    def __init__(self, samples: int = 256):
+        self.samples = deque(maxlen=samples)
+        self.timeouts_in_row = 0
+        self.recorded = 0
+        self._p99 = None
+
+    def record(self, elapsed: float) -> None:
+        self.samples.append(elapsed)
+        self.timeouts_in_row = 0
+        self.recorded += 1
+
+        # Recompute the percentile every 16 samples rather than sorting on every command
+        if self.recorded % 16 == 0:
+            self._p99 = None
+
+    def record_timeout(self) -> None:
+        self.timeouts_in_row += 1
+
+    def percentile(self, fraction: float) -> float:
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+    def timeout(self, max_timeout: float) -> float:
+        if not adaptive_timeouts or len(self.samples) < adaptive_min_samples:
+            return max_timeout
+
+        if self._p99 is None:
+            self._p99 = self.percentile(0.99)
+
+        wait = max(adaptive_min_timeout, self._p99 * adaptive_timeout_multiplier + adaptive_timeout_margin)
+        # Capped so a board that has been dead for hours doesn't overflow the float
+        return min(max_timeout, wait * (2 ** min(self.timeouts_in_row, adaptive_max_doublings)))
+
+
+# Check that a reply frame belongs to the command that was sent
+# Every reply echoes the command header and board address. UI/QI replies also echo the lock address and
+# QA replies carry the function code in byte 5 after the 3 door group bytes.
+def reply_matches(command: bytes, reply: bytes, cmd_type: str) -> bool:
+    if len(reply) != reply_sizes.get(cmd_type) or reply[0] != command[0] or reply[1] != command[1]:
+        return False
+
+    if cmd_type == 'UI' or cmd_type == 'QI':
+        return reply[2] == command[2]
+
+    if cmd_type == 'QA':
+        return reply[5] == command[3]
+
+    return True
+
+
+# Port name -> factory(port) for ports that are not real RS485 adapters, e.g. a simulated board for load tests.
+# A factory returns an open serial-like object with write, read, reset_input_buffer, close, timeout and is_open.
+_transport_factories = {}
+
+
+# Route a port name to a different transport. Any open session on that port is closed so the next command uses it.
+def register_transport(port: str, factory) -> None:
+    _transport_factories[port] = factory
+    close_port_session(port)
+
+
+def unregister_transport(port: str) -> None:
+    _transport_factories.pop(port, None)
+    close_port_session(port)
+
+
+def _open_transport(port: str):
+    factory = _transport_factories.get(port)
+
+    if factory is not None:
+        return factory(port)
+
+    return serial.rs485.RS485(port=port,
+                              baudrate=baud_rate,
+                              stopbits=serial.STOPBITS_ONE,
+                              timeout=default_timeout,
+                              rtscts=False)
+
+
+# A long-lived connection to one RS485 port. The serial handle is opened on first use and kept open between
+# commands so that each unlock/query only pays for the frame itself, not for port setup.
+# If the port drops (SerialException or a USB disconnect) the handle is thrown away and re-opened on the next command.
+class PortSession:
+    def __init__(self, port: str):
+        self.port = port
+        self.ser = None
+        # RS485 is half-duplex, only one command/reply exchange can be on the bus at a time
+        self.lock = threading.Lock()
+        # (board_addr, cmd_type) -> ResponseTimeTracker
+        self.response_times = {}
+
+    def open(self):
+        if self.ser is None or not self.ser.is_open:
+            self.ser = _open_transport(self.port)
+        return self.ser
+
+    def close(self) -> None:
+        if self.ser is not None:
+            try:
+                self.ser.close()
+            except (serial.SerialException, OSError, TypeError):
+                pass
+        self.ser = None
+
+    # Write a command and read back the first checksum-valid reply of read_size bytes
+    # Bytes are parsed as they arrive and the reply is returned as soon as it is complete, noise or a corrupted frame
+    # in front of it is skipped. If match is given, replies it rejects (e.g. a late reply to an earlier command) are
+    # skipped too. Returns b'' if no valid reply arrived within the timeout.
+    # timeout is the upper bound - with a tracker key (e.g. (board, cmd_type)) the wait adapts to how fast that board
+    # has been answering (see ResponseTimeTracker).
+    # A failed write is retried once on a fresh handle since the frame never made it onto the bus. A failed read is
+    # not retried (the board may already have acted on the command), the handle is dropped and the error re-raised.
+    def transact(self, command: bytes, read_size: int, timeout: float, match=None, key=None) -> bytes:
+        with self.lock:
+            tracker = None
+            if key is not None:
+                tracker = self.response_times.get(key)
+                if tracker is None:
+                    tracker = self.response_times[key] = ResponseTimeTracker()
+                timeout = tracker.timeout(timeout)
+
+            for attempt in range(2):
+                try:
+                    ser = self.open()
+                    # Throw away any late reply left over from a previous timed-out command
+                    ser.reset_input_buffer()
+                    ser.write(command)
+                    sent_at = time.monotonic()
+
+                except (serial.SerialException, OSError, TypeError):
+                    self.close()
+                    if attempt == 1:
+                        raise
+                    continue
+
+                try:
+                    port_resp = self._read_frame(ser, read_size, sent_at + timeout, match)
+
+                except (serial.SerialException, OSError, TypeError):
+                    self.close()
+                    raise
+
+                if tracker is not None:
+                    if port_resp:
+                        tracker.record(time.monotonic() - sent_at)
+                    else:
+                        tracker.record_timeout()
+
+                return port_resp
+
+    @staticmethod
+    def _read_frame(ser, read_size: int, deadline: float, match) -> bytes:
+        buffer = bytearray()
+
+        while True:
+            # Slide along the buffer one byte at a time until a complete, valid frame lines up at the front
+            while len(buffer) >= read_size:
+                frame = bytes(buffer[:read_size])
+
+                if frame_checksum_ok(frame) and (match is None or match(frame)):
+                    return frame
+
+                del buffer[0]
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return b''
+
+            # Only ask for the bytes still missing so read() returns the moment the frame is complete
+            ser.timeout = remaining
+            chunk = ser.read(read_size - len(buffer))
+
+            if not chunk:
+                return b''
+
+            buffer += chunk
+
+
+# Per board response times and the read timeout currently used for them on one port
+# {(board_addr, cmd_type): {'samples', 'p50_ms', 'p99_ms', 'timeout_ms'}}
+def get_response_times(port: str) -> dict:
+    session = get_port_session(port)
+    max_timeouts = {False: default_timeout, True: unlock_all_timeout}
+
+    with session.lock:
+        return {key: {'samples': len(tracker.samples),
+                      'p50_ms': tracker.percentile(0.5) * 1e3,
+                      'p99_ms': tracker.percentile(0.99) * 1e3,
+                      'timeout_ms': tracker.timeout(max_timeouts[key[1] == 'UA']) * 1e3}
+                for key, tracker in session.response_times.items()}
+
+
+# Pool of open port sessions keyed by port name, e.g. 'COM3' or '/dev/ttyUSB0'
+_port_sessions = {}
+_port_sessions_lock = threading.Lock()
+
+
+# Return the session for a port, creating it if this is the first command sent to that port
+def get_port_session(port: str) -> PortSession:
+    with _port_sessions_lock:
+        session = _port_sessions.get(port)
+
+        if session is None:
+            session = PortSession(port)
+            _port_sessions[port] = session
+
+        return session
+
+
+# Close and forget the session for a single port
+def close_port_session(port: str) -> None:
+    with _port_sessions_lock:
+        session = _port_sessions.pop(port, None)
+
+    if session is not None:
+        with session.lock:
+            session.close()
+
+
+def close_all_port_sessions() -> None:
+    with _port_sessions_lock:
+        ports = list(_port_sessions)
+
+    for port in ports:
+        close_port_session(port)
+
+
+atexit.register(close_all_port_sessions)
+
+
+# Metric name for each command type, e.g. 'serial.UI'
+serial_metric_names = {cmd_type: 'serial.' + cmd_type for cmd_type in reply_sizes}
+
+
+# Optional record of every command/reply frame (see audit_log.AuditLog), None = not recorded
+audit_log = None
+
+# Audit record status codes (audit_log.status_reply / status_timeout / status_port_error)
+audit_reply = 0
+audit_timeout = 1
+audit_port_error = 2
+
+
+def set_audit_log(log) -> None:
+    global audit_log
+    audit_log = log
+
+
+# Metrics + audit record for one finished send_command call
+def _finish_command(port: str, command: bytes, cmd_type: str, reply: bytes, start: int, status: int) -> None:
+    elapsed = time.perf_counter_ns() - start
+    metrics.record(serial_metric_names[cmd_type], elapsed, status == audit_reply)
+
+    if audit_log is not None:
+        try:
+            audit_log.record(port, cmd_type, command, reply, elapsed, status)
+        except (OSError, ValueError, struct.error) as e:
+            logger.error('Could not write audit record for port %s. %s', port, e)
+
+
 # Send a command to unlock an indiv. door
 # Return True, response if the message is sent and a reply is read successfully
 # Return False, error_code if exception or port timeout occurs
-# Eventually replace all print statements with logging
+# Latency and success of every command is recorded under serial.<cmd_type> (see telemetry.metrics)
 # Reply format: [cmd_header, board_addr, lock_addr, lock_status, check_code]
+# The port is kept open between calls (see PortSession), it is not opened and closed for every command
 def send_command(port: str, command: bytes, cmd_type: str):
+    # UA = Unlock All, UI = Unlock individual, QI = Query Individual, QA = Query All
+    # UI/QI response format: [header, board_addr, lock_addr, unlock state, check]
+    # QA response format: [header, board_addr, state 17-24, state 9-16, state 1-8, fxn_code, check]
+    # UA response format seems to be same as code: [header, board_addr, lock_addr, fxn_code, check]
+    if cmd_type not in reply_sizes:
+        logger.warning('Command not recognized! Check spelling and letter order.')
+        return False, -1
+
     try:
-        ser = serial.rs485.RS485(port=port,
-                                 baudrate=9600,
-                                 stopbits=serial.STOPBITS_ONE,
-                                 timeout=0.75,
-                                 rtscts=False)
-
-        # UA = Unlock All, UI = Unlock individual, QI = Query Individual, QA = Query All
-        if ser.is_open:
-            ser.write(command)
-            # Response format: [header, board_addr, lock_addr, unlock state, check]
-            if cmd_type == 'UI' or cmd_type == 'QI':
-                port_resp = ser.read(size=5)
-
-            # Response format: [header, board_addr, state 17-24, state 9-16, state 1-8, fxn_code, check]
-            elif cmd_type == 'QA':
-                port_resp = ser.read(size=7)
-
-            # Response format seems to be same as code: [header, board_addr, lock_addr, fxn_code, check]
-            # b'\x8a\x01\x00\x11\x9a'
-            elif cmd_type == 'UA':
-                # Give the board time to unlock all boards before responding
-                ser.timeout = 10
-                port_resp = ser.read(size=5)
-
-            else:
-                print('Command not recognized! Check spelling and letter order.')
-                return False, -1
-
-            if port_resp:
-                print('Data received from port {}'.format(port))
-                print('Response: {}'.format(port_resp))
-                ser.close()
-                return True, port_resp
-
-            else:
-                print('Port timeout has occurred, try reconnecting to port {}.'.format(port))
-                ser.close()
-                return False, -1
+        wrong_size = len(command) != command_size
+    except TypeError:
+        wrong_size = True
+
+    if wrong_size:
+        logger.warning('Command frame must be %s bytes long. Nothing was sent to port %s.', command_size, port)
+        return False, -1
+
+    # Give the board time to unlock all boards before responding
+    timeout = unlock_all_timeout if cmd_type == 'UA' else default_timeout
+    start = time.perf_counter_ns()
+
+    try:
+        port_resp = get_port_session(port).transact(command, reply_sizes[cmd_type], timeout,
+                                                    match=lambda reply: reply_matches(command, reply, cmd_type),
+                                                    key=(command[1], cmd_type))
 
     except serial.SerialException as e2:
-        print('No data was received from port. Check port connection settings + physical connector.')
-        print(e2)
+        _finish_command(port, command, cmd_type, b'', start, audit_port_error)
+        logger.error('No data was received from port %s. Check port connection settings + physical connector. %s',
+                     port, e2)
         return False, -1
 
-    except TypeError as e3:
-        print('Physical disconnect of USB to RS485 adapter detected, check physical connections.')
-        print(e3)
+    except (TypeError, OSError) as e3:
+        _finish_command(port, command, cmd_type, b'', start, audit_port_error)
+        logger.error('Physical disconnect of USB to RS485 adapter detected on port %s, check physical connections. %s',
+                     port, e3)
+        return False, -1
+
+    if port_resp:
+        _finish_command(port, command, cmd_type, port_resp, start, audit_reply)
+        logger.debug('Data received from port %s, response: %s', port, port_resp)
+        return True, port_resp
+
+    else:
+        _finish_command(port, command, cmd_type, b'', start, audit_timeout)
+        logger.warning('Port timeout has occurred, try reconnecting to port %s.', port)
         return False, -1
 
 
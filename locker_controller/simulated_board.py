@@ -0,0 +1,221 @@
+import random
+import threading
+import time
+
+import serial
+
+from locker_controller import lock_controls
+
+"""
+#--------------------SIMULATED LOCKER BOARD--------------------#
+
+In-memory stand-in for the RS485 bus and its locker boards so the control path can be load tested and benchmarked
+without hardware. The simulated bus speaks the same frame protocol as the real boards:
+
+    UI  [unlock_header, board, lock, fxn_code_unlock, check]   -> [unlock_header, board, lock, status, check]
+    UA  full_open_cmd                                           -> echo of the command
+    QI  [indv_query_header, board, lock, indv_query_fxn, check] -> [indv_query_header, board, lock, status, check]
+    QA  query_all_doors                                         -> [indv_query_header, board, g3, g2, g1, fxn, check]
+
+Frames with a bad check code or for a board that is not on the bus get no reply, like the real thing.
+Latency and faults (dropped replies, corrupted check codes, disconnects) can be configured per bus.
+
+Example:
+
+    bus = install_simulated_port('SIM0', boards=[1, 2], latency=0.002)
+    lock_controls.send_command('SIM0', lock_controls.get_command_frame(2, 5, 'UI')[1], 'UI')
+    bus.boards[2].is_door_open(5)   # True
+
+#--------------------SIMULATED LOCKER BOARD END--------------------#
+"""
+
+all_doors_closed = (1 << 24) - 1
+
+
+def _with_check(frame: list) -> bytes:
+    check = 0
+    for value in frame:
+        check ^= value
+
+    return bytes(frame + [check])
+
+
+# 24 doors on one board, bit (n - 1) of closed_mask is door n, 1 = locked door, 0 = open door
+class SimulatedBoard:
+    def __init__(self, board_addr: int = lock_controls.board_code, jammed_doors=()):
+        self.board_addr = board_addr
+        self.closed_mask = all_doors_closed
+        # Doors that ignore unlock commands, they reply with closed_indicator like a failed unlock
+        self.jammed_doors = set(jammed_doors)
+
+    # False for a door number the board doesn't have
+    def is_door_open(self, door: int) -> bool:
+        bit = lock_controls.door_bit(door)
+        return bool(bit) and not self.closed_mask & bit
+
+    # Someone pushed the door shut
+    def close_door(self, door: int) -> None:
+        self.closed_mask |= lock_controls.door_bit(door)
+
+    def close_all_doors(self) -> None:
+        self.closed_mask = all_doors_closed
+
+    def _door_status(self, door: int) -> int:
+        return lock_controls.open_indicator if self.is_door_open(door) else lock_controls.closed_indicator
+
+    # Reply to a valid 5 byte command addressed to this board, None if the board would not answer
+    def handle(self, frame: bytes) -> bytes:
+        header, board_addr, lock_addr, function_code, check = frame
+
+        if header == lock_controls.unlock_header and function_code == lock_controls.fxn_code_unlock:
+            # Lock 0 = open every door in sequence
+            if lock_addr == 0:
+                for door in range(1, lock_controls.locks_per_board + 1):
+                    if door not in self.jammed_doors:
+                        self.closed_mask &= ~lock_controls.door_bit(door)
+                return bytes(frame)
+
+            if 1 <= lock_addr <= lock_controls.locks_per_board:
+                if lock_addr not in self.jammed_doors:
+                    self.closed_mask &= ~lock_controls.door_bit(lock_addr)
+                return _with_check([header, board_addr, lock_addr, self._door_status(lock_addr)])
+
+        elif header == lock_controls.indv_query_header and function_code == lock_controls.indv_query_fxn:
+            if lock_addr == 0:
+                mask = self.closed_mask
+                return _with_check([header, board_addr, (mask >> 16) & 0xFF, (mask >> 8) & 0xFF, mask & 0xFF,
+                                    function_code])
+
+            if 1 <= lock_addr <= lock_controls.locks_per_board:
+                return _with_check([header, board_addr, lock_addr, self._door_status(lock_addr)])
+
+        return None
+
+
+# Serial-like object for one simulated RS485 bus with one or more boards on it
+# latency            - seconds between the end of a command and its reply
+# unlock_all_latency - reply delay for UA, defaults to latency (a real board takes several seconds)
+# drop_rate          - chance a reply never arrives
+# corrupt_rate       - chance a reply arrives with a wrong check code
+# disconnect_rate    - chance a write fails as if the USB adapter was unplugged, the next open reconnects
+class SimulatedBus:
+    def __init__(self, boards=(lock_controls.board_code,), latency: float = 0.0, unlock_all_latency: float = None,
+                 drop_rate: float = 0.0, corrupt_rate: float = 0.0, disconnect_rate: float = 0.0, seed: int = None):
+        self.boards = {}
+        for board in boards:
+            board = board if isinstance(board, SimulatedBoard) else SimulatedBoard(board)
+            self.boards[board.board_addr] = board
+
+        self.latency = latency
+        self.unlock_all_latency = latency if unlock_all_latency is None else unlock_all_latency
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+        self.disconnect_rate = disconnect_rate
+        self.random = random.Random(seed)
+
+        self.timeout = lock_controls.default_timeout
+        self.is_open = True
+
+        # Reply bytes and the time they finish arriving
+        self._pending = bytearray()
+        self._ready_at = 0.0
+        self._lock = threading.Lock()
+
+        self.frames_received = 0
+        self.replies_sent = 0
+        self.replies_dropped = 0
+        self.replies_corrupted = 0
+        self.disconnects = 0
+
+    # Factory for lock_controls.register_transport, reopening after a disconnect plugs the bus back in
+    def open(self, port: str = None):
+        self.is_open = True
+        return self
+
+    def close(self) -> None:
+        self.is_open = False
+
+    def reset_input_buffer(self) -> None:
+        with self._lock:
+            self._pending.clear()
+
+    @property
+    def in_waiting(self) -> int:
+        with self._lock:
+            return len(self._pending) if time.monotonic() >= self._ready_at else 0
+
+    def write(self, data: bytes) -> int:
+        if not self.is_open:
+            raise serial.SerialException('Simulated port is closed')
+
+        if self.disconnect_rate and self.random.random() < self.disconnect_rate:
+            self.disconnects += 1
+            self.is_open = False
+            raise serial.SerialException('Simulated USB to RS485 adapter disconnected')
+
+        for start in range(0, len(data) - 4, 5):
+            self._receive(bytes(data[start:start + 5]))
+
+        return len(data)
+
+    def _receive(self, frame: bytes) -> None:
+        self.frames_received += 1
+
+        if frame[0] ^ frame[1] ^ frame[2] ^ frame[3] != frame[4]:
+            return
+
+        board = self.boards.get(frame[1])
+        reply = board.handle(frame) if board is not None else None
+
+        if reply is None:
+            return
+
+        if self.drop_rate and self.random.random() < self.drop_rate:
+            self.replies_dropped += 1
+            return
+
+        if self.corrupt_rate and self.random.random() < self.corrupt_rate:
+            self.replies_corrupted += 1
+            reply = reply[:-1] + bytes([reply[-1] ^ 0xFF])
+
+        unlock_all = frame[0] == lock_controls.unlock_header and frame[2] == 0
+        with self._lock:
+            self._pending += reply
+            self._ready_at = time.monotonic() + (self.unlock_all_latency if unlock_all else self.latency)
+
+        self.replies_sent += 1
+
+    # Same contract as serial.Serial.read: up to size bytes, fewer (or none) if the timeout runs out first
+    def read(self, size: int = 1) -> bytes:
+        if not self.is_open:
+            raise serial.SerialException('Simulated port is closed')
+
+        with self._lock:
+            wait = self._ready_at - time.monotonic() if self._pending else None
+
+        timeout = self.timeout if self.timeout is not None else float('inf')
+
+        if wait is None or wait > timeout:
+            if timeout != float('inf'):
+                time.sleep(timeout)
+            return b''
+
+        if wait > 0:
+            time.sleep(wait)
+
+        with self._lock:
+            data = bytes(self._pending[:size])
+            del self._pending[:size]
+
+        return data
+
+
+# Put a simulated bus behind a port name, send_command / async_send_command on that port then talk to it
+def install_simulated_port(port: str, boards=(lock_controls.board_code,), **bus_options) -> SimulatedBus:
+    bus = SimulatedBus(boards, **bus_options)
+    lock_controls.register_transport(port, bus.open)
+    return bus
+
+
+def remove_simulated_port(port: str) -> None:
+    lock_controls.unregister_transport(port)
@@ -0,0 +1,52 @@
+import logging
+
+import numpy as np
+
+from locker_controller import lock_controls
+
+logger = logging.getLogger(__name__)
+
+"""
+#--------------------BULK STATUS DECODER--------------------#
+
+Vectorized decoding of many Query All (QA) replies at once, e.g. when replaying an audit log of raw replies.
+The replies are read straight out of the caller's buffer (bytes, bytearray, memoryview or a file mapped with
+np.memmap) without copying, and every frame's door states and XOR check byte are decoded in one pass.
+
+Door states come back as an (N, 24) bool array where column (n - 1) is door n and True means the door is open,
+the same meaning as DoorMonitor.is_door_open.
+
+#--------------------BULK STATUS DECODER END--------------------#
+"""
+
+qa_reply_size = lock_controls.reply_sizes['QA']
+
+
+# Decode a buffer of back-to-back 7 byte QA replies
+# Returns True, door_open (N, 24 bool), valid (N bool) - valid is False for any frame whose check byte, header or
+# function code is wrong. Returns False and empty arrays if the buffer is not a whole number of frames.
+def decode_status_replies(replies) -> (bool, np.ndarray, np.ndarray):
+    frames = np.frombuffer(replies, dtype=np.uint8)
+
+    if frames.size % qa_reply_size != 0:
+        logger.warning('Buffer is %s bytes, which is not a whole number of %s byte QA replies.', frames.size,
+                       qa_reply_size)
+        return False, np.zeros((0, 24), dtype=bool), np.zeros(0, dtype=bool)
+
+    frames = frames.reshape(-1, qa_reply_size)
+
+    # Check byte is the XOR of every byte before it, same as generate_check_code for commands
+    valid = np.bitwise_xor.reduce(frames[:, :-1], axis=1) == frames[:, -1]
+    valid &= frames[:, 0] == lock_controls.indv_query_header
+    valid &= frames[:, 5] == lock_controls.indv_query_fxn
+
+    # Reorder the groups to doors 1-8, 9-16, 17-24 and unpack least significant bit first so column 0 is door 1
+    # 1 = locked door, 0 = open door
+    closed = np.unpackbits(frames[:, [4, 3, 2]], axis=1, bitorder='little').view(bool)
+
+    return True, ~closed, valid
+
+
+# Decode a file of raw QA replies without reading it into memory first
+def decode_status_log(path: str) -> (bool, np.ndarray, np.ndarray):
+    return decode_status_replies(np.memmap(path, dtype=np.uint8, mode='r'))
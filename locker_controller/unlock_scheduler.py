@@ -0,0 +1,105 @@
+import heapq
+import logging
+import time
+from collections import deque
+
+from locker_controller import frame_parser
+from locker_controller import lock_controls
+from telemetry import metrics
+
+logger = logging.getLogger(__name__)
+
+"""
+#--------------------UNLOCK SCHEDULER--------------------#
+
+Open an exact set of doors as fast as the bus allows, e.g. every locker holding items for one shift, instead of
+looping over send_command by hand or firing full_open_cmd (all 24 doors on a board, up to 10s).
+
+RS485 is half-duplex so frames go out one at a time, the next frame is written as soon as the previous reply has been
+read. What limits a board is its solenoid driver, so each board gets at least board_unlock_gap seconds between two of
+its unlock frames. Frames are interleaved round-robin across boards, while one board recovers the bus is kept busy
+with the next board, a single board is simply paced at board_unlock_gap.
+
+Success per door comes from the reply frame: open_indicator = door opened, closed_indicator = unlock failed. Doors
+that failed or did not answer are retried at the back of their board's queue, up to retries more times.
+
+Example:
+
+    results = unlock_lockers('COM3', [3, 7, 30])   # {3: True, 7: True, 30: False}
+
+#--------------------UNLOCK SCHEDULER END--------------------#
+"""
+
+# Minimum time between two unlock frames to the same board, in seconds
+board_unlock_gap = 0.05
+
+batch_metric_name = 'unlock_scheduler.batch'
+
+
+# Send one UI frame and check the door reported open
+def _unlock_door(port: str, board_addr: int, lock_addr: int) -> bool:
+    valid, command = lock_controls.get_command_frame(board_addr, lock_addr, 'UI')
+    if not valid:
+        return False
+
+    sent, reply = lock_controls.send_command(port, command, 'UI')
+    if not sent:
+        return False
+
+    parsed, record = frame_parser.parse_reply(reply)
+    return parsed and record.cmd_type == 'UI' and record.is_open
+
+
+# Unlock every (board_addr, lock_addr) in targets, returns {(board_addr, lock_addr): bool}
+# Invalid addresses are reported as False without going on the bus.
+def unlock_doors(port: str, targets, gap: float = None, retries: int = 1) -> dict:
+    gap = board_unlock_gap if gap is None else gap
+    start = time.perf_counter_ns()
+
+    results = {}
+    queues = {}
+    for board_addr, lock_addr in sorted(set(targets)):
+        results[(board_addr, lock_addr)] = False
+
+        if 1 <= board_addr <= 255 and 1 <= lock_addr <= lock_controls.locks_per_board:
+            queues.setdefault(board_addr, deque()).append((lock_addr, 0))
+        else:
+            logger.warning('Skipping invalid door: board %s lock %s', board_addr, lock_addr)
+
+    # (time the board is ready for its next frame, board_addr), boards with nothing queued drop out
+    ready = [(0.0, board_addr) for board_addr in queues]
+    heapq.heapify(ready)
+
+    while ready:
+        ready_at, board_addr = heapq.heappop(ready)
+
+        wait = ready_at - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+        lock_addr, attempt = queues[board_addr].popleft()
+        sent_at = time.monotonic()
+
+        if _unlock_door(port, board_addr, lock_addr):
+            results[(board_addr, lock_addr)] = True
+        elif attempt < retries:
+            queues[board_addr].append((lock_addr, attempt + 1))
+        else:
+            logger.warning('Door did not open: port %s board %s lock %s', port, board_addr, lock_addr)
+
+        if queues[board_addr]:
+            heapq.heappush(ready, (sent_at + gap, board_addr))
+
+    opened = sum(results.values())
+    metrics.record(batch_metric_name, time.perf_counter_ns() - start, opened == len(results))
+    logger.info('Unlocked %s of %s doors on %s', opened, len(results), port)
+
+    return results
+
+
+# Same as unlock_doors but with locker numbers, returns {locker_number: bool}
+def unlock_lockers(port: str, locker_numbers, gap: float = None, retries: int = 1) -> dict:
+    addresses = {locker_number: lock_controls.locker_address(locker_number) for locker_number in set(locker_numbers)}
+    results = unlock_doors(port, addresses.values(), gap, retries)
+
+    return {locker_number: results[address] for locker_number, address in addresses.items()}
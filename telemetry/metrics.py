@@ -0,0 +1,254 @@
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+"""
+#--------------------HOT PATH METRICS--------------------#
+
+Counters and latency histograms for serial commands (serial.UA / UI / QI / QA) and database operations (db.<function>),
+cheap enough to leave on in production:
+
+- record() is a dict lookup, a few integer adds under a lock and a deque append, no I/O and no string formatting
+- latencies go into power-of-two nanosecond buckets, so percentiles come from 64 counters instead of stored samples
+- every call also lands in a fixed size ring buffer of recent events for tracing, old events fall off the end
+
+Nothing here writes to disk on the hot path. flush_events() (or the flusher thread from start_flusher) drains the ring
+buffer into the 'telemetry.trace' logger, and configure_logging() puts a QueueHandler in front of the package loggers so
+log records are handed to a background listener thread instead of being written by the caller.
+
+Example:
+
+    from telemetry import metrics
+
+    metrics.configure_logging('locker.log')
+    metrics.start_flusher(interval=10)
+    ...
+    metrics.snapshot()['serial.UI']   # {'count': ..., 'errors': ..., 'p50_us': ..., 'p99_us': ..., ...}
+
+#--------------------HOT PATH METRICS END--------------------#
+"""
+
+# Set to False to turn record() into a no-op
+enabled = True
+
+# Number of recent events kept for tracing
+ring_size = 4096
+
+histogram_buckets = 64
+
+
+# Count, error count and latency histogram for one operation name
+class Metric:
+    __slots__ = ('name', 'count', 'errors', 'total_ns', 'max_ns', 'buckets')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.errors = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        # buckets[i] counts latencies with bit_length i, i.e. below 2 ** i nanoseconds
+        self.buckets = [0] * histogram_buckets
+
+    # Upper bound of the bucket holding the given fraction of samples, in nanoseconds
+    def percentile_ns(self, fraction: float) -> int:
+        if self.count == 0:
+            return 0
+
+        target = fraction * self.count
+        seen = 0
+
+        for bucket, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= target:
+                return min(1 << bucket, self.max_ns)
+
+        return self.max_ns
+
+    def summary(self) -> dict:
+        return {'count': self.count,
+                'errors': self.errors,
+                'mean_us': self.total_ns / self.count / 1e3 if self.count else 0.0,
+                'p50_us': self.percentile_ns(0.50) / 1e3,
+                'p90_us': self.percentile_ns(0.90) / 1e3,
+                'p99_us': self.percentile_ns(0.99) / 1e3,
+                'max_us': self.max_ns / 1e3}
+
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+# (time_ns, name, elapsed_ns, ok) for the most recent calls
+_events = deque(maxlen=ring_size)
+
+
+def record(name: str, elapsed_ns: int, ok: bool = True) -> None:
+    if not enabled:
+        return
+
+    with _metrics_lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = Metric(name)
+
+        metric.count += 1
+        metric.total_ns += elapsed_ns
+        metric.buckets[min(elapsed_ns.bit_length(), histogram_buckets - 1)] += 1
+
+        if elapsed_ns > metric.max_ns:
+            metric.max_ns = elapsed_ns
+        if not ok:
+            metric.errors += 1
+
+    _events.append((time.time_ns(), name, elapsed_ns, ok))
+
+
+# Treat the (bool, value) / bool return values used across the project as success or failure
+def _succeeded(result) -> bool:
+    if result is False:
+        return False
+
+    return not (type(result) is tuple and len(result) > 0 and result[0] is False)
+
+
+# Decorator that records the latency and success of every call as metric name
+def instrumented(name: str):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter_ns()
+            ok = False
+
+            try:
+                result = func(*args, **kwargs)
+                ok = _succeeded(result)
+                return result
+
+            finally:
+                record(name, time.perf_counter_ns() - start, ok)
+
+        return wrapper
+
+    return decorator
+
+
+# {name: summary} for every metric recorded so far
+def snapshot() -> dict:
+    with _metrics_lock:
+        return {name: metric.summary() for name, metric in _metrics.items()}
+
+
+# The most recent events, oldest first, without removing them from the ring buffer
+def recent_events(limit: int = None) -> list:
+    events = list(_events)
+    return events if limit is None else events[-limit:]
+
+
+def reset() -> None:
+    with _metrics_lock:
+        _metrics.clear()
+
+    _events.clear()
+
+
+"""
+Logging
+"""
+
+trace_logger = logging.getLogger('telemetry.trace')
+
+# Loggers of the project packages that configure_logging routes through the queue
+package_loggers = ('database', 'locker_controller', 'telemetry')
+
+_listener = None
+_queue_handler = None
+
+
+# Route the package loggers through a QueueHandler so callers only pay for a queue put, a background
+# QueueListener does the formatting and file I/O. Replaces the old logging.basicConfig call on import of locker_db.
+def configure_logging(filename: str = 'database.log', level: int = logging.INFO, handler=None):
+    global _listener, _queue_handler
+
+    stop_logging()
+
+    if handler is None:
+        handler = logging.FileHandler(filename)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    _queue_handler = logging.handlers.QueueHandler(log_queue)
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+
+    for name in package_loggers:
+        logger = logging.getLogger(name)
+        logger.addHandler(_queue_handler)
+        logger.setLevel(level)
+
+    _listener.start()
+    return _listener
+
+
+# Detach the queue handler and write out anything still queued
+def stop_logging() -> None:
+    global _listener, _queue_handler
+
+    if _queue_handler is not None:
+        for name in package_loggers:
+            logging.getLogger(name).removeHandler(_queue_handler)
+
+    if _listener is not None:
+        _listener.stop()
+
+    _listener = None
+    _queue_handler = None
+
+
+# Move every event out of the ring buffer into the trace logger, returns how many were flushed
+def flush_events() -> int:
+    flushed = 0
+
+    while True:
+        try:
+            event_time, name, elapsed_ns, ok = _events.popleft()
+        except IndexError:
+            return flushed
+
+        if trace_logger.isEnabledFor(logging.DEBUG):
+            trace_logger.debug('%d %s %.1fus %s', event_time, name, elapsed_ns / 1e3, 'ok' if ok else 'error')
+
+        flushed += 1
+
+
+_flusher = None
+_flusher_stop = threading.Event()
+
+
+# Background thread that flushes the ring buffer and logs a metrics summary every interval seconds
+def start_flusher(interval: float = 10.0) -> None:
+    global _flusher
+
+    if _flusher is not None and _flusher.is_alive():
+        return
+
+    def run():
+        while not _flusher_stop.wait(interval):
+            flush_events()
+            if trace_logger.isEnabledFor(logging.INFO):
+                trace_logger.info('metrics %s', snapshot())
+
+    _flusher_stop.clear()
+    _flusher = threading.Thread(target=run, name='metrics-flusher', daemon=True)
+    _flusher.start()
+
+
+def stop_flusher() -> None:
+    global _flusher
+
+    _flusher_stop.set()
+    if _flusher is not None:
+        _flusher.join()
+        _flusher = None
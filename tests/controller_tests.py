@@ -0,0 +1,760 @@
+import asyncio
+import itertools
+import os
+import socket
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import serial
+
+from database import locker_db
+from database import locker_snapshot
+from locker_controller import access_control
+from locker_controller import async_controls
+from locker_controller import audit_log
+from locker_controller import controller_service
+from locker_controller import door_monitor
+from locker_controller import frame_parser
+from locker_controller import lock_controls
+from locker_controller import simulated_board
+from locker_controller import unlock_scheduler
+
+try:
+    import numpy as np
+    from locker_controller import status_decoder
+except ImportError:
+    np = None
+
+
+# Loopback port that echoes every frame written to it back as the reply
+def loopback_port(*args, **kwargs):
+    return serial.serial_for_url('loop://', timeout=kwargs.get('timeout'))
+
+
+# Closed mask of a board with only the given doors open
+def all_closed_except(*doors) -> int:
+    mask = simulated_board.all_doors_closed
+    for door in doors:
+        mask &= ~lock_controls.door_bit(door)
+    return mask
+
+
+class TestFrameTable(unittest.TestCase):
+
+    def test_table_matches_built_frames(self) -> None:
+        for lock_addr in range(1, 25):
+            for cmd_type, (header, fxn) in lock_controls.frame_codes.items():
+                check = lock_controls.generate_check_code(header, 2, lock_addr, fxn)[1]
+
+                self.assertEqual((True, bytes([header, 2, lock_addr, fxn, check])),
+                                 lock_controls.get_command_frame(2, lock_addr, cmd_type),
+                                 "Test34 Failed: Frame table entry board 2 lock {} {}".format(lock_addr, cmd_type))
+
+    def test_generate_unlock_code_uses_table(self) -> None:
+        test35 = lock_controls.generate_unlock_code(lock_controls.unlock_header, 1, 1, lock_controls.fxn_code_unlock)
+
+        self.assertEqual((True, b'\x8a\x01\x01\x11\x9b'), test35, "Test35 Failed: Unlock code for lock 1")
+        self.assertIs(lock_controls.get_command_frame(1, 1, 'UI'), test35, "Test36 Failed: Unlock code not cached")
+
+    def test_invalid_frame_lookup(self) -> None:
+        self.assertEqual((False, b''), lock_controls.get_command_frame(1, 25, 'UI'), "Test37 Failed: Lock 25")
+        self.assertEqual((False, b''), lock_controls.get_command_frame(1, 1, 'QA'), "Test38 Failed: QA frame")
+
+
+class TestPortSessions(unittest.TestCase):
+
+    def setUp(self) -> None:
+        lock_controls.close_all_port_sessions()
+
+    def tearDown(self) -> None:
+        lock_controls.close_all_port_sessions()
+
+    def test_port_stays_open_between_commands(self) -> None:
+        with mock.patch('serial.rs485.RS485', side_effect=loopback_port) as rs485:
+            test1 = lock_controls.send_command('COM_TEST', lock_controls.query_all_doors[:5], 'QI')
+            test2 = lock_controls.send_command('COM_TEST', lock_controls.full_open_cmd, 'UI')
+
+        self.assertEqual((True, lock_controls.query_all_doors[:5]), test1, "Test1 Failed: First command reply")
+        self.assertEqual((True, lock_controls.full_open_cmd), test2, "Test2 Failed: Second command reply")
+        self.assertEqual(1, rs485.call_count, "Test3 Failed: Port was reopened between commands")
+
+    def test_reconnect_after_serial_exception(self) -> None:
+        with mock.patch('serial.rs485.RS485', side_effect=loopback_port) as rs485:
+            lock_controls.send_command('COM_TEST', lock_controls.full_open_cmd, 'UI')
+
+            # Simulate the USB adapter being unplugged, the next write on the old handle fails
+            session = lock_controls.get_port_session('COM_TEST')
+            session.ser.write = mock.Mock(side_effect=serial.SerialException('device disconnected'))
+
+            test4 = lock_controls.send_command('COM_TEST', lock_controls.full_open_cmd, 'UI')
+
+        self.assertEqual((True, lock_controls.full_open_cmd), test4, "Test4 Failed: Command after reconnect")
+        self.assertEqual(2, rs485.call_count, "Test5 Failed: Port was not reopened after disconnect")
+
+    def test_unknown_command_type(self) -> None:
+        test6 = lock_controls.send_command('COM_TEST', lock_controls.full_open_cmd, 'XX')
+
+        self.assertEqual((False, -1), test6, "Test6 Failed: Unknown command type")
+
+    def test_stale_reply_is_skipped(self) -> None:
+        unlock_door_3 = lock_controls.generate_unlock_code(lock_controls.unlock_header, 1, 3,
+                                                           lock_controls.fxn_code_unlock)[1]
+
+        with mock.patch('serial.rs485.RS485', side_effect=loopback_port):
+            session = lock_controls.get_port_session('COM_TEST')
+            ser = session.open()
+
+            # A late reply to an earlier command arrives after the input buffer was cleared
+            ser.reset_input_buffer = mock.Mock(side_effect=lambda: ser.write(lock_controls.full_open_cmd))
+
+            test7 = lock_controls.send_command('COM_TEST', unlock_door_3, 'UI')
+
+        self.assertEqual((True, unlock_door_3), test7, "Test7 Failed: Stale reply was not skipped")
+
+    def test_noise_before_reply_is_skipped(self) -> None:
+        with mock.patch('serial.rs485.RS485', side_effect=loopback_port):
+            session = lock_controls.get_port_session('COM_TEST')
+            ser = session.open()
+
+            # Line noise and half a corrupted frame arrive ahead of the real reply
+            ser.reset_input_buffer = mock.Mock(side_effect=lambda: ser.write(b'\x00\xff\x8a\x01'))
+
+            test39 = lock_controls.send_command('COM_TEST', lock_controls.full_open_cmd, 'UI')
+
+        self.assertEqual((True, lock_controls.full_open_cmd), test39, "Test39 Failed: Noise was not skipped")
+
+    def test_checksum(self) -> None:
+        self.assertTrue(lock_controls.frame_checksum_ok(lock_controls.full_open_cmd), "Test40 Failed: Valid frame")
+        self.assertFalse(lock_controls.frame_checksum_ok(b'\x8a\x01\x01\x11\x00'), "Test41 Failed: Bad check byte")
+
+
+class TestAdaptiveTimeouts(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.bus = simulated_board.install_simulated_port('SIM_ADAPT', boards=[1, 2])
+
+    def tearDown(self) -> None:
+        simulated_board.remove_simulated_port('SIM_ADAPT')
+
+    def test_tracker(self) -> None:
+        tracker = lock_controls.ResponseTimeTracker()
+        test42 = tracker.timeout(0.75)
+
+        for _ in range(lock_controls.adaptive_min_samples):
+            tracker.record(0.001)
+        test43 = tracker.timeout(0.75)
+
+        tracker.record_timeout()
+        test44 = tracker.timeout(0.75)
+
+        self.assertEqual(0.75, test42, "Test42 Failed: Fixed timeout until enough samples")
+        self.assertEqual(lock_controls.adaptive_min_timeout, test43, "Test43 Failed: Timeout follows response times")
+        self.assertEqual(2 * test43, test44, "Test44 Failed: Timeout backs off after a miss")
+
+    def test_backoff_capped(self) -> None:
+        tracker = lock_controls.ResponseTimeTracker()
+        for _ in range(lock_controls.adaptive_min_samples):
+            tracker.record(0.001)
+
+        tracker.timeouts_in_row = 5000
+        test45 = tracker.timeout(0.75)
+
+        self.assertEqual(0.75, test45, "Test45 Failed: Long run of timeouts capped at the fixed timeout")
+
+    def test_short_frames_rejected(self) -> None:
+        frame = lock_controls.get_command_frame(1, 1, 'UI')[1]
+        test46 = [lock_controls.send_command('SIM_ADAPT', command, 'UI') for command in (b'', frame[:1], frame[:4])]
+
+        self.assertEqual([(False, -1)] * 3, test46, "Test46 Failed: Empty and truncated frames rejected")
+        self.assertEqual(False, self.bus.boards[1].is_door_open(1), "Test47 Failed: Nothing sent to the board")
+
+    def test_dead_board_fails_fast(self) -> None:
+        frame = lock_controls.get_command_frame(1, 1, 'QI')[1]
+
+        for _ in range(lock_controls.adaptive_min_samples):
+            lock_controls.send_command('SIM_ADAPT', frame, 'QI')
+
+        self.bus.drop_rate = 1.0
+        start = time.monotonic()
+        test48 = lock_controls.send_command('SIM_ADAPT', frame, 'QI')
+        elapsed = time.monotonic() - start
+
+        times = lock_controls.get_response_times('SIM_ADAPT')
+
+        self.assertEqual((False, -1), test48, "Test48 Failed: Dropped reply times out")
+        self.assertLess(elapsed, lock_controls.default_timeout / 2, "Test49 Failed: Timeout did not adapt")
+        self.assertEqual(lock_controls.adaptive_min_samples, times[(1, 'QI')]['samples'],
+                         "Test50 Failed: Response times tracked per board")
+
+
+class TestAsyncControls(unittest.TestCase):
+
+    def setUp(self) -> None:
+        lock_controls.close_all_port_sessions()
+
+    def tearDown(self) -> None:
+        lock_controls.close_all_port_sessions()
+
+    def test_commands_on_different_ports_overlap(self) -> None:
+        # Each reply takes 0.2s to arrive
+        def slow_port(*args, **kwargs):
+            ser = loopback_port(*args, **kwargs)
+            read = ser.read
+            ser.read = lambda size=1: time.sleep(0.2) or read(size)
+            return ser
+
+        async def run():
+            requests = [('COM_A', lock_controls.full_open_cmd, 'UI'),
+                        ('COM_B', lock_controls.full_open_cmd, 'UI'),
+                        ('COM_C', lock_controls.full_open_cmd, 'UI')]
+            start = time.monotonic()
+            results = await async_controls.async_send_commands(requests)
+            elapsed = time.monotonic() - start
+            await async_controls.close_engine()
+            return results, elapsed
+
+        with mock.patch('serial.rs485.RS485', side_effect=slow_port):
+            test8, elapsed = asyncio.run(run())
+
+        self.assertEqual([(True, lock_controls.full_open_cmd)] * 3, test8, "Test8 Failed: Async replies")
+        self.assertLess(elapsed, 0.5, "Test9 Failed: Ports were not served concurrently")
+
+    def test_close_does_not_block_loop(self) -> None:
+        def slow_port(*args, **kwargs):
+            ser = loopback_port(*args, **kwargs)
+            read = ser.read
+            ser.read = lambda size=1: time.sleep(0.3) or read(size)
+            return ser
+
+        async def run():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            sending = asyncio.ensure_future(async_controls.async_send_command('COM_A', lock_controls.full_open_cmd,
+                                                                              'UI'))
+            await asyncio.sleep(0.05)
+            ticking = asyncio.ensure_future(ticker())
+            await async_controls.close_engine()
+            ticking.cancel()
+            await asyncio.gather(sending, return_exceptions=True)
+            return ticks
+
+        with mock.patch('serial.rs485.RS485', side_effect=slow_port):
+            test51 = asyncio.run(run())
+
+        self.assertGreater(test51, 5, "Test51 Failed: Event loop kept running while the engine closed")
+
+    def test_unknown_command_type(self) -> None:
+        test10 = asyncio.run(async_controls.async_send_command('COM_TEST', lock_controls.full_open_cmd, 'XX'))
+
+        self.assertEqual((False, -1), test10, "Test10 Failed: Unknown async command type")
+
+
+class TestDoorMonitor(unittest.TestCase):
+    # Doors 1, 9 and 17 are closed, the rest are open
+    qa_reply = b'\x80\x01\x01\x01\x01\x33\xb3'
+
+    def test_decode_door_mask(self) -> None:
+        test11 = lock_controls.decode_door_mask(self.qa_reply)
+
+        self.assertEqual((True, 0x010101), test11, "Test11 Failed: Decode QA reply into door mask")
+        self.assertEqual(False, lock_controls.decode_door_mask(b'\x8a\x01\x00\x11\x9a')[0],
+                         "Test12 Failed: Decode non QA reply")
+
+    def test_is_door_open_from_cache(self) -> None:
+        monitor = door_monitor.DoorMonitor('COM_TEST')
+
+        self.assertEqual(None, monitor.is_door_open(1), "Test13 Failed: State before first poll")
+
+        with mock.patch.object(lock_controls, 'send_command', return_value=(True, self.qa_reply)) as send:
+            monitor.poll_once()
+
+        send.assert_called_once_with('COM_TEST', lock_controls.query_all_doors, 'QA')
+
+        self.assertEqual(False, monitor.is_door_open(1), "Test14 Failed: Door 1 closed")
+        self.assertEqual(True, monitor.is_door_open(2), "Test15 Failed: Door 2 open")
+        self.assertEqual(False, monitor.is_door_open(17), "Test16 Failed: Door 17 closed")
+        self.assertEqual(21, len(monitor.open_doors()), "Test17 Failed: Open door list")
+
+    def test_door_numbers_outside_board(self) -> None:
+        monitor = door_monitor.DoorMonitor('COM_TEST')
+        with mock.patch.object(lock_controls, 'send_command', return_value=(True, self.qa_reply)):
+            monitor.poll_once()
+
+        status = frame_parser.parse_reply(self.qa_reply)[1]
+        board = simulated_board.SimulatedBoard()
+
+        self.assertEqual([None, None], [monitor.is_door_open(0), monitor.is_door_open(25)],
+                         "Test31 Failed: Monitor door outside 1-24")
+        self.assertEqual([None, None], [status.is_door_open(0), status.is_door_open(25)],
+                         "Test32 Failed: Status reply door outside 1-24")
+        self.assertEqual([False, False], [board.is_door_open(0), board.is_door_open(25)],
+                         "Test33 Failed: Simulated board door outside 1-24")
+
+    def test_failed_poll_keeps_last_state(self) -> None:
+        monitor = door_monitor.DoorMonitor('COM_TEST')
+
+        with mock.patch.object(lock_controls, 'send_command', side_effect=[(True, self.qa_reply), (False, -1)]):
+            monitor.poll_once()
+            test18 = monitor.poll_once()
+
+        self.assertEqual(False, test18, "Test18 Failed: Failed poll return")
+        self.assertEqual(0x010101, monitor.mask, "Test19 Failed: Failed poll kept last mask")
+        self.assertEqual(1, monitor.failed_polls, "Test20 Failed: Failed poll count")
+
+    def test_change_events(self) -> None:
+        monitor = door_monitor.DoorMonitor('COM_TEST')
+
+        # Door 1 opens and door 2 closes between the second and third poll
+        replies = [(True, self.qa_reply), (True, self.qa_reply), (True, b'\x80\x01\x01\x01\x02\x33\xb0')]
+
+        def poll_all():
+            with mock.patch.object(lock_controls, 'send_command', side_effect=replies):
+                for reply in replies:
+                    monitor.poll_once()
+
+        stream = monitor.events(timeout=2)
+        poller = threading.Timer(0.05, poll_all)
+        poller.start()
+
+        test21 = [(event.door, event.is_open) for event in itertools.islice(stream, 2)]
+        poller.join()
+
+        self.assertEqual([], door_monitor.diff_door_masks(0x010101, 0x010101), "Test21 Failed: No change")
+        self.assertEqual([(1, True), (2, False)], test21, "Test22 Failed: Door change events")
+
+    def test_snapshot_follows_doors(self) -> None:
+        monitor = door_monitor.DoorMonitor('COM_TEST', board_addr=2)
+        snapshot = locker_snapshot.LockerSnapshot()
+        # Board 2 door 1 opens and door 2 closes between the polls
+        replies = [(True, b'\x80\x02\x01\x01\x01\x33\xb0'), (True, b'\x80\x02\x01\x01\x02\x33\xb3')]
+
+        with mock.patch.object(lock_controls, 'send_command', side_effect=replies):
+            monitor.poll_once()
+            snapshot.watch_doors(monitor)
+            test23 = snapshot.is_door_open(25)
+            monitor.poll_once()
+
+        self.assertEqual(False, test23, "Test23 Failed: Snapshot takes the monitor's current mask")
+        self.assertEqual(True, snapshot.is_door_open(25), "Test24 Failed: Board 2 door 1 is locker 25")
+        self.assertEqual(False, snapshot.is_door_open(26), "Test25 Failed: Door event applied")
+        self.assertEqual(21, len(snapshot.open_lockers()), "Test26 Failed: Open lockers")
+
+
+class TestFrameParser(unittest.TestCase):
+
+    def test_reply_types(self) -> None:
+        test52 = frame_parser.parse_reply(b'\x8a\x01\x05\x00\x8e')
+        test53 = frame_parser.parse_reply(bytearray(b'\x80\x02\x03\x11\x90'))
+        test54 = frame_parser.parse_reply(memoryview(lock_controls.full_open_cmd))
+        test55 = frame_parser.parse_reply(TestDoorMonitor.qa_reply)
+
+        self.assertEqual((True, frame_parser.LockReply('UI', 1, 5, True)), test52, "Test52 Failed: UI reply")
+        self.assertEqual((True, frame_parser.LockReply('QI', 2, 3, False)), test53, "Test53 Failed: QI reply")
+        self.assertEqual((True, frame_parser.UnlockAllReply(1)), test54, "Test54 Failed: UA reply")
+        self.assertEqual((True, frame_parser.StatusReply(1, 0x010101)), test55, "Test55 Failed: QA reply")
+        self.assertEqual((False, True), (test55[1].is_door_open(1), test55[1].is_door_open(2)),
+                         "Test56 Failed: QA door state")
+
+    def test_rejects_corrupted_frames(self) -> None:
+        # Wrong check byte, 7 bytes that are not a QA reply, an unknown lock state and a lock address past 24
+        bad_frames = [b'\x80\x01\x01\x01\x01\x33\xb2', b'\x8a\x01\x01\x01\x01\x33\xb9',
+                      b'\x8a\x01\x05\x07\x89', b'\x80\x01\x19\x00\x98', b'', 42]
+
+        test57 = [frame_parser.parse_reply(frame) for frame in bad_frames]
+
+        self.assertEqual([(False, None)] * len(bad_frames), test57, "Test57 Failed: Corrupted frames rejected")
+        self.assertEqual((False, -1), lock_controls.decode_door_mask(b'\x80\x01\x01\x01\x01\x33\xb2'),
+                         "Test58 Failed: decode_door_mask checks the check byte")
+
+    def test_parse_stream(self) -> None:
+        stream = bytearray(b'\x00\x8a\x01\x05\x00\x8e' + TestDoorMonitor.qa_reply + b'\x80\x01\x01\x01\x01\x33\xb2'
+                           + b'\x80\x02\x03\x11\x90')
+
+        test59 = list(frame_parser.parse_replies(stream))
+
+        self.assertEqual([frame_parser.LockReply('UI', 1, 5, True), frame_parser.StatusReply(1, 0x010101),
+                          frame_parser.LockReply('QI', 2, 3, False)], test59, "Test59 Failed: Replies in a stream")
+
+    def test_monitor_ignores_corrupted_reply(self) -> None:
+        monitor = door_monitor.DoorMonitor('COM_TEST')
+        replies = [(True, TestDoorMonitor.qa_reply), (True, b'\x80\x01\x00\x00\x00\x33\xb3')]
+
+        with mock.patch.object(lock_controls, 'send_command', side_effect=replies):
+            monitor.poll_once()
+            test60 = monitor.poll_once()
+
+        self.assertEqual(False, test60, "Test60 Failed: Corrupted QA counted as a failed poll")
+        self.assertEqual(0x010101, monitor.mask, "Test61 Failed: Corrupted QA did not change the door state")
+
+
+@unittest.skipUnless(np is not None, "NumPy is not installed")
+class TestStatusDecoder(unittest.TestCase):
+    # Doors 1, 9 and 17 are closed, the rest are open
+    qa_reply = b'\x80\x01\x01\x01\x01\x33\xb3'
+    # Door 2 closed, bad check byte
+    corrupt_reply = b'\x80\x01\x00\x00\x02\x33\x00'
+
+    def test_decode_many_replies(self) -> None:
+        decoded, door_open, valid = status_decoder.decode_status_replies(memoryview(self.qa_reply * 3 +
+                                                                                    self.corrupt_reply))
+
+        expected = np.ones(24, dtype=bool)
+        expected[[0, 8, 16]] = False
+
+        self.assertEqual(True, decoded, "Test62 Failed: Decode return value")
+        self.assertEqual((4, 24), door_open.shape, "Test63 Failed: Door state shape")
+        self.assertTrue((door_open[:3] == expected).all(), "Test64 Failed: Door states")
+        self.assertEqual(False, door_open[3, 1], "Test65 Failed: Door 2 closed in corrupt frame")
+        self.assertListEqual([True, True, True, False], valid.tolist(), "Test66 Failed: Checksum validation")
+
+    def test_partial_frame(self) -> None:
+        decoded, door_open, valid = status_decoder.decode_status_replies(self.qa_reply[:5])
+
+        self.assertEqual(False, decoded, "Test67 Failed: Partial frame return value")
+        self.assertEqual((0, 24), door_open.shape, "Test68 Failed: Partial frame shape")
+
+
+class TestAuthorizeAndUnlock(unittest.TestCase):
+
+    def setUp(self) -> None:
+        lock_controls.close_all_port_sessions()
+        access_control.reset_unlock_latency()
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        db_name = os.path.join(self.tmp_dir.name, "locker.db")
+        locker_db.create_database(db_name)
+        self.db_conn = sqlite3.connect(db_name)
+        self.db_cursor = self.db_conn.cursor()
+
+        locker_db.add_employee(self.db_cursor, [("1", "Jake Enoch", 5), ("2", "John Enoch", 2)])
+        locker_db.add_locker(self.db_cursor, [(3, 2), (30, 5)])
+        locker_db.add_item(self.db_cursor, [("A100", "Torque Wrench", None, 1, 3), ("A101", "Crimper", None, 1, 30)])
+
+    def tearDown(self) -> None:
+        lock_controls.close_all_port_sessions()
+        self.db_conn.close()
+        self.tmp_dir.cleanup()
+
+    def test_unlock_allowed(self) -> None:
+        with mock.patch('serial.rs485.RS485', side_effect=loopback_port):
+            test69 = access_control.authorize_and_unlock(self.db_cursor, 'COM_TEST', "1", "A101")
+
+        # Locker 30 is lock 6 on board 2
+        self.assertEqual((True, lock_controls.get_command_frame(2, 6, 'UI')[1]), test69, "Test69 Failed: Unlock frame")
+
+        summary = access_control.unlock_latency_summary()
+        self.assertEqual([1, 1, 1, 1], [summary[stage]['count'] for stage in access_control.unlock_stages],
+                         "Test70 Failed: Stage latency recorded")
+
+    def test_unlock_denied_by_locker_perm_level(self) -> None:
+        with mock.patch.object(lock_controls, 'send_command') as send:
+            test71 = access_control.authorize_and_unlock(self.db_cursor, 'COM_TEST', "2", "A101")
+
+        self.assertEqual((False, -1), test71, "Test71 Failed: Unlock denied")
+        send.assert_not_called()
+
+
+class TestSimulatedBoard(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.bus = simulated_board.install_simulated_port('SIM_TEST', boards=[1, 2])
+
+    def tearDown(self) -> None:
+        simulated_board.remove_simulated_port('SIM_TEST')
+
+    def test_unlock_and_query(self) -> None:
+        test72 = lock_controls.send_command('SIM_TEST', lock_controls.get_command_frame(2, 5, 'UI')[1], 'UI')
+        test73 = lock_controls.send_command('SIM_TEST', lock_controls.get_command_frame(2, 5, 'QI')[1], 'QI')
+        test74 = lock_controls.send_command('SIM_TEST', lock_controls.generate_query_all_code(2), 'QA')
+
+        self.assertEqual((True, b'\x8a\x02\x05\x00\x8d'), test72, "Test72 Failed: Simulated unlock reply")
+        self.assertEqual(lock_controls.open_indicator, test73[1][3], "Test73 Failed: Simulated query reply")
+        self.assertEqual((True, 0xFFFFEF), lock_controls.decode_door_mask(test74[1]), "Test74 Failed: Simulated QA")
+        self.assertEqual(False, self.bus.boards[1].is_door_open(5), "Test75 Failed: Other board untouched")
+
+    def test_unlock_all(self) -> None:
+        lock_controls.send_command('SIM_TEST', lock_controls.full_open_cmd, 'UA')
+
+        self.assertEqual(0, self.bus.boards[1].closed_mask, "Test76 Failed: Simulated unlock all")
+
+    def test_fault_injection(self) -> None:
+        self.bus.drop_rate = 1.0
+
+        with mock.patch.object(lock_controls, 'default_timeout', 0.01):
+            test77 = lock_controls.send_command('SIM_TEST', lock_controls.get_command_frame(1, 1, 'UI')[1], 'UI')
+
+        self.bus.drop_rate = 0.0
+        self.bus.disconnect_rate = 1.0
+        test78 = lock_controls.send_command('SIM_TEST', lock_controls.get_command_frame(1, 1, 'UI')[1], 'UI')
+
+        self.assertEqual((False, -1), test77, "Test77 Failed: Dropped reply times out")
+        self.assertEqual((False, -1), test78, "Test78 Failed: Disconnect reported")
+        self.assertEqual(2, self.bus.disconnects, "Test79 Failed: Write retried once after disconnect")
+
+
+class TestUnlockScheduler(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.bus = simulated_board.install_simulated_port('SIM_SCHED', boards=[1, 2])
+        self.bus.boards[2].jammed_doors.add(9)
+
+    def tearDown(self) -> None:
+        simulated_board.remove_simulated_port('SIM_SCHED')
+
+    def test_opens_exact_doors(self) -> None:
+        # Board 3 is not on the bus and never answers
+        with mock.patch.object(lock_controls, 'default_timeout', 0.02):
+            test80 = unlock_scheduler.unlock_doors('SIM_SCHED', [(2, 4), (1, 3), (1, 3), (2, 9), (3, 1)], gap=0)
+
+        self.assertEqual({(1, 3): True, (2, 4): True, (2, 9): False, (3, 1): False}, test80,
+                         "Test80 Failed: Per door results")
+        self.assertEqual(all_closed_except(3), self.bus.boards[1].closed_mask, "Test81 Failed: Board 1 doors")
+        self.assertEqual(all_closed_except(4), self.bus.boards[2].closed_mask, "Test82 Failed: Board 2 doors")
+
+    def test_retries_failed_doors(self) -> None:
+        unlock_scheduler.unlock_doors('SIM_SCHED', [(2, 9)], gap=0, retries=2)
+
+        # Jammed door answers closed_indicator every time: one frame + two retries
+        self.assertEqual(3, self.bus.frames_received, "Test83 Failed: Failed door retried")
+
+    def test_boards_are_paced(self) -> None:
+        start = time.monotonic()
+        unlock_scheduler.unlock_doors('SIM_SCHED', [(1, 1), (1, 2), (1, 3), (2, 1), (2, 2), (2, 3)], gap=0.05)
+        elapsed = time.monotonic() - start
+
+        # 3 frames per board, interleaved across the two boards: 2 gaps
+        self.assertGreaterEqual(elapsed, 0.1, "Test84 Failed: Board gap not respected")
+        self.assertLess(elapsed, 0.2, "Test85 Failed: Boards were not interleaved")
+
+    def test_unlock_lockers(self) -> None:
+        test86 = unlock_scheduler.unlock_lockers('SIM_SCHED', [1, 26, 33], gap=0)
+
+        self.assertEqual({1: True, 26: True, 33: False}, test86, "Test86 Failed: Locker numbers")
+
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), "Unix domain sockets not available")
+class TestControllerService(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.tmp_dir.name, 'controller.sock')
+        self.bus_a = simulated_board.install_simulated_port('SIM_SVC_A', boards=[1])
+        self.bus_b = simulated_board.install_simulated_port('SIM_SVC_B', boards=[1])
+
+        # Daemon runs on its own event loop thread, the clients talk to it over the socket like another process would
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.service = controller_service.ControllerService(self.socket_path, ports=['SIM_SVC_A', 'SIM_SVC_B'])
+        asyncio.run_coroutine_threadsafe(self.service.start(), self.loop).result(5)
+
+    def tearDown(self) -> None:
+        asyncio.run_coroutine_threadsafe(self.service.stop(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+        self.loop.close()
+        simulated_board.remove_simulated_port('SIM_SVC_A')
+        simulated_board.remove_simulated_port('SIM_SVC_B')
+        self.tmp_dir.cleanup()
+
+    def test_send_command(self) -> None:
+        frame = lock_controls.get_command_frame(1, 5, 'UI')[1]
+
+        with controller_service.ControllerClient(self.socket_path) as client:
+            test87 = client.send_command('SIM_SVC_A', frame, 'UI')
+
+        self.assertEqual((True, b'\x8a\x01\x05\x00\x8e'), test87, "Test87 Failed: Unlock through the service")
+        self.assertEqual(True, self.bus_a.boards[1].is_door_open(5), "Test88 Failed: Door opened")
+
+    def test_pipelined_requests(self) -> None:
+        requests = [('SIM_SVC_A' if lock_addr % 2 else 'SIM_SVC_B',
+                     lock_controls.get_command_frame(1, lock_addr, 'UI')[1], 'UI') for lock_addr in range(1, 25)]
+
+        with controller_service.ControllerClient(self.socket_path) as client:
+            test89 = client.send_commands(requests)
+
+        self.assertEqual([(True, lock_controls.generate_check_code(0x8a, 1, lock_addr, 0)[1])
+                          for lock_addr in range(1, 25)],
+                         [(ok, reply[4]) for ok, reply in test89], "Test89 Failed: Replies in request order")
+        self.assertEqual(0xAAAAAA, self.bus_a.boards[1].closed_mask, "Test90 Failed: Odd doors opened on port A")
+        self.assertEqual(0x555555, self.bus_b.boards[1].closed_mask, "Test91 Failed: Even doors opened on port B")
+
+    def test_concurrent_clients(self) -> None:
+        frame = lock_controls.get_command_frame(1, 1, 'QI')[1]
+        results = []
+
+        def client_thread():
+            with controller_service.ControllerClient(self.socket_path) as client:
+                results.extend(client.send_command('SIM_SVC_A', frame, 'QI')[0] for _ in range(50))
+
+        threads = [threading.Thread(target=client_thread) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertEqual([True] * 200, results, "Test92 Failed: Concurrent clients")
+
+    def test_rejected_requests(self) -> None:
+        frame = lock_controls.get_command_frame(1, 1, 'UI')[1]
+
+        with controller_service.ControllerClient(self.socket_path) as client:
+            test93 = client.send_commands([('COM_NOT_ALLOWED', frame, 'UI'), ('SIM_SVC_A', frame, 'XX'),
+                                          ('SIM_SVC_A', frame, 'UI')])
+
+        self.assertEqual([(False, -1), (False, -1)], test93[:2], "Test93 Failed: Rejected port and command type")
+        self.assertEqual(True, test93[2][0], "Test94 Failed: Connection still usable after a rejected request")
+
+    def test_engine_error_answered(self) -> None:
+        frame = lock_controls.get_command_frame(1, 1, 'QI')[1]
+
+        with controller_service.ControllerClient(self.socket_path, timeout=2.0) as client:
+            test95 = client.send_commands([('SIM_SVC_A', frame[:1], 'QI'), ('SIM_SVC_A', frame, 'QI')])
+
+            with mock.patch.object(self.service.engine, 'send', side_effect=RuntimeError('engine broke')):
+                test96 = client.send_command('SIM_SVC_A', frame, 'QI')
+
+        self.assertEqual([False, True], [ok for ok, reply in test95], "Test95 Failed: Short frame rejected")
+        self.assertEqual((False, -1), test96, "Test96 Failed: Engine error answered with a failure")
+
+    def test_socket_locked_down(self) -> None:
+        other = controller_service.ControllerService(self.socket_path, ports=['SIM_SVC_A'])
+
+        with self.assertRaises(OSError):
+            asyncio.run_coroutine_threadsafe(other.start(), self.loop).result(5)
+
+        with self.assertRaises(ValueError):
+            controller_service.ControllerService(self.socket_path)
+
+        with controller_service.ControllerClient(self.socket_path) as client:
+            test97 = client.send_command('SIM_SVC_A', lock_controls.get_command_frame(1, 1, 'QI')[1], 'QI')[0]
+
+        self.assertEqual(True, test97, "Test97 Failed: Second daemon did not take over the socket")
+        self.assertEqual(0o660, stat.S_IMODE(os.stat(self.socket_path).st_mode), "Test98 Failed: Socket permissions")
+
+    def test_client_closes_after_timeout(self) -> None:
+        self.bus_a.latency = 0.3
+        frame = lock_controls.get_command_frame(1, 1, 'QI')[1]
+
+        client = controller_service.ControllerClient(self.socket_path, timeout=0.05)
+        with self.assertRaises(socket.timeout):
+            client.send_command('SIM_SVC_A', frame, 'QI')
+
+        # The late reply must not be read as the answer to a new request
+        with self.assertRaises(OSError):
+            client.send_command('SIM_SVC_A', frame, 'QI')
+
+        self.bus_a.latency = 0.0
+
+    def test_malformed_request_closes_connection(self) -> None:
+        client = controller_service.ControllerClient(self.socket_path, timeout=5.0)
+        client.sock.sendall(controller_service.length_prefix.pack(2) + b'\x00\x01')
+
+        start = time.monotonic()
+        with self.assertRaises(ConnectionError):
+            client.send_command('SIM_SVC_A', lock_controls.get_command_frame(1, 1, 'QI')[1], 'QI')
+
+        self.assertLess(time.monotonic() - start, 1.0, "Test99 Failed: Client fails fast on a malformed request")
+
+
+class TestAuditLog(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.bus = simulated_board.install_simulated_port('SIM_AUDIT', boards=[1, 2])
+
+    def tearDown(self) -> None:
+        lock_controls.set_audit_log(None)
+        simulated_board.remove_simulated_port('SIM_AUDIT')
+        self.tmp_dir.cleanup()
+
+    def test_records_commands(self) -> None:
+        log = audit_log.AuditLog(self.tmp_dir.name)
+        lock_controls.set_audit_log(log)
+
+        unlock = lock_controls.get_command_frame(2, 17, 'UI')[1]
+        lock_controls.send_command('SIM_AUDIT', unlock, 'UI')
+        lock_controls.send_command('SIM_AUDIT', lock_controls.generate_query_all_code(2), 'QA')
+
+        self.bus.drop_rate = 1.0
+        with mock.patch.object(lock_controls, 'default_timeout', 0.01):
+            lock_controls.send_command('SIM_AUDIT', unlock, 'UI')
+        log.close()
+
+        records = list(audit_log.iter_records(self.tmp_dir.name))
+
+        self.assertEqual(3, len(records), "Test100 Failed: Every command recorded")
+        self.assertEqual(('UI', unlock, b'\x8a\x02\x11\x00\x99', 'SIM_AUDIT', audit_log.status_reply),
+                         (records[0].cmd_type, records[0].command, records[0].reply, records[0].port,
+                          records[0].status),
+                         "Test101 Failed: Command record")
+        self.assertEqual(7, len(records[1].reply), "Test102 Failed: QA reply recorded")
+        self.assertEqual((audit_log.status_timeout, b''), (records[2].status, records[2].reply),
+                         "Test103 Failed: Timeout recorded")
+        self.assertLessEqual(records[0].timestamp_ns, records[2].timestamp_ns, "Test104 Failed: Records in order")
+
+    def test_rotation(self) -> None:
+        log = audit_log.AuditLog(self.tmp_dir.name, records_per_file=4, max_files=2)
+        frame = lock_controls.get_command_frame(1, 1, 'QI')[1]
+
+        for number in range(10):
+            log.record('SIM_AUDIT', 'QI', frame, frame, number * 1000, audit_log.status_reply)
+        log.close()
+
+        # Reopening carries on in the newest file
+        log = audit_log.AuditLog(self.tmp_dir.name, records_per_file=4, max_files=2)
+        log.record('SIM_AUDIT', 'QI', frame, frame, 10000, audit_log.status_reply)
+        log.close()
+
+        files = audit_log.list_log_files(self.tmp_dir.name)
+        latencies = [record.latency_us for record in audit_log.iter_records(self.tmp_dir.name)]
+
+        self.assertEqual(2, len(files), "Test105 Failed: Old files removed")
+        self.assertEqual([4, 5, 6, 7, 8, 9, 10], latencies, "Test106 Failed: Newest records kept")
+
+    def test_last_door_open(self) -> None:
+        log = audit_log.AuditLog(self.tmp_dir.name)
+        lock_controls.set_audit_log(log)
+
+        lock_controls.send_command('SIM_AUDIT', lock_controls.get_command_frame(1, 17, 'UI')[1], 'UI')
+        lock_controls.send_command('SIM_AUDIT', lock_controls.generate_query_all_code(1), 'QA')
+        self.bus.boards[1].close_door(17)
+        lock_controls.send_command('SIM_AUDIT', lock_controls.generate_query_all_code(1), 'QA')
+        lock_controls.send_command('SIM_AUDIT', lock_controls.get_command_frame(2, 17, 'UI')[1], 'UI')
+        log.flush()
+
+        records = list(audit_log.iter_records(self.tmp_dir.name))
+        test107 = audit_log.last_door_open(self.tmp_dir.name, 1, 17)
+        test108 = audit_log.last_door_open(self.tmp_dir.name, 1, 3)
+        log.close()
+
+        self.assertEqual(records[1], test107, "Test107 Failed: Last QA reply showing the door open")
+        self.assertEqual(None, test108, "Test108 Failed: Door never opened")
+
+    def test_last_door_open_outside_board(self) -> None:
+        log = audit_log.AuditLog(self.tmp_dir.name)
+        lock_controls.set_audit_log(log)
+
+        # Every door open, so any wrongly indexed reply byte would look like a match
+        lock_controls.send_command('SIM_AUDIT', lock_controls.full_open_cmd, 'UA')
+        lock_controls.send_command('SIM_AUDIT', lock_controls.generate_query_all_code(1), 'QA')
+        log.flush()
+
+        test109 = [audit_log.last_door_open(self.tmp_dir.name, 1, door) for door in (0, 25, 40)]
+        test110 = [audit_log.last_door_open(self.tmp_dir.name, 1, door) is not None for door in (1, 24)]
+        log.close()
+
+        self.assertEqual([None, None, None], test109, "Test109 Failed: Doors outside 1-24 rejected")
+        self.assertEqual([True, True], test110, "Test110 Failed: Doors on the board still found")
+
@@ -1,6 +1,13 @@
 # import database.locker_db
+import io
 import sqlite3
+import tempfile
+import threading
+import time
+from database import access_matrix
 from database import locker_db
+from database import locker_shards
+from database import locker_snapshot
 import os
 # os.remove("demofile.txt")
 
@@ -203,3 +210,583 @@ class TestEmployeeCRUD(unittest.TestCase):
 # Make future tests fully independent of one another even if it's going to take longer to write tests
 # Unit tests shouldn't rely on anything outside the test to run
 # Maybe have a setup function that instantiates everything for you and a teardown that removes these items from the DB
+
+
+# Base class for tests that need a fresh, empty locker DB of their own
+class FreshDatabaseTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_name = os.path.join(self.tmp_dir.name, "locker.db")
+
+        locker_db.create_database(self.db_name)
+        self.db_conn = sqlite3.connect(self.db_name)
+        self.db_cursor = self.db_conn.cursor()
+
+    def tearDown(self) -> None:
+        self.db_cursor.close()
+        self.db_conn.close()
+        self.tmp_dir.cleanup()
+
+
+class TestBulkEmployeeImport(FreshDatabaseTestCase):
+
+    def test_bulk_insert_reports_rejected_rows(self) -> None:
+        locker_db.add_employee(self.db_cursor, [("1", "Jake Enoch", 5)])
+
+        batch = [("2", "John Enoch", 4), (3, "Bad Id", 1), ("1", "Already There", 2), ("4", "Nick Enoch", 3),
+                 ("4", "Duplicate", 3), ("5", "Too", 1, "Long")]
+
+        test31, rejected = locker_db.add_employees_bulk(self.db_cursor, batch)
+
+        test32 = self.db_cursor.execute("SELECT * FROM employees ORDER BY id").fetchall()
+
+        self.assertEqual(True, test31, "Test31 Failed: Bulk Insert Return Value")
+        self.assertListEqual([1, 2, 4, 5], [index for index, employee, reason in rejected],
+                             "Test32 Failed: Bulk Insert Rejected Rows")
+        self.assertListEqual([("1", "Jake Enoch", 5), ("2", "John Enoch", 4), ("4", "Nick Enoch", 3)], test32,
+                             "Test33 Failed: Bulk Insert Rows")
+
+    def test_bulk_upsert(self) -> None:
+        locker_db.add_employee(self.db_cursor, [("1", "Jake Enoch", 5)])
+
+        test34, rejected = locker_db.add_employees_bulk(self.db_cursor, [("1", "Jake Enoch", 7), ("2", "John Enoch", 4)],
+                                                        upsert=True)
+
+        test35 = self.db_cursor.execute("SELECT * FROM employees ORDER BY id").fetchall()
+
+        self.assertEqual((True, []), (test34, rejected), "Test34 Failed: Bulk Upsert Return Value")
+        self.assertListEqual([("1", "Jake Enoch", 7), ("2", "John Enoch", 4)], test35, "Test35 Failed: Bulk Upsert")
+
+
+class TestStreamingEmployeeLoader(FreshDatabaseTestCase):
+    csv_data = "id,name,max_perm_level\n1,Jake Enoch,5\n2,John Enoch,4\n3,Bad Level,high\n4,Nick Enoch,3\n" \
+               "5,Dave Enoch,2\n"
+
+    def test_load_csv(self) -> None:
+        rejected = []
+
+        test36, summary = locker_db.load_employees_from_file(self.db_cursor, io.StringIO(self.csv_data),
+                                                             file_format="csv", chunk_size=2,
+                                                             on_reject=lambda *row: rejected.append(row[0]))
+
+        test37 = self.db_cursor.execute("SELECT id FROM employees ORDER BY id").fetchall()
+
+        self.assertEqual(True, test36, "Test36 Failed: CSV Load Return Value")
+        self.assertEqual({'rows_read': 5, 'added': 4, 'rejected': 1, 'resumed_from': 0}, summary,
+                         "Test37 Failed: CSV Load Summary")
+        self.assertListEqual([3], rejected, "Test38 Failed: CSV Load Rejected Rows")
+        self.assertListEqual([("1",), ("2",), ("4",), ("5",)], test37, "Test39 Failed: CSV Load Rows")
+
+    def test_load_jsonl(self) -> None:
+        jsonl_data = '{"id": "1", "name": "Jake Enoch", "max_perm_level": 5}\n\n["2", "John Enoch", 4]\n{bad\n'
+        path = os.path.join(self.tmp_dir.name, "employees.jsonl")
+
+        with open(path, "w") as file:
+            file.write(jsonl_data)
+
+        test40, summary = locker_db.load_employees_from_file(self.db_cursor, path)
+
+        self.assertEqual(True, test40, "Test40 Failed: JSONL Load Return Value")
+        self.assertEqual((3, 2, 1), (summary['rows_read'], summary['added'], summary['rejected']),
+                         "Test41 Failed: JSONL Load Summary")
+
+    def test_resume_interrupted_load(self) -> None:
+        # Source that dies after handing out the header and 4 data rows
+        def interrupted_source():
+            for line_number, line in enumerate(io.StringIO(self.csv_data)):
+                if line_number == 5:
+                    raise KeyboardInterrupt
+                yield line
+
+        with self.assertRaises(KeyboardInterrupt):
+            locker_db.load_employees_from_file(self.db_cursor, interrupted_source(), file_format="csv",
+                                               chunk_size=2, job_name="hr-sync")
+
+        test42, summary = locker_db.load_employees_from_file(self.db_cursor, io.StringIO(self.csv_data),
+                                                             file_format="csv", chunk_size=2, job_name="hr-sync")
+
+        test43 = self.db_cursor.execute("SELECT count(*) FROM employees").fetchone()[0]
+
+        self.assertEqual(True, test42, "Test42 Failed: Resumed Load Return Value")
+        self.assertEqual(4, summary['resumed_from'], "Test43 Failed: Resumed From Row")
+        self.assertEqual(0, summary['rejected'], "Test44 Failed: Resumed Load Rejected Rows")
+        self.assertEqual(4, test43, "Test45 Failed: Resumed Load Rows")
+
+
+class TestEmployeePaging(FreshDatabaseTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.employees = [("{:03d}".format(number), "Employee {}".format(number), number % 7) for number in range(25)]
+        locker_db.add_employees_bulk(self.db_cursor, self.employees)
+
+    def test_get_employees_page(self) -> None:
+        pages = []
+        page, after_id = locker_db.get_employees_page(self.db_cursor, page_size=10)
+        pages.append(page)
+
+        while after_id is not None:
+            page, after_id = locker_db.get_employees_page(self.db_cursor, after_id=after_id, page_size=10)
+            pages.append(page)
+
+        self.assertListEqual([10, 10, 5], [len(page) for page in pages], "Test46 Failed: Page Sizes")
+        self.assertListEqual(self.employees, [row for page in pages for row in page], "Test47 Failed: Paged Rows")
+
+    def test_iter_employees(self) -> None:
+        test48 = list(locker_db.iter_employees(self.db_cursor, batch_size=4))
+
+        self.assertListEqual(self.employees, test48, "Test48 Failed: Iterate Employees")
+
+    def test_iter_employees_error_raised(self) -> None:
+        conn = sqlite3.connect(self.db_name)
+        employees = locker_db.iter_employees(conn.cursor(), batch_size=4)
+        test97 = [next(employees) for _ in range(4)]
+
+        # Connection lost part way through the listing
+        conn.close()
+
+        with self.assertRaises(sqlite3.Error):
+            list(employees)
+
+        self.assertListEqual(self.employees[:4], test97, "Test97 Failed: Rows Before The Error")
+
+
+class TestLockerDB(FreshDatabaseTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.ldb = locker_db.LockerDB(self.db_name)
+
+    def tearDown(self) -> None:
+        self.ldb.close()
+        super().tearDown()
+
+    def test_connection_settings(self) -> None:
+        cursor = self.ldb.cursor()
+
+        self.assertEqual("wal", cursor.execute("PRAGMA journal_mode").fetchone()[0], "Test49 Failed: WAL Mode")
+        self.assertEqual(1, cursor.execute("PRAGMA synchronous").fetchone()[0], "Test50 Failed: Synchronous NORMAL")
+
+    def test_thread_local_connections(self) -> None:
+        other = []
+        thread = threading.Thread(target=lambda: other.append(self.ldb.connection()))
+        thread.start()
+        thread.join()
+
+        self.assertIs(self.ldb.connection(), self.ldb.connection(), "Test51 Failed: Same Thread Connection Reused")
+        self.assertIsNot(self.ldb.connection(), other[0], "Test52 Failed: Per Thread Connections")
+
+    def test_batch_commits_once(self) -> None:
+        with self.ldb.batch() as cursor:
+            locker_db.add_employee(cursor, [("1", "Jake Enoch", 5)])
+            locker_db.update_employee(cursor, "1", ("Jake Enoch", 6))
+
+            # Nothing is visible to other connections until the scope exits
+            test53 = self.db_cursor.execute("SELECT count(*) FROM employees").fetchone()[0]
+
+        test54 = self.db_cursor.execute("SELECT * FROM employees").fetchall()
+
+        self.assertEqual(0, test53, "Test53 Failed: Batch Committed Early")
+        self.assertListEqual([("1", "Jake Enoch", 6)], test54, "Test54 Failed: Batch Commit")
+
+    def test_batch_rolled_back(self) -> None:
+        with self.assertRaises(sqlite3.DatabaseError):
+            with self.ldb.batch() as cursor:
+                locker_db.add_employee(cursor, [("1", "Jake Enoch", 5)])
+                locker_db.add_employee(cursor, [(2, "Bad Id", 5)])
+
+        test55 = self.db_cursor.execute("SELECT count(*) FROM employees").fetchone()[0]
+
+        self.assertEqual(0, test55, "Test55 Failed: Rolled Back Batch")
+
+    def test_nested_batch_exception_discards_batch(self) -> None:
+        with self.assertRaises(sqlite3.DatabaseError):
+            with self.ldb.batch() as cursor:
+                try:
+                    with self.ldb.batch() as inner_cursor:
+                        locker_db.add_employee(inner_cursor, [("1", "Jake Enoch", 5)])
+                        raise RuntimeError("inner scope failed")
+                except RuntimeError:
+                    pass
+
+                locker_db.add_employee(cursor, [("2", "John Enoch", 4)])
+
+        test98 = self.db_cursor.execute("SELECT count(*) FROM employees").fetchone()[0]
+
+        self.assertEqual(0, test98, "Test98 Failed: Nested Scope Exception Rolls Back Batch")
+
+
+class TestItemIndexes(FreshDatabaseTestCase):
+
+    def test_hot_queries_use_index(self) -> None:
+        for statement in (locker_db.items_held_by_employee_statement, locker_db.items_in_locker_statement):
+            plan = locker_db.explain_query_plan(self.db_cursor, statement, ("1",))
+
+            self.assertFalse(any(step.startswith("SCAN") for step in plan),
+                             "Test56 Failed: Table Scan In Plan For {} {}".format(statement, plan))
+            self.assertTrue(any("USING COVERING INDEX" in step for step in plan),
+                            "Test57 Failed: No Covering Index For {} {}".format(statement, plan))
+
+    def test_unlock_target_uses_index(self) -> None:
+        plan = locker_db.explain_query_plan(self.db_cursor, locker_db.unlock_target_statement, ("1", "A100"))
+
+        self.assertFalse(any(step.startswith("SCAN") for step in plan), "Test59 Failed: Table Scan In Unlock "
+                                                                        "Target Plan {}".format(plan))
+
+    def test_indexes_added_to_existing_database(self) -> None:
+        self.db_cursor.execute("DROP INDEX idx_items_borrowed_by")
+        self.db_cursor.execute("DROP INDEX idx_items_locker_number")
+        self.db_conn.commit()
+
+        locker_db.create_database(self.db_name)
+
+        test58 = self.db_cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'items' "
+                                        "AND name LIKE 'idx_%' ORDER BY name").fetchall()
+
+        self.assertListEqual([("idx_items_borrowed_by",), ("idx_items_locker_number",)], test58,
+                             "Test58 Failed: Indexes Migrated")
+
+
+class TestItemsAndLockers(FreshDatabaseTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        locker_db.add_employee(self.db_cursor, [("1", "Jake Enoch", 5), ("2", "John Enoch", 2)])
+        locker_db.add_locker(self.db_cursor, [(1, 2), (2, 5)])
+        locker_db.add_item(self.db_cursor, [("A100", "Torque Wrench", None, 3, 1),
+                                            ("A101", "Multimeter", "Fluke", 1, 2),
+                                            ("A102", "Crimper", None, 5, 2)])
+
+    def test_locker_crud(self) -> None:
+        test99 = locker_db.add_locker(self.db_cursor, [(3, "high")])
+        test100 = locker_db.update_locker(self.db_cursor, 1, 4)
+        test101 = locker_db.remove_locker(self.db_cursor, 99)
+
+        self.assertEqual((False, True, False), (test99, test100, test101), "Test99 Failed: Locker CRUD Return Values")
+        self.assertListEqual([(1, 4), (2, 5)], locker_db.get_all_lockers(self.db_cursor),
+                             "Test102 Failed: Locker CRUD Rows")
+
+    def test_item_crud(self) -> None:
+        test103 = locker_db.update_item(self.db_cursor, "A101", ("Multimeter", "Fluke 87", 2, 1))
+        test104 = locker_db.remove_item(self.db_cursor, "A102")
+
+        self.assertEqual((True, True), (test103, test104), "Test103 Failed: Item CRUD Return Values")
+        self.assertEqual(("A101", "Multimeter", "Fluke 87", 2, None, 1), locker_db.get_item(self.db_cursor, "A101"),
+                         "Test105 Failed: Item Update")
+        self.assertListEqual([("A100", "Torque Wrench", None), ("A101", "Multimeter", None)],
+                             sorted(locker_db.get_items_in_locker(self.db_cursor, 1)),
+                             "Test106 Failed: Items In Locker")
+
+    def test_checkout_checks_perm_level(self) -> None:
+        test64 = locker_db.checkout_item(self.db_cursor, "2", "A100")
+        test65 = locker_db.checkout_item(self.db_cursor, "1", "A100")
+        test66 = locker_db.checkout_item(self.db_cursor, "1", "A100")
+        test67 = locker_db.checkout_item(self.db_cursor, "404", "A101")
+
+        self.assertEqual((False, -1), test64, "Test64 Failed: Checkout Perm Level Too Low")
+        self.assertEqual((True, 1), test65, "Test65 Failed: Checkout Locker Number")
+        self.assertEqual((False, -1), test66, "Test66 Failed: Checkout Already Borrowed")
+        self.assertEqual((False, -1), test67, "Test67 Failed: Checkout Unknown Employee")
+        self.assertListEqual([("A100", "Torque Wrench", 1)], locker_db.get_items_held_by(self.db_cursor, "1"),
+                             "Test68 Failed: Items Held By Employee")
+
+    def test_batched_checkout_and_return(self) -> None:
+        test69 = locker_db.checkout_items(self.db_cursor, "2", ["A100", "A101", "A102"])
+        test70 = locker_db.checkout_items(self.db_cursor, "1", ["A100", "A101", "A102"])
+        test71 = locker_db.return_items(self.db_cursor, ["A100", "A101", "A102"])
+
+        self.assertEqual((True, {"A101": 2}), test69, "Test69 Failed: Batched Checkout Perm Level")
+        self.assertEqual((True, {"A100": 1, "A102": 2}), test70, "Test70 Failed: Batched Checkout")
+        self.assertEqual((True, {"A100": 1, "A101": 2, "A102": 2}), test71, "Test71 Failed: Batched Return")
+        self.assertEqual((False, -1), locker_db.return_item(self.db_cursor, "A100"), "Test72 Failed: Double Return")
+
+    def test_batched_checkout_from_generator(self) -> None:
+        test107 = locker_db.checkout_items(self.db_cursor, "1", (item_id for item_id in ["A100", "A101", "A102"]))
+        test108 = locker_db.return_items(self.db_cursor, (item_id for item_id in ["A100", "A101", "A102"]))
+
+        self.assertEqual((True, {"A100": 1, "A101": 2, "A102": 2}), test107, "Test107 Failed: Checkout From Generator")
+        self.assertEqual((True, {"A100": 1, "A101": 2, "A102": 2}), test108, "Test108 Failed: Return From Generator")
+
+
+class TestLockerSnapshot(FreshDatabaseTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        locker_db.add_employee(self.db_cursor, [("1", "Jake Enoch", 5)])
+        locker_db.add_locker(self.db_cursor, [(1, 2), (2, 5), (3, 1)])
+        locker_db.add_item(self.db_cursor, [("A100", "Torque Wrench", None, 3, 1),
+                                            ("A101", "Multimeter", "Fluke", 1, 2)])
+
+        self.snapshot = locker_snapshot.LockerSnapshot()
+        self.snapshot.load(self.db_cursor)
+        self.snapshot.attach()
+
+    def tearDown(self) -> None:
+        self.snapshot.detach()
+        super().tearDown()
+
+    # Snapshot has to match a fresh load from the database after every change
+    def assertMatchesDatabase(self, message: str) -> None:
+        fresh = locker_snapshot.LockerSnapshot()
+        fresh.load(self.db_cursor)
+
+        self.assertEqual((fresh.free_lockers(), fresh.occupied_lockers(),
+                          sorted(record.as_tuple() for record in fresh.items.values())),
+                         (self.snapshot.free_lockers(), self.snapshot.occupied_lockers(),
+                          sorted(record.as_tuple() for record in self.snapshot.items.values())), message)
+
+    def test_load(self) -> None:
+        self.assertEqual([3], self.snapshot.free_lockers(), "Test109 Failed: Free lockers")
+        self.assertEqual([1, 2], self.snapshot.occupied_lockers(), "Test110 Failed: Occupied lockers")
+        self.assertEqual(5, self.snapshot.locker_perm_level(2), "Test111 Failed: Locker perm level")
+        self.assertEqual("Fluke", self.snapshot.get_item("A101").description, "Test112 Failed: Item record")
+
+    def test_checkout_and_return(self) -> None:
+        locker_db.checkout_items(self.db_cursor, "1", ["A100", "A101"])
+
+        self.assertEqual([1, 2, 3], self.snapshot.free_lockers(), "Test113 Failed: Lockers free after checkout")
+        self.assertEqual(["A100", "A101"], sorted(record.item_id for record in self.snapshot.items_held_by("1")),
+                         "Test114 Failed: Items held by employee")
+        self.assertMatchesDatabase("Test115 Failed: Snapshot after checkout")
+
+        locker_db.return_item(self.db_cursor, "A101")
+
+        self.assertEqual(["A100"], [record.item_id for record in self.snapshot.items_out()],
+                         "Test116 Failed: Items out")
+        self.assertMatchesDatabase("Test117 Failed: Snapshot after return")
+
+    def test_locker_and_item_writes(self) -> None:
+        locker_db.add_locker(self.db_cursor, [(30, 4)])
+        locker_db.update_item(self.db_cursor, "A100", ("Torque Wrench", None, 3, 3))
+        locker_db.add_item(self.db_cursor, [("A102", "Crimper", None, 5, 30)])
+        locker_db.remove_item(self.db_cursor, "A101")
+        locker_db.update_locker(self.db_cursor, 1, 4)
+
+        self.assertEqual([1, 2], self.snapshot.free_lockers(), "Test118 Failed: Free lockers after writes")
+        self.assertEqual(4, self.snapshot.locker_perm_level(1), "Test119 Failed: Locker perm level update")
+        self.assertMatchesDatabase("Test120 Failed: Snapshot after writes")
+
+    def test_rolled_back_batch_is_ignored(self) -> None:
+        ldb = locker_db.LockerDB(self.db_name)
+
+        with self.assertRaises(sqlite3.DatabaseError):
+            with ldb.batch() as cursor:
+                locker_db.checkout_items(cursor, "1", ["A100"])
+                locker_db.add_locker(cursor, [(4, "high")])
+
+        with ldb.batch() as cursor:
+            locker_db.checkout_items(cursor, "1", ["A101"])
+            self.assertEqual([3], self.snapshot.free_lockers(), "Test121 Failed: Batch applied before commit")
+
+        ldb.close()
+
+        self.assertEqual([2, 3], self.snapshot.free_lockers(), "Test122 Failed: Batch applied after commit")
+        self.assertMatchesDatabase("Test123 Failed: Snapshot after batches")
+
+
+class TestAccessMatrix(FreshDatabaseTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        locker_db.add_employee(self.db_cursor, [("1", "Jake Enoch", 5), ("2", "John Enoch", 2), ("3", "Nick Enoch", 3)])
+        locker_db.add_locker(self.db_cursor, [(1, 2), (2, 5), (3, 1)])
+        locker_db.add_item(self.db_cursor, [("A100", "Torque Wrench", None, 3, 1),
+                                            ("A101", "Multimeter", "Fluke", 1, 2),
+                                            ("A102", "Crimper", None, 1, 3),
+                                            ("A103", "Drill", None, 1, None)])
+
+        self.matrix = access_matrix.AccessMatrix()
+        self.matrix.load(self.db_cursor)
+        self.matrix.attach()
+
+    def tearDown(self) -> None:
+        self.matrix.detach()
+        super().tearDown()
+
+    # Every answer has to agree with get_unlock_target, the per-lookup check it replaces
+    def assertMatchesUnlockTarget(self, message: str) -> None:
+        for emp_id, name, level in locker_db.get_all_employees(self.db_cursor):
+            allowed = tuple(sorted(item[0] for item in locker_db.get_all_items(self.db_cursor)
+                                   if locker_db.get_unlock_target(self.db_cursor, emp_id, item[0])[0]))
+            self.assertEqual(allowed, self.matrix.items_for_employee(emp_id), message)
+
+    def test_queries(self) -> None:
+        self.assertEqual((1, 3), self.matrix.lockers_for_employee("2"), "Test124 Failed: Lockers for employee")
+        self.assertEqual(("A100", "A102"), self.matrix.items_for_employee("3"), "Test125 Failed: Items for employee")
+        self.assertEqual(["3", "1"], self.matrix.employees_for_item("A100"), "Test126 Failed: Employees for item")
+        self.assertEqual(["1"], self.matrix.employees_for_locker(2), "Test127 Failed: Employees for locker")
+        self.assertEqual((["2"], 3), (self.matrix.employees_for_locker(3, limit=1),
+                                      self.matrix.count_employees_for_level(1)),
+                         "Test128 Failed: Limited employee list")
+        self.assertEqual((), self.matrix.lockers_for_employee("404"), "Test129 Failed: Unknown employee")
+        self.assertMatchesUnlockTarget("Test130 Failed: Matrix matches get_unlock_target")
+
+    def test_employee_level_change(self) -> None:
+        locker_db.update_employee(self.db_cursor, "2", ("John Enoch", 5))
+        locker_db.remove_employee(self.db_cursor, "3")
+        locker_db.add_employees_bulk(self.db_cursor, [("4", "Mark Treadwell", 4)])
+
+        self.assertEqual((1, 2, 3), self.matrix.lockers_for_employee("2"), "Test131 Failed: Level raised")
+        self.assertEqual(["4", "1", "2"], self.matrix.employees_for_item("A100"), "Test132 Failed: Employees re-sorted")
+        self.assertMatchesUnlockTarget("Test133 Failed: Matrix after employee changes")
+
+    def test_locker_and_item_changes(self) -> None:
+        before = self.matrix.items_for_employee("2")
+
+        locker_db.update_locker(self.db_cursor, 3, 4)
+        locker_db.update_item(self.db_cursor, "A103", ("Drill", None, 1, 1))
+        locker_db.add_locker(self.db_cursor, [(4, 0)])
+        locker_db.add_item(self.db_cursor, [("A104", "Tape", None, 0, 4)])
+
+        self.assertEqual(("A102",), before, "Test134 Failed: Items before changes")
+        self.assertEqual(("A103", "A104"), self.matrix.items_for_employee("2"), "Test135 Failed: Items re-keyed")
+        self.assertEqual(["1"], self.matrix.employees_for_locker(3), "Test136 Failed: Locker level raised")
+        self.assertMatchesUnlockTarget("Test137 Failed: Matrix after locker and item changes")
+
+
+class TestLockerShards(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.files = {name: os.path.join(self.tmp_dir.name, name + ".db") for name in ("north", "south")}
+        self.shards = locker_shards.LockerShards(self.files, [(1, 24, "north"), (25, 48, "south")])
+        self.shards.create_database()
+
+        self.shards.add_employee([("1", "Jake Enoch", 5), ("2", "John Enoch", 2)])
+        self.shards.add_locker([(1, 2), (2, 5), (25, 2), (30, 1)])
+        self.shards.add_item([("A100", "Torque Wrench", None, 3, 1), ("A101", "Multimeter", "Fluke", 1, 2),
+                              ("B200", "Crimper", None, 1, 25), ("B201", "Drill", None, 1, 30)])
+
+    def tearDown(self) -> None:
+        self.shards.close()
+        self.tmp_dir.cleanup()
+
+    def rows(self, shard: str, table: str) -> list:
+        conn = sqlite3.connect(self.files[shard])
+        rows = conn.execute("SELECT * FROM {}".format(table)).fetchall()
+        conn.close()
+        return sorted(rows)
+
+    def test_placement(self) -> None:
+        self.assertEqual(self.rows("north", "employees"), self.rows("south", "employees"),
+                         "Test79 Failed: Employees copied to every shard")
+        self.assertEqual([(1, 2), (2, 5)], self.rows("north", "locker_doors"), "Test80 Failed: North lockers")
+        self.assertEqual(["B200", "B201"], [item[0] for item in self.rows("south", "items")],
+                         "Test81 Failed: Items follow their locker")
+        self.assertEqual(False, self.shards.add_locker([(3, 1), (99, 1)]), "Test82 Failed: Locker outside every range")
+        self.assertEqual([], self.rows("north", "locker_doors")[2:], "Test83 Failed: Nothing added on a bad range")
+
+    def test_cross_shard_reads_and_writes(self) -> None:
+        test84 = self.shards.checkout_items("1", ["A100", "B200", "Z999"])
+        test85 = self.shards.get_items_held_by("1")
+        test86 = self.shards.get_unlock_target("2", "B201")
+        test87 = self.shards.return_items(["B200"])
+
+        self.assertEqual((True, {"A100": 1, "B200": 25}), test84, "Test84 Failed: Checkout across shards")
+        self.assertEqual([("A100", "Torque Wrench", 1), ("B200", "Crimper", 25)], test85,
+                         "Test85 Failed: Items held by employee across shards")
+        self.assertEqual((True, 30), test86, "Test86 Failed: Unlock target in the south shard")
+        self.assertEqual((True, {"B200": 25}), test87, "Test87 Failed: Return")
+        self.assertEqual(4, len(self.shards.get_all_items()), "Test88 Failed: All items")
+
+        with self.shards.attached_connection() as conn:
+            test89 = conn.execute("SELECT count(*) FROM (SELECT item_id FROM shard_north.items "
+                                  "UNION ALL SELECT item_id FROM shard_south.items)").fetchone()[0]
+
+        self.assertEqual(4, test89, "Test89 Failed: Attached cross-shard query")
+
+    def test_write_lock_stays_in_one_shard(self) -> None:
+        # Hold the north shard's write lock, south writes must not wait for it
+        blocker = sqlite3.connect(self.files["north"])
+        blocker.execute("BEGIN IMMEDIATE")
+
+        try:
+            start = time.monotonic()
+            test90 = self.shards.checkout_items("2", ["B201"])
+            elapsed = time.monotonic() - start
+
+        finally:
+            blocker.rollback()
+            blocker.close()
+
+        self.assertEqual((True, {"B201": 30}), test90, "Test90 Failed: South checkout while north is locked")
+        self.assertLess(elapsed, 1.0, "Test91 Failed: South write waited on the north shard")
+
+    def test_employee_copies_stay_in_step(self) -> None:
+        # Employee 1 still holds an item in the south shard only, the delete must fail everywhere
+        self.shards.checkout_items("1", ["B200"])
+        test92 = self.shards.remove_employee("1")
+
+        self.shards.return_items(["B200"])
+        test93 = self.shards.update_employee("1", ("Jake Enoch", 6))
+        test94 = self.shards.add_employee([("3", "Nick Enoch", 1), ("1", "Already There", 1)])
+
+        self.assertEqual(False, test92, "Test92 Failed: Remove employee holding an item")
+        self.assertEqual(True, test93, "Test93 Failed: Update employee on every shard")
+        self.assertEqual(False, test94, "Test94 Failed: Add with a duplicate ID")
+        self.assertEqual([("1", "Jake Enoch", 6), ("2", "John Enoch", 2)], self.rows("north", "employees"),
+                         "Test95 Failed: North employees")
+        self.assertEqual(self.rows("north", "employees"), self.rows("south", "employees"),
+                         "Test96 Failed: Employee copies identical")
+
+
+class TestEmployeeCache(FreshDatabaseTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.cache = locker_db.enable_employee_cache(max_size=2, ttl=60)
+        locker_db.add_employee(self.db_cursor, [("1", "Jake Enoch", 5), ("2", "John Enoch", 4), ("3", "Nick Enoch", 3)])
+
+    def tearDown(self) -> None:
+        locker_db.disable_employee_cache()
+        super().tearDown()
+
+    def test_hits_and_evictions(self) -> None:
+        locker_db.get_employee(self.db_cursor, "1")
+        locker_db.get_employee(self.db_cursor, "1")
+        locker_db.get_employee(self.db_cursor, "2")
+        locker_db.get_employee(self.db_cursor, "3")
+        test73 = locker_db.get_employee_perm_level(self.db_cursor, "3")
+
+        stats = locker_db.employee_cache_stats()
+
+        self.assertEqual(3, test73, "Test73 Failed: Cached Perm Level")
+        self.assertEqual((2, 3, 1), (stats['hits'], stats['misses'], stats['evictions']),
+                         "Test74 Failed: Cache Counters")
+
+    def test_write_through_invalidation(self) -> None:
+        locker_db.get_employee(self.db_cursor, "1")
+        locker_db.update_employee(self.db_cursor, "1", ("Jake Enoch", 7))
+        test75 = locker_db.get_employee(self.db_cursor, "1")
+
+        locker_db.remove_employee(self.db_cursor, "1")
+        test76 = locker_db.get_employee(self.db_cursor, "1")
+
+        self.assertEqual(("1", "Jake Enoch", 7), test75, "Test75 Failed: Cache Invalidated On Update")
+        self.assertEqual(None, test76, "Test76 Failed: Cache Invalidated On Remove")
+
+    def test_batch_changes_cached_only_after_commit(self) -> None:
+        ldb = locker_db.LockerDB(self.db_name)
+
+        try:
+            with self.assertRaises(RuntimeError):
+                with ldb.batch() as cursor:
+                    locker_db.update_employee(cursor, "1", ("Jake Enoch", 9))
+                    locker_db.get_employee(cursor, "1")
+                    raise RuntimeError("abort batch")
+
+            test77 = locker_db.get_employee(self.db_cursor, "1")
+
+            with ldb.batch() as cursor:
+                locker_db.update_employee(cursor, "1", ("Jake Enoch", 8))
+                # Another connection caches the committed row while the batch is still open
+                locker_db.get_employee(self.db_cursor, "1")
+
+            test78 = locker_db.get_employee(self.db_cursor, "1")
+
+        finally:
+            ldb.close()
+
+        self.assertEqual(("1", "Jake Enoch", 5), test77, "Test77 Failed: Rolled Back Batch Not Cached")
+        self.assertEqual(("1", "Jake Enoch", 8), test78, "Test78 Failed: Cache Invalidated On Batch Commit")
@@ -0,0 +1,60 @@
+import logging
+import unittest
+
+from locker_controller import lock_controls
+from locker_controller import simulated_board
+from telemetry import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self) -> None:
+        metrics.reset()
+
+    def tearDown(self) -> None:
+        metrics.reset()
+
+    def test_histogram_percentiles(self) -> None:
+        for elapsed in [1000] * 98 + [1000000, 2000000]:
+            metrics.record('test.op', elapsed)
+        metrics.record('test.op', 500, ok=False)
+
+        summary = metrics.snapshot()['test.op']
+
+        self.assertEqual((101, 1), (summary['count'], summary['errors']), "Test1 Failed: Counters")
+        self.assertLessEqual(summary['p50_us'], 1.024, "Test2 Failed: p50 bucket")
+        self.assertEqual(2000.0, summary['max_us'], "Test3 Failed: Max latency")
+        self.assertEqual(101, len(metrics.recent_events()), "Test4 Failed: Ring buffer events")
+
+    def test_send_command_records_metrics(self) -> None:
+        simulated_board.install_simulated_port('SIM_METRICS')
+
+        try:
+            lock_controls.send_command('SIM_METRICS', lock_controls.get_command_frame(1, 1, 'UI')[1], 'UI')
+            lock_controls.send_command('SIM_METRICS', lock_controls.query_all_doors, 'QA')
+        finally:
+            simulated_board.remove_simulated_port('SIM_METRICS')
+
+        snapshot = metrics.snapshot()
+
+        self.assertEqual(1, snapshot['serial.UI']['count'], "Test5 Failed: UI metric")
+        self.assertEqual(1, snapshot['serial.QA']['count'], "Test6 Failed: QA metric")
+
+    def test_flush_events_through_queue_handler(self) -> None:
+        records = []
+
+        class ListHandler(logging.Handler):
+            def emit(self, record):
+                records.append(record.getMessage())
+
+        metrics.configure_logging(handler=ListHandler(), level=logging.DEBUG)
+
+        try:
+            metrics.record('test.op', 1500)
+            test7 = metrics.flush_events()
+        finally:
+            metrics.stop_logging()
+
+        self.assertEqual(1, test7, "Test7 Failed: Events flushed")
+        self.assertEqual(0, len(metrics.recent_events()), "Test8 Failed: Ring buffer drained")
+        self.assertTrue(records and records[0].endswith('test.op 1.5us ok'), "Test9 Failed: Trace log record")